@@ -1,15 +1,23 @@
+import os
+import asyncio
 import logging as logger
 import traceback
 import numpy as np
 from fastapi import FastAPI, HTTPException
 
 
-from constants import IndexType, MetricType, DIM, NUM_DATA, BD_PATH, WAL_PATH, \
-    VERSION, SNAPSHOT_FOLDER_PATH
+from constants import IndexType, MetricType, DIM, NUM_DATA, BD_PATH, WAL_PATH, VECTOR_INDEX_TYPES, \
+    VERSION, SNAPSHOT_FOLDER_PATH, SEARCH_BATCH_ENABLED, SEARCH_BATCH_MAX_SIZE, SEARCH_BATCH_WINDOW_MS, \
+    READ_POOL_SIZE, WRITE_POOL_SIZE, Durability
 from schemas import SearchRequest, SearchResponse, InsertRequest, InsertResponse \
-    , UpsertRequest, UpsertResponse, QueryRequest, QueryResponse, SnapshotResponse
+    , UpsertRequest, UpsertResponse, QueryRequest, QueryResponse, SnapshotResponse \
+    , BatchUpsertRequest, BatchUpsertResponse, BatchSearchRequest, BatchSearchResponse, SearchResult \
+    , StatsResponse, TrainRequest, TrainResponse, DeleteRequest, DeleteResponse \
+    , BulkImportRequest, BulkImportResponse
 from indexes.index_factory import IndexFactory
 from vector_database import VectorDatabase
+from search_batcher import SearchBatcher
+from executor import RequestExecutor
 
 app = FastAPI(debug=True)
 
@@ -20,30 +28,50 @@ app = FastAPI(debug=True)
 index_factory = IndexFactory()
 index_factory.init(IndexType.FLAT, DIM)
 index_factory.init(IndexType.HNSW, DIM, NUM_DATA)
+index_factory.init(IndexType.IVF_FLAT, DIM)
+index_factory.init(IndexType.IVF_PQ, DIM)
+index_factory.init(IndexType.IVF_SQ8, DIM)
 index_factory.init(IndexType.FILTER)
 
 # 初始化数据库和WAL日志
 vector_database = VectorDatabase(index_factory, BD_PATH, WAL_PATH, 
                                     SNAPSHOT_FOLDER_PATH, VERSION)
 vector_database.reload_database()
+vector_database.start_snapshot_scheduler()
+
+# 阻塞的索引和存储操作在线程池中执行，避免阻塞事件循环
+executor = RequestExecutor(READ_POOL_SIZE, WRITE_POOL_SIZE)
+
+# 可选：合并并发的 /search 请求
+search_batcher = SearchBatcher(vector_database, executor, SEARCH_BATCH_MAX_SIZE, SEARCH_BATCH_WINDOW_MS) \
+    if SEARCH_BATCH_ENABLED else None
 
 """
 注册接口
 """
 
+def get_index_type(index_type_str: str) -> IndexType:
+    """
+    解析请求中的向量索引类型
+    :param index_type_str: 索引类型字符串
+    :return: 索引类型
+    """
+    for index_type in VECTOR_INDEX_TYPES:
+        if index_type_str == index_type.value:
+            return index_type
+    raise HTTPException(status_code=400, detail="Invalid index type")
+
+
 @app.post("/search", response_model=SearchResponse)
 async def search(request: SearchRequest):
     try:
-        match request.index_type:
-            case IndexType.FLAT.value:
-                index_type = IndexType.FLAT
-            case IndexType.HNSW.value:
-                index_type = IndexType.HNSW
-            case _:
-                raise HTTPException(status_code=400, detail="Invalid index type")
+        index_type = get_index_type(request.index_type)
 
 
-        ids, distances = vector_database.search(request)
+        if search_batcher:
+            ids, distances = await search_batcher.search(request)
+        else:
+            ids, distances = await executor.run_read(vector_database.search, request)
         # index = index_factory.get_index(index_type)
         # if not index:
         #     raise HTTPException(status_code=400, detail="Index not initialized")
@@ -62,22 +90,42 @@ async def search(request: SearchRequest):
         return SearchResponse(retcode=1, error_msg=str(e))
 
 
+@app.post("/batch_search", response_model=BatchSearchResponse)
+async def batch_search(request: BatchSearchRequest):
+    """批量搜索向量"""
+    try:
+        get_index_type(request.index_type)
+
+        results = []
+        for ids, distances in await executor.run_read(vector_database.search_batch, request):
+            valid_results = [(i, d) for i, d in zip(ids, distances) if i != -1]
+            if not valid_results:
+                results.append(SearchResult())
+                continue
+            result_ids, result_distances = zip(*valid_results)
+            results.append(SearchResult(vectors=list(result_ids), distances=list(result_distances)))
+        return BatchSearchResponse(results=results)
+
+    except Exception as e:
+        print(traceback.format_exc())
+        return BatchSearchResponse(retcode=1, error_msg=str(e))
+
+
 @app.post("/insert", response_model=InsertResponse)
 async def insert(request: InsertRequest):
     try:
-        match request.index_type:
-            case IndexType.FLAT.value:
-                index_type = IndexType.FLAT
-            case IndexType.HNSW.value:
-                index_type = IndexType.HNSW
-            case _:
-                raise HTTPException(status_code=400, detail="Invalid index type")
+        index_type = get_index_type(request.index_type)
 
         index = index_factory.get_index(index_type)
         if not index:
             raise HTTPException(status_code=400, detail="Index not initialized")
 
-        index.insert_vectors(request.vectors, request.id)
+        def write():
+            vector_database.materialize_index(index_type)
+            with vector_database.rw_lock.write_lock():
+                index.insert_vectors(request.vectors, request.id)
+
+        await executor.run_write(write)
         return InsertResponse()
 
     except Exception as e:
@@ -89,17 +137,22 @@ async def upsert(request: UpsertRequest):
     """更新或插入向量"""
     try:
         # 获取索引类型
-        match request.index_type:
-            case IndexType.FLAT.value:
-                index_type = IndexType.FLAT
-            case IndexType.HNSW.value:
-                index_type = IndexType.HNSW
-            case _:
-                raise HTTPException(status_code=400, detail="Invalid index type")
-
-        vector_database.write_wal_log("upsert", request.dict())
-        # 执行更新插入
-        vector_database.upsert(request.id, request.dict(), index_type)
+        index_type = get_index_type(request.index_type)
+
+        json_data = request.dict(exclude={"durability"})
+
+        def write():
+            # 内存映射的索引在写锁外读入内存
+            vector_database.materialize_index(index_type)
+            # WAL 和索引更新在同一个写锁内完成，保证快照与 WAL 位置一致
+            with vector_database.rw_lock.write_lock():
+                committed = vector_database.write_wal_log("upsert", json_data, request.durability)
+                # 执行更新插入
+                vector_database.upsert(request.id, json_data, index_type)
+            return committed
+
+        # 在写锁外等待 WAL 落盘，等待期间后续写入可以进入同一组提交
+        await asyncio.wrap_future(await executor.run_write(write))
         return UpsertResponse()
 
     except Exception as e:
@@ -107,12 +160,59 @@ async def upsert(request: UpsertRequest):
         return UpsertResponse(retcode=1, error_msg=str(e))
 
 
+@app.post("/batch_upsert", response_model=BatchUpsertResponse)
+async def batch_upsert(request: BatchUpsertRequest):
+    """批量更新或插入向量"""
+    try:
+        index_type = get_index_type(request.index_type)
+
+        json_data = request.dict(exclude={"durability"})
+
+        def write():
+            vector_database.materialize_index(index_type)
+            with vector_database.rw_lock.write_lock():
+                # 整个批次只写一条WAL日志
+                committed = vector_database.write_wal_log("batch_upsert", json_data, request.durability)
+                vector_database.upsert_batch(json_data["records"], index_type)
+            return committed
+
+        await asyncio.wrap_future(await executor.run_write(write))
+        return BatchUpsertResponse(count=len(request.records))
+
+    except Exception as e:
+        print(traceback.format_exc())
+        return BatchUpsertResponse(retcode=1, error_msg=str(e))
+
+
+@app.post("/delete", response_model=DeleteResponse)
+async def delete(request: DeleteRequest):
+    """删除向量"""
+    try:
+        index_type = get_index_type(request.index_type)
+
+        json_data = request.dict(exclude={"durability"})
+
+        def write():
+            vector_database.materialize_index(index_type)
+            with vector_database.rw_lock.write_lock():
+                committed = vector_database.write_wal_log("delete", json_data, request.durability)
+                return committed, vector_database.delete(request.ids, index_type)
+
+        committed, count = await executor.run_write(write)
+        await asyncio.wrap_future(committed)
+        return DeleteResponse(count=count)
+
+    except Exception as e:
+        print(traceback.format_exc())
+        return DeleteResponse(retcode=1, error_msg=str(e))
+
+
 @app.post("/query", response_model=QueryResponse)
 async def query(request: QueryRequest):
     """查询向量数据"""    
     try:
         # 执行查询
-        result = vector_database.query(request.id)
+        result = await executor.run_read(vector_database.query, request.id)
         if not result:
             return QueryResponse(data={})
             
@@ -123,11 +223,86 @@ async def query(request: QueryRequest):
 
 
 @app.post("/admin/snapshot", response_model=SnapshotResponse)
-async def take_snapshot():
-    """创建数据库快照"""
+async def take_snapshot(wait: bool = False):
+    """创建数据库快照，默认在后台执行并立即返回任务状态"""
+    try:
+        snapshot = await executor.run_write(vector_database.start_snapshot)
+        if wait:
+            await asyncio.wrap_future(snapshot)
+        return SnapshotResponse(data=vector_database.snapshot_status)
+    except Exception as e:
+        print(traceback.format_exc())
+        return SnapshotResponse(retcode=1, error_msg=str(e))
+
+
+@app.get("/admin/snapshot", response_model=SnapshotResponse)
+async def snapshot_status():
+    """获取快照任务状态"""
+    return SnapshotResponse(data=vector_database.snapshot_status)
+
+
+@app.post("/admin/train", response_model=TrainResponse)
+async def train(request: TrainRequest):
+    """训练 IVF 索引并热切换"""
     try:
-        vector_database.take_snapshot()
-        return SnapshotResponse()
+        index_type = get_index_type(request.index_type)
+        # 训练在维护线程中进行，写线程池照常处理写入
+        await asyncio.wrap_future(vector_database.start_training(index_type))
+        return TrainResponse()
     except Exception as e:
         print(traceback.format_exc())
-        return SnapshotResponse(retcode=1, error_msg=str(e))
\ No newline at end of file
+        return TrainResponse(retcode=1, error_msg=str(e))
+
+
+@app.post("/admin/bulk_import", response_model=BulkImportResponse)
+async def bulk_import(request: BulkImportRequest):
+    """从服务端 .npy 文件批量导入向量"""
+    try:
+        index_type = get_index_type(request.index_type)
+
+        for path in (request.path, request.labels_path):
+            if path and not os.path.exists(path):
+                raise FileNotFoundError(f"File not found: {path}")
+
+        json_data = request.dict()
+        committed = []
+
+        def log_chunk(chunk: dict) -> None:
+            # 每块在写锁内写一条 WAL，只记录文件路径、行范围和校验和，回放时重新读取并校验文件
+            committed.append(vector_database.write_wal_log("bulk_import", {**json_data, **chunk},
+                                                           Durability.FSYNC))
+
+        # 导入在独立的导入线程中按块执行，写线程池照常处理其他写入，进度见 /admin/stats
+        count = await asyncio.wrap_future(vector_database.start_bulk_import(
+            request.path, request.labels_path, request.start_id, index_type, log_chunk))
+        if committed:
+            await asyncio.wrap_future(committed[-1])
+        return BulkImportResponse(count=count)
+    except Exception as e:
+        print(traceback.format_exc())
+        return BulkImportResponse(retcode=1, error_msg=str(e))
+
+
+@app.get("/admin/stats", response_model=StatsResponse)
+async def stats():
+    """获取运行时统计信息"""
+    try:
+        data = {"search_plans": vector_database.query_planner.stats()}
+        filter_index = index_factory.get_index(IndexType.FILTER)
+        if filter_index:
+            data["filter_cache"] = filter_index.bitmap_cache.stats()
+        hnsw_index = index_factory.get_index(IndexType.HNSW)
+        if hnsw_index:
+            data["hnsw"] = hnsw_index.stats()
+        if search_batcher:
+            data["search_batcher"] = search_batcher.stats()
+        data["wal"] = vector_database.persistence.wal_stats()
+        data["recovery"] = vector_database.recovery_stats
+        data["snapshot"] = vector_database.snapshot_status
+        data["mmapped_indexes"] = [index_type.value for index_type, index in index_factory.index_map.items()
+                                   if getattr(index, "mmapped", False)]
+        if vector_database.bulk_import_progress:
+            data["bulk_import"] = vector_database.bulk_import_progress
+        return StatsResponse(data=data)
+    except Exception as e:
+        return StatsResponse(retcode=1, error_msg=str(e))
\ No newline at end of file
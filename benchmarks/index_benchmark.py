@@ -0,0 +1,298 @@
+"""
+索引召回率 / QPS 基准测试
+
+在固定随机种子生成的合成数据集上，用 FLAT 索引计算精确的 ground truth，
+对 FaissIndex / HNSWIndex / IVFIndex 扫描构建参数和搜索参数，
+输出 JSON 报告（召回率、QPS、延迟分位数、构建时间、索引大小、帕累托前沿）。
+
+用法（在仓库根目录执行）：
+    python -m benchmarks.index_benchmark --scales 10000,100000 --dims 32,128 --output report.json
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from importlib import metadata
+from typing import Any, Dict, List, Optional
+
+import faiss
+import hnswlib
+import numpy as np
+
+from constants import IndexType, MetricType, IVF_INDEX_TYPES
+from indexes.faiss_index import FaissIndex
+from indexes.hnsw_index import HNSWIndex
+from indexes.ivf_index import IVFIndex
+
+
+def parse_int_list(value: str) -> List[int]:
+    """
+    解析逗号分隔的整数列表
+    :param value: 例如 "16,32"
+    :return: 整数列表
+    """
+    return [int(item) for item in value.split(",") if item]
+
+
+def make_dataset(n: int, dim: int, nq: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    生成高斯混合分布的合成数据集，比均匀分布更接近真实 embedding 的聚簇结构
+    :param n: 数据量
+    :param dim: 向量维度
+    :param nq: 查询数量
+    :param seed: 随机种子
+    :return: (数据矩阵, 查询矩阵)
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, int(np.sqrt(n)))
+    centers = rng.normal(size=(n_clusters, dim)).astype('float32')
+
+    def sample(count: int) -> np.ndarray:
+        assignments = rng.integers(0, n_clusters, size=count)
+        noise = rng.normal(scale=0.3, size=(count, dim)).astype('float32')
+        return np.ascontiguousarray(centers[assignments] + noise, dtype='float32')
+
+    return sample(n), sample(nq)
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    当前进程的常驻内存，仅支持 Linux
+    :return: 字节数，无法获取时返回 None
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def recall_at_k(result_ids: List[List[int]], ground_truth: np.ndarray, k: int) -> float:
+    """
+    计算 recall@k
+    :param result_ids: 每个查询返回的 ID 列表
+    :param ground_truth: (nq, k) 精确最近邻
+    :param k: 最近邻数量
+    :return: 平均召回率
+    """
+    hits = sum(len(set(ids[:k]) & set(truth.tolist())) for ids, truth in zip(result_ids, ground_truth))
+    return hits / (len(ground_truth) * k)
+
+
+def measure_search(search_batch, queries: np.ndarray, k: int, ground_truth: np.ndarray,
+                   latency_queries: int) -> Dict[str, Any]:
+    """
+    测量召回率、批量 QPS 和单查询延迟分位数
+    :param search_batch: search_batch(queries, k) -> (ids, distances)
+    :param queries: (nq, d) 查询矩阵
+    :param k: 最近邻数量
+    :param ground_truth: (nq, k) 精确最近邻
+    :param latency_queries: 用于测量单查询延迟的查询数量
+    :return: 测量结果
+    """
+    start = time.perf_counter()
+    ids, _ = search_batch(queries, k)
+    batch_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in queries[:latency_queries]:
+        start = time.perf_counter()
+        search_batch(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "recall": recall_at_k(ids, ground_truth, k),
+        "qps": len(queries) / batch_seconds if batch_seconds > 0 else float("inf"),
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+        },
+    }
+
+
+def bench_flat(data: np.ndarray, queries: np.ndarray, k: int, args) -> tuple[List[Dict[str, Any]], np.ndarray]:
+    """
+    构建 FLAT 索引，计算 ground truth 并测量精确搜索的基线
+    :return: (结果列表, (nq, k) ground truth)
+    """
+    labels = np.arange(len(data), dtype='int64')
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    index = FaissIndex(data.shape[1], MetricType.L2)
+    index.insert_vectors_batch(data, labels)
+    build_seconds = time.perf_counter() - start
+    rss_after = rss_bytes()
+
+    ground_truth = np.array(index.search_vectors_batch(queries, k)[0], dtype='int64')
+    result = {
+        "index": IndexType.FLAT.value,
+        "build_params": {},
+        "search_params": {},
+        "build_seconds": build_seconds,
+        "index_bytes": int(faiss.serialize_index(index.index).nbytes),
+        "rss_delta_bytes": rss_after - rss_before if rss_before is not None else None,
+        **measure_search(lambda q, kk: index.search_vectors_batch(q, kk), queries, k, ground_truth,
+                         args.latency_queries),
+    }
+    return [result], ground_truth
+
+
+def bench_hnsw(data: np.ndarray, queries: np.ndarray, k: int, ground_truth: np.ndarray,
+               args) -> List[Dict[str, Any]]:
+    """
+    扫描 HNSW 的 M、ef_construction 和 ef
+    :return: 结果列表
+    """
+    results = []
+    labels = np.arange(len(data), dtype='int64')
+    for M in args.hnsw_m:
+        for ef_construction in args.hnsw_ef_construction:
+            rss_before = rss_bytes()
+            start = time.perf_counter()
+            index = HNSWIndex(data.shape[1], len(data), MetricType.L2, M, ef_construction)
+            index.bulk_build(data, labels)
+            build_seconds = time.perf_counter() - start
+            rss_after = rss_bytes()
+
+            for ef in args.hnsw_ef:
+                results.append({
+                    "index": IndexType.HNSW.value,
+                    "build_params": {"M": M, "ef_construction": ef_construction},
+                    "search_params": {"ef": ef},
+                    "build_seconds": build_seconds,
+                    "index_bytes": int(index.index.index_file_size()),
+                    "rss_delta_bytes": rss_after - rss_before if rss_before is not None else None,
+                    **measure_search(lambda q, kk: index.search_vectors_batch(q, kk, None, ef),
+                                     queries, k, ground_truth, args.latency_queries),
+                })
+            del index
+    return results
+
+
+def bench_ivf(index_type: IndexType, data: np.ndarray, queries: np.ndarray, k: int,
+              ground_truth: np.ndarray, args) -> List[Dict[str, Any]]:
+    """
+    扫描 IVF 的 nlist 和 nprobe
+    :return: 结果列表
+    """
+    results = []
+    labels = np.arange(len(data), dtype='int64')
+    nlists = args.ivf_nlist or [max(1, int(4 * np.sqrt(len(data))))]
+    for nlist in nlists:
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        # train_size 大于数据量，插入时不会自动训练，插入完成后再显式训练
+        index = IVFIndex(data.shape[1], index_type, MetricType.L2, nlist, args.ivf_pq_m,
+                         len(data) + 1, args.ivf_nprobe[0])
+        index.insert_vectors_batch(data, labels)
+        index.swap(index.populate(index.train(data[:max(args.ivf_train_size, nlist)])))
+        build_seconds = time.perf_counter() - start
+        rss_after = rss_bytes()
+
+        for nprobe in args.ivf_nprobe:
+            if nprobe > nlist:
+                continue
+            results.append({
+                "index": index_type.value,
+                "build_params": {"nlist": nlist, "pq_m": index.pq_m} if index_type == IndexType.IVF_PQ
+                else {"nlist": nlist},
+                "search_params": {"nprobe": nprobe},
+                "build_seconds": build_seconds,
+                "index_bytes": int(faiss.serialize_index(index.index).nbytes),
+                "rss_delta_bytes": rss_after - rss_before if rss_before is not None else None,
+                **measure_search(lambda q, kk: index.search_vectors_batch(q, kk, None, nprobe),
+                                 queries, k, ground_truth, args.latency_queries),
+            })
+        del index
+    return results
+
+
+def mark_pareto(results: List[Dict[str, Any]]) -> None:
+    """
+    标记召回率 / QPS 帕累托前沿：没有其他配置在两项上都不差且至少一项更好
+    :param results: 同一数据集上的结果列表，原地添加 pareto 字段
+    """
+    for result in results:
+        result["pareto"] = not any(
+            other["recall"] >= result["recall"] and other["qps"] >= result["qps"]
+            and (other["recall"] > result["recall"] or other["qps"] > result["qps"])
+            for other in results
+        )
+
+
+def run(args) -> Dict[str, Any]:
+    """
+    执行全部数据集和索引的基准测试
+    :param args: 命令行参数
+    :return: 报告
+    """
+    report = {
+        "meta": {
+            "seed": args.seed,
+            "k": args.k,
+            "nq": args.nq,
+            "cpu_count": os.cpu_count(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "faiss": faiss.__version__,
+            "hnswlib": metadata.version("hnswlib"),
+        },
+        "datasets": [],
+    }
+    index_types = [IndexType(value) for value in args.indexes]
+
+    for n in args.scales:
+        for dim in args.dims:
+            data, queries = make_dataset(n, dim, args.nq, args.seed)
+            results, ground_truth = bench_flat(data, queries, args.k, args)
+            if IndexType.FLAT not in index_types:
+                results = []
+            if IndexType.HNSW in index_types:
+                results += bench_hnsw(data, queries, args.k, ground_truth, args)
+            for index_type in index_types:
+                if index_type in IVF_INDEX_TYPES:
+                    results += bench_ivf(index_type, data, queries, args.k, ground_truth, args)
+
+            mark_pareto(results)
+            report["datasets"].append({"n": n, "dim": dim, "results": results})
+            for result in results:
+                print(f"n={n} dim={dim} {result['index']:<8} {json.dumps(result['build_params'])} "
+                      f"{json.dumps(result['search_params'])} recall={result['recall']:.4f} "
+                      f"qps={result['qps']:.0f} p99={result['latency_ms']['p99']:.3f}ms "
+                      f"build={result['build_seconds']:.2f}s{' *' if result['pareto'] else ''}")
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall/QPS benchmark for lvdb indexes")
+    parser.add_argument("--scales", type=parse_int_list, default=[10000, 100000])
+    parser.add_argument("--dims", type=parse_int_list, default=[32, 128])
+    parser.add_argument("--nq", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--indexes", type=lambda value: value.split(","),
+                        default=["FLAT", "HNSW", "IVF_FLAT", "IVF_PQ", "IVF_SQ8"])
+    parser.add_argument("--hnsw-m", type=parse_int_list, default=[16, 32])
+    parser.add_argument("--hnsw-ef-construction", type=parse_int_list, default=[100, 200])
+    parser.add_argument("--hnsw-ef", type=parse_int_list, default=[16, 32, 64, 128, 256])
+    parser.add_argument("--ivf-nlist", type=parse_int_list, default=None,
+                        help="默认 4 * sqrt(n)")
+    parser.add_argument("--ivf-nprobe", type=parse_int_list, default=[1, 4, 16, 64])
+    parser.add_argument("--ivf-pq-m", type=int, default=8)
+    parser.add_argument("--ivf-train-size", type=int, default=50000)
+    parser.add_argument("--latency-queries", type=int, default=200,
+                        help="逐条搜索以测量延迟分位数的查询数量")
+    parser.add_argument("--output", default="index_benchmark.json")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
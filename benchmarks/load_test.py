@@ -0,0 +1,314 @@
+"""
+HTTP 端到端压测
+
+异步并发地向 /search、/upsert、/query 发送混合请求，覆盖请求解析、JSON 编码、
+WAL 写入、过滤和索引搜索的完整路径，输出各接口的 QPS、延迟分位数和延迟直方图。
+
+默认在进程内通过 ASGI 直接调用 app（使用临时目录存放数据），也可以用 --url 压测本地 uvicorn：
+    python -m benchmarks.load_test --dims 32,128 --concurrency 32 --duration 20
+    python -m benchmarks.load_test --url http://localhost:8000 --dims 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+
+# 延迟直方图的桶上界（毫秒）
+HISTOGRAM_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def parse_list(value: str, cast=float) -> list:
+    """
+    解析逗号分隔的列表
+    :param value: 例如 "0.01,0.1"
+    :param cast: 元素类型
+    :return: 列表
+    """
+    return [cast(item) for item in value.split(",") if item]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """
+    解析请求比例，例如 "search=80,upsert=15,query=5"
+    :param value: 比例字符串
+    :return: 接口到权重的映射
+    """
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def filter_field(selectivity: float) -> tuple[str, int]:
+    """
+    每种选择性对应一个字段：字段值为 id % cardinality，过滤值 0 命中约 1 / cardinality 的数据
+    :param selectivity: 过滤命中比例
+    :return: (字段名, cardinality)
+    """
+    cardinality = max(1, round(1 / selectivity))
+    return f"f{cardinality}", cardinality
+
+
+class LatencyRecorder:
+    """按标签记录请求延迟和错误数"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, label: str, latency_ms: float, ok: bool) -> None:
+        self.latencies[label].append(latency_ms)
+        if not ok:
+            self.errors[label] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        """
+        汇总每个标签的 QPS、延迟分位数和直方图
+        :param elapsed: 压测持续时间（秒）
+        :return: 汇总结果
+        """
+        result = {}
+        for label, latencies in sorted(self.latencies.items()):
+            values = np.array(latencies)
+            counts = np.histogram(values, bins=[0] + HISTOGRAM_BUCKETS_MS + [float("inf")])[0]
+            result[label] = {
+                "count": len(values),
+                "errors": self.errors[label],
+                "qps": len(values) / elapsed if elapsed > 0 else 0.0,
+                "latency_ms": {
+                    "mean": float(values.mean()),
+                    "p50": float(np.percentile(values, 50)),
+                    "p90": float(np.percentile(values, 90)),
+                    "p99": float(np.percentile(values, 99)),
+                    "max": float(values.max()),
+                },
+                "histogram_ms": {
+                    f"<={bound}": int(count) for bound, count in zip(HISTOGRAM_BUCKETS_MS, counts)
+                } | {f">{HISTOGRAM_BUCKETS_MS[-1]}": int(counts[-1])},
+            }
+        return result
+
+
+def make_record(id: int, dim: int, rng: random.Random, selectivities: List[float]) -> Dict[str, Any]:
+    """
+    生成一条 upsert 记录，包含每种选择性对应的过滤字段
+    :param id: 记录ID
+    :param dim: 向量维度
+    :param rng: 随机数生成器
+    :param selectivities: 过滤选择性列表
+    :return: 记录
+    """
+    record = {"id": id, "vectors": [rng.random() for _ in range(dim)]}
+    for selectivity in selectivities:
+        field_name, cardinality = filter_field(selectivity)
+        record[field_name] = id % cardinality
+    return record
+
+
+async def preload(client: httpx.AsyncClient, args, dim: int) -> None:
+    """
+    通过 /batch_upsert 预先写入数据
+    :param client: HTTP 客户端
+    :param args: 命令行参数
+    :param dim: 向量维度
+    """
+    rng = random.Random(args.seed)
+    for start in range(0, args.preload, args.preload_batch):
+        records = [make_record(id, dim, rng, args.selectivities)
+                   for id in range(start, min(start + args.preload_batch, args.preload))]
+        response = await client.post("/batch_upsert", json={"index_type": args.index_type, "records": records})
+        response.raise_for_status()
+        if response.json().get("retcode", 0) != 0:
+            raise RuntimeError(f"Preload failed: {response.json()}")
+
+
+async def worker(client: httpx.AsyncClient, args, dim: int, recorder: LatencyRecorder,
+                 deadline: float, seed: int) -> None:
+    """
+    按比例循环发送请求直到截止时间
+    :param client: HTTP 客户端
+    :param args: 命令行参数
+    :param dim: 向量维度
+    :param recorder: 延迟记录器
+    :param deadline: 截止时间（perf_counter）
+    :param seed: 该 worker 的随机种子
+    """
+    rng = random.Random(seed)
+    names = list(args.mix.keys())
+    weights = list(args.mix.values())
+    id_space = max(args.preload * 2, 1)
+    # None 表示不带过滤条件
+    selectivities: List[Optional[float]] = [None] + list(args.selectivities)
+
+    while time.perf_counter() < deadline:
+        op = rng.choices(names, weights)[0]
+        label = op
+        if op == "search":
+            body = {"vectors": [rng.random() for _ in range(dim)], "k": args.k, "index_type": args.index_type}
+            selectivity = rng.choice(selectivities)
+            if selectivity is not None:
+                field_name, _ = filter_field(selectivity)
+                body["filter"] = {"fieldName": field_name, "op": "=", "value": 0}
+                label = f"search[filter={selectivity}]"
+            path = "/search"
+        elif op == "upsert":
+            body = {**make_record(rng.randrange(id_space), dim, rng, args.selectivities),
+                    "index_type": args.index_type}
+            path = "/upsert"
+        elif op == "query":
+            body = {"id": rng.randrange(id_space)}
+            path = "/query"
+        else:
+            raise ValueError(f"Unknown operation: {op}")
+
+        start = time.perf_counter()
+        try:
+            response = await client.post(path, json=body)
+            ok = response.status_code == 200 and response.json().get("retcode", 0) == 0
+        except httpx.HTTPError:
+            ok = False
+        recorder.record(label, (time.perf_counter() - start) * 1000, ok)
+
+
+async def run_load(client: httpx.AsyncClient, args, dim: int) -> Dict[str, Any]:
+    """
+    预写入数据后以指定并发运行混合负载
+    :param client: HTTP 客户端
+    :param args: 命令行参数
+    :param dim: 向量维度
+    :return: 该维度的压测结果
+    """
+    await preload(client, args, dim)
+
+    recorder = LatencyRecorder()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*[
+        worker(client, args, dim, recorder, deadline, args.seed + i) for i in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(latencies) for latencies in recorder.latencies.values())
+    return {
+        "dim": dim,
+        "elapsed_seconds": elapsed,
+        "total_requests": total,
+        "total_qps": total / elapsed if elapsed > 0 else 0.0,
+        "operations": recorder.summary(elapsed),
+    }
+
+
+async def run_in_process(args, dim: int) -> Dict[str, Any]:
+    """
+    在进程内通过 ASGI 调用 app，数据写入临时目录
+    :param args: 命令行参数
+    :param dim: 向量维度
+    :return: 该维度的压测结果
+    """
+    os.chdir(tempfile.mkdtemp(prefix="lvdb-load-"))
+    # app 在导入时按 constants 初始化索引，必须先设置维度
+    import constants
+    constants.DIM = dim
+    constants.SEARCH_BATCH_ENABLED = args.search_batch
+    import app
+
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://lvdb", timeout=args.timeout) as client:
+        return await run_load(client, args, dim)
+
+
+async def run_remote(args, dim: int) -> Dict[str, Any]:
+    """
+    压测已启动的服务
+    :param args: 命令行参数
+    :param dim: 向量维度，需与服务端 DIM 一致
+    :return: 该维度的压测结果
+    """
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await run_load(client, args, dim)
+
+
+def run_child(dim: int) -> Dict[str, Any]:
+    """
+    app 是模块级单例，每个维度在独立子进程中运行
+    :param dim: 向量维度
+    :return: 子进程的压测结果
+    """
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    command = [sys.executable, "-m", "benchmarks.load_test", *sys.argv[1:], "--dims", str(dim), "--output", output]
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [repo_root, os.environ.get("PYTHONPATH")]))}
+    subprocess.run(command, check=True, env=env)
+    with open(output) as f:
+        return json.load(f)["results"][0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="HTTP load test for lvdb")
+    parser.add_argument("--url", default=None, help="压测已启动的服务，默认在进程内运行 app")
+    parser.add_argument("--dims", type=lambda value: parse_list(value, int), default=[32])
+    parser.add_argument("--index-type", default="FLAT")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="每个维度的压测时长（秒）")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("search=80,upsert=15,query=5"))
+    parser.add_argument("--selectivities", type=parse_list, default=[0.01, 0.1, 0.5],
+                        help="过滤条件的命中比例，search 在不过滤和这些选择性之间随机选择")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--preload", type=int, default=10000)
+    parser.add_argument("--preload-batch", type=int, default=1000)
+    parser.add_argument("--search-batch", action="store_true", help="进程内运行时开启 /search 合批")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="load_test.json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    if args.url is None and len(args.dims) > 1:
+        results = [run_child(dim) for dim in args.dims]
+    else:
+        runner = run_remote if args.url else run_in_process
+        results = [asyncio.run(runner(args, dim)) for dim in args.dims]
+
+    report = {
+        "config": {
+            "url": args.url,
+            "index_type": args.index_type,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+            "selectivities": args.selectivities,
+            "k": args.k,
+            "preload": args.preload,
+            "search_batch": args.search_batch,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for result in results:
+        print(f"dim={result['dim']} total_qps={result['total_qps']:.0f}")
+        for label, summary in result["operations"].items():
+            latency = summary["latency_ms"]
+            print(f"  {label:<24} n={summary['count']:<7} err={summary['errors']:<4} qps={summary['qps']:<8.0f} "
+                  f"p50={latency['p50']:.2f}ms p99={latency['p99']:.2f}ms max={latency['max']:.2f}ms")
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import os
 from enum import Enum
 
 
@@ -7,17 +8,86 @@ WAL_PATH = "wal.log"
 SNAPSHOT_FOLDER_PATH = ".snapshots"
 SNAPSHOTS_MAX_LOG_ID = "snapshots_max_log_id"
 
+# WAL 默认持久化级别（none / flush / fsync，可按请求覆盖）和组提交等待时间
+WAL_DURABILITY = "flush"
+WAL_GROUP_COMMIT_WINDOW_MS = 0
+# WAL 分段：当前段达到大小或记录数上限（0 表示不限制）后切换到新段
+WAL_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+WAL_SEGMENT_MAX_RECORDS = 0
+# 被快照覆盖的段移动到该目录归档，为空时直接删除
+WAL_ARCHIVE_FOLDER_PATH = ""
+# 启动回放 WAL：每批最多合并的记录数、解析线程与回放线程之间的队列长度
+WAL_REPLAY_BATCH_SIZE = 10000
+WAL_REPLAY_QUEUE_SIZE = 10000
+# 自动快照：未释放的 WAL 超过该大小，或距上次快照超过该时间且有新写入时在后台创建快照（0 表示不触发）
+SNAPSHOT_WAL_MAX_BYTES = 256 * 1024 * 1024
+SNAPSHOT_INTERVAL_SECONDS = 0
+SNAPSHOT_CHECK_INTERVAL_SECONDS = 5
+# 保留的快照数量；加载快照时是否读取全部文件校验 CRC32（默认只校验文件大小）
+SNAPSHOT_KEEP_COUNT = 2
+SNAPSHOT_VERIFY_CHECKSUMS = False
+# 以内存映射方式只读加载快照中的 FLAT / IVF 索引，启动时不读入全部向量，多个进程共享页缓存；
+# 索引第一次写入时复制到内存。hnswlib 不支持内存映射，HNSW 仍完整读入
+INDEX_LOAD_MMAP = False
+
 
 DIM = 1
+# HNSW 初始容量，写满后按 HNSW_GROWTH_FACTOR 倍数扩容
 NUM_DATA = 1000
+HNSW_GROWTH_FACTOR = 2.0
+
+# 并发 /search 请求合批（micro-batching）
+SEARCH_BATCH_ENABLED = False
+SEARCH_BATCH_MAX_SIZE = 64
+SEARCH_BATCH_WINDOW_MS = 2
+
+# 阻塞操作线程池：读（搜索、查询）与写（WAL、索引更新、快照）分开
+READ_POOL_SIZE = os.cpu_count() or 4
+WRITE_POOL_SIZE = 1
+
+# 过滤查询计划：候选数不超过该值时直接精确计算
+BRUTE_FORCE_MAX_CANDIDATES = 2048
+# 过滤条件命中比例不低于该值时先搜索再过滤
+POST_FILTER_MIN_SELECTIVITY = 0.5
+# 先搜索再过滤时的额外放大系数
+POST_FILTER_OVERFETCH = 1.5
+
+# 过滤结果位图 LRU 缓存容量
+FILTER_CACHE_SIZE = 1024
+
+# IVF 索引：倒排列表数量、PQ 子空间数量、自动训练所需向量数、默认 nprobe
+IVF_NLIST = 100
+IVF_PQ_M = 8
+IVF_TRAIN_SIZE = 10000
+IVF_NPROBE = 8
+
+# HNSW 默认搜索深度，可被请求中的 ef 覆盖；批量查询时 knn_query 使用的线程数
+HNSW_EF_SEARCH = 50
+HNSW_BATCH_SEARCH_THREADS = os.cpu_count() or 4
+
+# 批量导入：每块向量数量、HNSW add_items 线程数
+BULK_IMPORT_CHUNK_SIZE = 100000
+BULK_IMPORT_THREADS = os.cpu_count() or 4
+
+# HNSW 墓碑数量和比例同时超过阈值时，在后台用存活向量重建图
+HNSW_COMPACT_MIN_TOMBSTONES = 1000
+HNSW_COMPACT_TOMBSTONE_RATIO = 0.3
 
 class IndexType(Enum):
     FLAT = "FLAT"
     HNSW = "HNSW"
+    IVF_FLAT = "IVF_FLAT"
+    IVF_PQ = "IVF_PQ"
+    IVF_SQ8 = "IVF_SQ8"
     FILTER = "FILTER"
     UNKNOWN = "UNKNOWN"
 
 
+# 可用于向量搜索的索引类型
+VECTOR_INDEX_TYPES = (IndexType.FLAT, IndexType.HNSW, IndexType.IVF_FLAT, IndexType.IVF_PQ, IndexType.IVF_SQ8)
+IVF_INDEX_TYPES = (IndexType.IVF_FLAT, IndexType.IVF_PQ, IndexType.IVF_SQ8)
+
+
 class MetricType(Enum):
     L2 = "L2"
     IP = "IP"
@@ -27,3 +97,22 @@ class MetricType(Enum):
 class Operation(Enum):
     EQUAL = "eq"
     NOT_EQUAL = "ne"
+    GREATER = "gt"
+    GREATER_EQUAL = "ge"
+    LESS = "lt"
+    LESS_EQUAL = "le"
+    EXISTS = "exists"
+    NOT_EXISTS = "not_exists"
+
+
+class Durability(Enum):
+    NONE = "none"
+    FLUSH = "flush"
+    FSYNC = "fsync"
+
+
+class SearchPlan(Enum):
+    NO_FILTER = "no_filter"
+    BRUTE_FORCE = "brute_force"
+    IN_INDEX_FILTER = "in_index_filter"
+    POST_FILTER = "post_filter"
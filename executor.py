@@ -0,0 +1,46 @@
+import asyncio
+import logging as logger
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+
+class RequestExecutor:
+    """
+    将阻塞的索引搜索和 RocksDB/WAL 读写从事件循环卸载到线程池。
+    faiss 和 hnswlib 在搜索时释放 GIL，因此读线程池可以利用多核；
+    读写使用独立线程池，写入高峰不会挤占搜索线程。
+    """
+
+    def __init__(self, read_workers: int, write_workers: int):
+        """
+        初始化线程池
+        :param read_workers: 读线程数（搜索、查询）
+        :param write_workers: 写线程数（WAL、索引更新、快照）
+        """
+        self.read_pool = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="lvdb-read")
+        self.write_pool = ThreadPoolExecutor(max_workers=write_workers, thread_name_prefix="lvdb-write")
+        logger.info(f"RequestExecutor started: read_workers={read_workers}, write_workers={write_workers}")
+
+    async def run_read(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        在读线程池中执行
+        :param fn: 要执行的函数
+        :return: 函数返回值
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.read_pool, partial(fn, *args, **kwargs))
+
+    async def run_write(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        在写线程池中执行
+        :param fn: 要执行的函数
+        :return: 函数返回值
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.write_pool, partial(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        """关闭线程池，等待已提交的任务完成"""
+        self.read_pool.shutdown(wait=True)
+        self.write_pool.shutdown(wait=True)
@@ -0,0 +1,165 @@
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+from pyroaring import BitMap
+
+from constants import Operation
+
+
+# 单个谓词：(字段名, 操作类型, 比较值)
+Predicate = Tuple[str, Operation, Any]
+
+
+def predicate_matches(op: Operation, predicate_value: Any, value: Optional[int]) -> bool:
+    """
+    判断字段取值是否满足谓词
+    :param op: 操作类型
+    :param predicate_value: 谓词中的比较值
+    :param value: 字段取值，None 表示文档没有该字段
+    :return: 是否满足
+    """
+    if op == Operation.NOT_EXISTS:
+        return value is None
+    if value is None:
+        return False
+    match op:
+        case Operation.EQUAL:
+            return value == predicate_value
+        case Operation.NOT_EQUAL:
+            return value != predicate_value
+        case Operation.GREATER:
+            return value > predicate_value
+        case Operation.GREATER_EQUAL:
+            return value >= predicate_value
+        case Operation.LESS:
+            return value < predicate_value
+        case Operation.LESS_EQUAL:
+            return value <= predicate_value
+        case _:
+            return True
+
+
+class BitmapCache:
+    """
+    过滤结果位图的 LRU 缓存。
+    每个缓存项记录它依赖的谓词，字段更新时只淘汰结果会发生变化的缓存项。
+    """
+
+    def __init__(self, capacity: int):
+        """
+        初始化
+        :param capacity: 最多缓存的位图数量，0 表示不缓存
+        """
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        # 键 -> (位图, 依赖的谓词, 是否依赖存活ID位图)
+        self._entries: OrderedDict[str, Tuple[BitMap, List[Predicate], bool]] = OrderedDict()
+        # 字段名 -> 依赖该字段的缓存键
+        self._field_keys: Dict[str, Set[str]] = defaultdict(set)
+        self._live_keys: Set[str] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[BitMap]:
+        """
+        获取缓存的位图，调用方不能修改返回的位图
+        :param key: 规范化的过滤条件键
+        :return: 位图，未命中返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, bitmap: BitMap, predicates: List[Predicate], depends_on_live_ids: bool) -> None:
+        """
+        写入缓存
+        :param key: 规范化的过滤条件键
+        :param bitmap: 结果位图
+        :param predicates: 结果依赖的谓词
+        :param depends_on_live_ids: 结果是否依赖存活ID位图
+        """
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (bitmap, predicates, depends_on_live_ids)
+            for field_name, _, _ in predicates:
+                self._field_keys[field_name].add(key)
+            if depends_on_live_ids:
+                self._live_keys.add(key)
+            while len(self._entries) > self.capacity:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_field(self, field_name: str, old_value: Optional[int], new_value: Optional[int]) -> None:
+        """
+        某个文档的字段从 old_value 变为 new_value 时，淘汰结果会变化的缓存项
+        :param field_name: 字段名
+        :param old_value: 旧值，None 表示原来没有该字段
+        :param new_value: 新值，None 表示删除该字段
+        """
+        with self._lock:
+            for key in list(self._field_keys.get(field_name, ())):
+                _, predicates, _ = self._entries[key]
+                for predicate_field, op, predicate_value in predicates:
+                    if predicate_field != field_name:
+                        continue
+                    if predicate_matches(op, predicate_value, old_value) != \
+                            predicate_matches(op, predicate_value, new_value):
+                        self._remove(key)
+                        self.invalidations += 1
+                        break
+
+    def invalidate_live_ids(self) -> None:
+        """存活ID集合变化时，淘汰依赖它的缓存项"""
+        with self._lock:
+            for key in list(self._live_keys):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._field_keys.clear()
+            self._live_keys.clear()
+
+    def _remove(self, key: str) -> None:
+        """
+        删除缓存项及其依赖记录，调用方需持有锁
+        :param key: 缓存键
+        """
+        _, predicates, _ = self._entries.pop(key)
+        for field_name, _, _ in predicates:
+            keys = self._field_keys.get(field_name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._field_keys[field_name]
+        self._live_keys.discard(key)
+
+    def stats(self) -> dict:
+        """
+        获取缓存统计信息
+        :return: 统计信息字典
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def squared_l2(queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """
+    计算查询与候选向量之间的平方 L2 距离（与 faiss/hnswlib 的 L2 一致）
+    :param queries: (nq, d) 查询矩阵
+    :param vectors: (n, d) 候选向量矩阵
+    :return: (nq, n) 距离矩阵
+    """
+    distances = (queries * queries).sum(axis=1, keepdims=True) \
+        - 2.0 * queries @ vectors.T \
+        + (vectors * vectors).sum(axis=1)[np.newaxis, :]
+    return np.maximum(distances, 0.0)
+
+
+def top_k(distances: np.ndarray, labels: np.ndarray, k: int,
+          descending: bool = False) -> tuple[list[list[int]], list[list[float]]]:
+    """
+    从距离矩阵中选出每行的 top-k，不足 k 个时用 (-1, 0) 填充
+    :param distances: (nq, n) 距离矩阵
+    :param labels: 长度为 n 的标签数组
+    :param k: 返回数量
+    :param descending: 是否按距离从大到小排序（内积）
+    :return: (ids, distances) 元组，每个元素为 nq 个结果列表
+    """
+    nq, n = distances.shape
+    kk = min(k, n)
+    scores = -distances if descending else distances
+
+    all_ids, all_distances = [], []
+    for row_scores, row_distances in zip(scores, distances):
+        if kk == 0:
+            order = np.empty(0, dtype=np.int64)
+        else:
+            candidates = np.argpartition(row_scores, kk - 1)[:kk] if kk < n else np.arange(n)
+            order = candidates[np.argsort(row_scores[candidates], kind='stable')]
+        result_ids = labels[order].tolist() + [-1] * (k - kk)
+        result_distances = row_distances[order].tolist() + [0.0] * (k - kk)
+        all_ids.append(result_ids)
+        all_distances.append(result_distances)
+
+    return all_ids, all_distances
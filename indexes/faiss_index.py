@@ -1,57 +1,105 @@
 import os
+import copy
 import pickle
 import logging as logger
 import faiss
 import numpy as np
+from typing import Optional
+from pyroaring import BitMap
 from constants import MetricType
+from indexes.exact_search import squared_l2, top_k
+from indexes.index_io import read_faiss_index, materialize_faiss_index
 
 
-class RoaringBitmapIDSelector:
-    def __init__(self, bitmap):
-        self.bitmap = bitmap
+class FaissIndex:
 
-    def is_member(self, id: int) -> bool:
-        return id in self.bitmap if self.bitmap else True
+    def __init__(self, dim: int, metric_type: MetricType = MetricType.L2):
+        self.metric_type = metric_type
+        # 外部 ID 由 IndexIDMap2 以 int64 数组保存，删除后不会发生内部 ID 漂移
+        self.index = faiss.IndexIDMap2(self._new_flat_index(dim))
+        self.labels = BitMap()
+        # 以内存映射方式加载的索引是只读的，第一次写入前从 file_path 重新读入内存
+        self.mmapped = False
+        self.file_path: Optional[str] = None
 
+    @property
+    def dim(self) -> int:
+        """向量维度"""
+        return self.index.d
 
-class FaissIndex:
+    def load_writable(self):
+        """
+        读出内存映射索引的可写副本，不修改当前索引，可以在写锁外调用
+        :return: 内存中的 faiss 索引，索引已经可写时为 None
+        """
+        if not self.mmapped:
+            return None
+        logger.info(f"Copying memory-mapped flat index with {self.index.ntotal} vectors into memory")
+        return materialize_faiss_index(self.index, self.file_path)
 
-    def __init__(self, dim: int, metric_type: MetricType = MetricType.L2):
-        if metric_type == MetricType.L2:
-            self.index = faiss.IndexFlatL2(dim)
-        else:
-            self.index = faiss.IndexFlatIP(dim)
-        self.id_map = {}
-        self.reverse_id_map = {}
+    def adopt_writable(self, index) -> None:
+        """
+        替换为 load_writable 读出的副本，需要在写锁内调用；期间索引已被替换（如训练切换）时丢弃副本
+        :param index: load_writable 的返回值
+        """
+        if self.mmapped and index is not None:
+            self.index = index
+            self.mmapped = False
+
+    def _ensure_writable(self) -> None:
+        """内存映射加载的索引在第一次写入前复制到内存"""
+        self.adopt_writable(self.load_writable())
+
+    def _new_flat_index(self, dim: int):
+        """
+        按度量类型创建扁平索引
+        :param dim: 向量维度
+        :return: IndexFlatL2 或 IndexFlatIP
+        """
+        if self.metric_type == MetricType.L2:
+            return faiss.IndexFlatL2(dim)
+        return faiss.IndexFlatIP(dim)
 
     def insert_vectors(self, vectors: list, label: int):
         vector = np.array(vectors).reshape(1, -1).astype('float32')
-        self.index.add(vector)
-        internal_id = self.index.ntotal - 1
-        self.id_map[internal_id] = label
-        self.reverse_id_map[label] = internal_id
+        self.insert_vectors_batch(vector, [label])
 
-    def search_vectors_(self, query: list, k: int, bitmap=None) -> tuple[list[int], list[float]]:
+    def insert_vectors_batch(self, vectors: np.ndarray, labels: list):
         """
-        搜索向量
-        :param query: 查询向量
-        :param k: 返回的最近邻数量
-        :param bitmap: 可选的位图过滤器
-        :return: (ids, distances) 元组
+        批量插入向量，已存在的标签原地覆盖，新标签一次 add_with_ids 调用
+        :param vectors: (N, d) 向量矩阵
+        :param labels: 长度为 N 的向量标签列表
         """
-        query = np.array(query).reshape(1, -1).astype('float32')
-        
-        # 创建搜索参数
-        params = None
-        if bitmap is not None:
-            logger.error(" bitmap ")
-            selector = RoaringBitmapIDSelector(bitmap)
-            params = faiss.SearchParameters(sel = selector)
+        vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(len(labels), -1)
+        labels = np.asarray(labels, dtype='int64')
+        self._ensure_writable()
+
+        existing = np.fromiter((label in self.labels for label in labels.tolist()),
+                               dtype=bool, count=len(labels))
+        if existing.any():
+            self._overwrite_vectors(vectors[existing], labels[existing])
+
+        new_labels = labels[~existing]
+        if len(new_labels):
+            self.index.add_with_ids(np.ascontiguousarray(vectors[~existing]), new_labels)
+            self.labels.update(new_labels.tolist())
 
-        distances, indices = self.index.search(query, k, params=params)
+    def _overwrite_vectors(self, vectors: np.ndarray, labels: np.ndarray):
+        """
+        直接改写扁平存储中已有标签的向量，避免 remove_ids 带来的 O(N) 压缩
+        :param vectors: (n, d) 新向量矩阵
+        :param labels: 长度为 n 的已存在标签
+        """
+        ntotal, dim = self.index.ntotal, self.index.d
+        stored_labels = faiss.rev_swig_ptr(self.index.id_map.data(), ntotal)
+        flat_index = faiss.downcast_index(self.index.index)
+        codes = faiss.rev_swig_ptr(flat_index.codes.data(), ntotal * dim * 4)
+        stored_vectors = codes.view('float32').reshape(ntotal, dim)
 
-        result_ids = [self.id_map.get(idx, -1) for idx in indices[0]]
-        return result_ids, distances[0].tolist()
+        positions = np.nonzero(np.isin(stored_labels, labels))[0]
+        order = np.argsort(labels, kind='stable')
+        sources = order[np.searchsorted(labels, stored_labels[positions], sorter=order)]
+        stored_vectors[positions] = vectors[sources]
 
     def search_vectors(self, query: list, k: int, bitmap=None) -> tuple[list[int], list[float]]:
         """
@@ -62,46 +110,98 @@ class FaissIndex:
         :return: (ids, distances) 元组
         """
         query = np.array(query).reshape(1, -1).astype('float32')
-        
-        # 如果有位图过滤器，获取更多候选项以应对过滤
-        search_k = k * 2 if bitmap is not None else k
-        distances, indices = self.index.search(query, search_k)
-
-        # 应用过滤器
-        filtered_results = []
-        for idx, dist in zip(indices[0], distances[0]):
-            label = self.id_map.get(idx, None)
-            if label and (bitmap is None or label in bitmap):
-                filtered_results.append((label, dist))
-                if len(filtered_results) >= k:
-                    break
-
-        while len(filtered_results) < k:
-            filtered_results.append((-1, 0))
-
-        result_ids, distances = zip(*filtered_results)
-        return list(result_ids), list(distances)
+        result_ids, result_distances = self.search_vectors_batch(query, k, bitmap)
+        return result_ids[0], result_distances[0]
+
+    def search_vectors_batch(self, queries: np.ndarray, k: int,
+                             bitmap=None) -> tuple[list[list[int]], list[list[float]]]:
+        """
+        批量搜索向量，nq 个查询在一次 index.search 调用中完成
+        :param queries: (nq, d) 查询矩阵
+        :param k: 每个查询返回的最近邻数量
+        :param bitmap: 可选的位图过滤器，对所有查询生效
+        :return: (ids, distances) 元组，每个元素为 nq 个结果列表
+        """
+        queries = np.ascontiguousarray(queries, dtype='float32').reshape(-1, self.index.d)
+        nq = queries.shape[0]
+
+        if bitmap is None:
+            # IndexIDMap2 直接返回外部标签
+            distances, labels = self.index.search(queries, k)
+            distances[labels == -1] = 0.0
+            return labels.tolist(), distances.tolist()
+
+        # 位图过滤下推到 faiss：把外部 ID 位图转换为扁平存储位置上的 IDSelectorBitmap，
+        # 扫描时按位判断，直接跳过不匹配的向量
+        ntotal = self.index.ntotal
+        stored_labels = faiss.rev_swig_ptr(self.index.id_map.data(), ntotal) if ntotal else np.empty(0, 'int64')
+        mask = np.isin(stored_labels, np.array(bitmap.to_array(), dtype='int64'))
+        if not mask.any():
+            return [[-1] * k for _ in range(nq)], [[0.0] * k for _ in range(nq)]
+        selector = faiss.IDSelectorBitmap(np.packbits(mask, bitorder='little'))
+        distances, positions = self.index.index.search(queries, k, params=faiss.SearchParameters(sel=selector))
+        labels = np.where(positions == -1, -1, stored_labels[np.maximum(positions, 0)])
+        distances[positions == -1] = 0.0
+        return labels.tolist(), distances.tolist()
+
+    def brute_force_search(self, queries: np.ndarray, k: int,
+                           bitmap) -> tuple[list[list[int]], list[list[float]]]:
+        """
+        对位图中的向量做精确距离计算，适用于高选择性的过滤条件
+        :param queries: (nq, d) 查询矩阵
+        :param k: 每个查询返回的最近邻数量
+        :param bitmap: 外部 ID 位图
+        :return: (ids, distances) 元组，每个元素为 nq 个结果列表
+        """
+        queries = np.ascontiguousarray(queries, dtype='float32').reshape(-1, self.index.d)
+        labels = np.array((bitmap & self.labels).to_array(), dtype='int64')
+        if len(labels):
+            vectors = self.index.reconstruct_batch(labels)
+        else:
+            vectors = np.empty((0, self.index.d), dtype='float32')
+
+        distances, descending = self.exact_distances(queries, vectors)
+        return top_k(distances, labels, k, descending)
+
+    def exact_distances(self, queries: np.ndarray, vectors: np.ndarray) -> tuple[np.ndarray, bool]:
+        """
+        按索引的度量计算精确距离
+        :param queries: (nq, d) 查询矩阵
+        :param vectors: (n, d) 候选向量矩阵
+        :return: ((nq, n) 距离矩阵, 是否越大越相似)
+        """
+        if self.metric_type == MetricType.L2:
+            return squared_l2(queries, vectors), False
+        return queries @ vectors.T, True
+
+    def get_count(self) -> int:
+        """
+        获取索引中的向量数量
+        :return: 向量数量
+        """
+        return self.index.ntotal
 
     def remove_vectors(self, ids: list):
         """
         删除指定ID的向量
         :param ids: 要删除的向量ID列表
         """
-        if not hasattr(self.index, 'remove_ids'):
-            raise RuntimeError("当前索引类型不支持删除操作")
+        labels = [label for label in ids if label in self.labels]
+        if labels:
+            self._ensure_writable()
+            self.index.remove_ids(np.array(labels, dtype='int64'))
+            self.labels.difference_update(BitMap(labels))
 
-        # 将外部ID转换为内部ID
-        internal_ids = []
-        for label in ids:
-            if label in self.reverse_id_map:
-                internal_id = self.reverse_id_map[label]
-                internal_ids.append(internal_id)
-                del self.id_map[internal_id]
-                del self.reverse_id_map[label]
-
-        if internal_ids:
-            selector = faiss.IDSelectorBatch(len(internal_ids), np.array(internal_ids, dtype='int64'))
-            self.index.remove_ids(selector)
+    def freeze(self) -> "FaissIndex":
+        """
+        复制一份索引，后台快照保存副本，原索引可以继续写入
+        :return: 索引副本
+        """
+        frozen = copy.copy(self)
+        # 内存映射的索引不会被原地修改（写入前会先复制），可以直接共享
+        frozen.index = self.index if self.mmapped else faiss.clone_index(self.index)
+        frozen.labels = BitMap(self.labels)
+        return frozen
 
     def save_index(self, file_path: str) -> None:
         """
@@ -110,31 +210,51 @@ class FaissIndex:
         """
         try:
             faiss.write_index(self.index, file_path)
-            with open(f"{file_path}.map", "wb") as f:
-                pickle.dump({
-                    "id_map": self.id_map,
-                    "reverse_id_map": self.reverse_id_map
-                }, f)
         except Exception as e:
             logger.error(f"Failed to save index: {str(e)}")
             raise
 
-    def load_index(self, file_path: str) -> None:
+    def load_index(self, file_path: str, mmap: bool = False) -> None:
         """
-        从文件加载索引
+        从文件加载索引，兼容旧版 IndexFlat + pickle 映射文件的格式
         :param file_path: 索引文件路径
+        :param mmap: 是否以内存映射方式只读加载向量数据
         """
         try:
             if os.path.exists(file_path):
-                self.index = faiss.read_index(file_path)
-                if os.path.exists(f"{file_path}.map"):
-                    import pickle
-                    with open(f"{file_path}.map", "rb") as f:
-                        mapping = pickle.load(f)
-                        self.id_map = mapping["id_map"]
-                        self.reverse_id_map = mapping["reverse_id_map"]
+                index, mmapped = read_faiss_index(file_path, mmap)
+                if not isinstance(index, faiss.IndexIDMap2):
+                    index = self._migrate_legacy_index(index, f"{file_path}.map")
+                    mmapped = False
+                self.index = index
+                self.mmapped = mmapped
+                self.file_path = file_path
+                ids = faiss.rev_swig_ptr(self.index.id_map.data(), self.index.ntotal)
+                self.labels = BitMap(ids.tolist())
             else:
                 logger.warning(f"File not found: {file_path}. Skipping loading index.")
         except Exception as e:
             logger.error(f"Failed to load index: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def _migrate_legacy_index(self, flat_index, map_path: str):
+        """
+        将旧版扁平索引和 pickle 映射转换为 IndexIDMap2
+        :param flat_index: 旧版 IndexFlat
+        :param map_path: 旧版映射文件路径
+        :return: IndexIDMap2
+        """
+        id_map = {}
+        if os.path.exists(map_path):
+            with open(map_path, "rb") as f:
+                id_map = pickle.load(f)["id_map"]
+
+        internal_ids = np.array(sorted(id_map), dtype='int64')
+        internal_ids = internal_ids[internal_ids < flat_index.ntotal]
+        index = faiss.IndexIDMap2(self._new_flat_index(flat_index.d))
+        if len(internal_ids):
+            vectors = flat_index.reconstruct_batch(internal_ids)
+            labels = np.array([id_map[i] for i in internal_ids.tolist()], dtype='int64')
+            index.add_with_ids(vectors, labels)
+        logger.info(f"Migrated legacy flat index with {index.ntotal} vectors")
+        return index
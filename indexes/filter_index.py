@@ -1,17 +1,55 @@
 import base64
+import bisect
+import json
 import logging as logger
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from pyroaring import BitMap
 from collections import defaultdict
 
-from constants import Operation
+from constants import Operation, FILTER_CACHE_SIZE
+from indexes.bitmap_cache import BitmapCache, Predicate
 
 
 class FilterIndex:
-    def __init__(self):
-        """初始化过滤器索引"""
+    def __init__(self, cache_size: int = FILTER_CACHE_SIZE):
+        """
+        初始化过滤器索引
+        :param cache_size: 过滤结果位图缓存的容量
+        """
         # 使用嵌套的字典存储字段->值->位图的映射
         self.int_field_filter: Dict[str, Dict[int, BitMap]] = defaultdict(dict)
+        # 每个字段的有序取值列表，范围查询通过二分查找定位取值区间
+        self.int_field_values: Dict[str, List[int]] = defaultdict(list)
+        # 每个字段的“有该字段的全部文档”位图，取反和字段存在判断只需一次位图差运算
+        self.int_field_ids: Dict[str, BitMap] = defaultdict(BitMap)
+        # 全部存活文档ID
+        self.live_ids = BitMap()
+        # 过滤结果位图缓存，字段更新时精确失效
+        self.bitmap_cache = BitmapCache(cache_size)
+
+    def _add_value(self, field_name: str, value: int) -> BitMap:
+        """
+        为字段新增一个取值，返回该取值对应的空位图
+        :param field_name: 字段名
+        :param value: 字段值
+        :return: 新建的位图
+        """
+        bitmap = BitMap()
+        self.int_field_filter[field_name][value] = bitmap
+        bisect.insort(self.int_field_values[field_name], value)
+        return bitmap
+
+    def _remove_value(self, field_name: str, value: int) -> None:
+        """
+        删除字段的一个取值及其位图
+        :param field_name: 字段名
+        :param value: 字段值
+        """
+        del self.int_field_filter[field_name][value]
+        values = self.int_field_values[field_name]
+        pos = bisect.bisect_left(values, value)
+        if pos < len(values) and values[pos] == value:
+            del values[pos]
 
     def add_int_field_filter(self, fieldname: str, value: int, id: int) -> None:
         """
@@ -21,8 +59,9 @@ class FilterIndex:
         :param id: 文档ID
         """
         if value not in self.int_field_filter[fieldname]:
-            self.int_field_filter[fieldname][value] = BitMap()
+            self._add_value(fieldname, value)
         self.int_field_filter[fieldname][value].add(id)
+        self.int_field_ids[fieldname].add(id)
         
         logger.debug(
             f"Added int field filter: fieldname={fieldname}, value={value}, id={id}"
@@ -53,6 +92,8 @@ class FilterIndex:
                 f"old_value=None, new_value={new_value}, id={id}"
             )
 
+        self.bitmap_cache.invalidate_field(field_name, old_value, new_value)
+
         # 如果字段存在
         if field_name in self.int_field_filter:
             value_map = self.int_field_filter[field_name]
@@ -63,16 +104,90 @@ class FilterIndex:
                 
                 # 如果位图为空，删除该值的映射
                 if len(value_map[old_value]) == 0:
-                    del value_map[old_value]
+                    self._remove_value(field_name, old_value)
 
             # 处理新值
             if new_value not in value_map:
-                value_map[new_value] = BitMap()
+                self._add_value(field_name, new_value)
             value_map[new_value].add(id)
+            self.int_field_ids[field_name].add(id)
         else:
             # 如果字段不存在，直接添加新值
             self.add_int_field_filter(field_name, new_value, id)
 
+    def batch_update_int_field_filter(
+        self,
+        updates: List[Tuple[str, Optional[int], int, int]]
+    ) -> None:
+        """
+        批量更新整数字段过滤器，按 (字段, 值) 分组后对位图做批量增删
+        :param updates: (field_name, old_value, new_value, id) 元组列表
+        """
+        removals: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+        additions: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+        changes = set()
+        for field_name, old_value, new_value, id in updates:
+            if old_value is not None:
+                removals[(field_name, old_value)].append(id)
+            additions[(field_name, new_value)].append(id)
+            changes.add((field_name, old_value, new_value))
+
+        for field_name, old_value, new_value in changes:
+            self.bitmap_cache.invalidate_field(field_name, old_value, new_value)
+
+        for (field_name, value), ids in removals.items():
+            value_map = self.int_field_filter.get(field_name)
+            if value_map is None or value not in value_map:
+                continue
+            value_map[value].difference_update(BitMap(ids))
+            if len(value_map[value]) == 0:
+                self._remove_value(field_name, value)
+
+        for (field_name, value), ids in additions.items():
+            value_map = self.int_field_filter[field_name]
+            if value not in value_map:
+                self._add_value(field_name, value)
+            bitmap = BitMap(ids)
+            value_map[value].update(bitmap)
+            self.int_field_ids[field_name].update(bitmap)
+
+        logger.debug(
+            f"Batch updated int field filter: removals={len(removals)}, additions={len(additions)}"
+        )
+
+    def add_live_ids(self, ids: List[int]) -> None:
+        """
+        记录存活的文档ID
+        :param ids: 文档ID列表
+        """
+        new_ids = BitMap(ids) - self.live_ids
+        if new_ids:
+            self.live_ids |= new_ids
+            self.bitmap_cache.invalidate_live_ids()
+
+    def remove_ids(self, ids: List[int]) -> None:
+        """
+        删除文档：从所有字段取值位图和存活ID中移除，不依赖文档原有的字段值
+        :param ids: 文档ID列表
+        """
+        removed = BitMap(ids)
+        for field_name, field_ids in self.int_field_ids.items():
+            hit = field_ids & removed
+            if not hit:
+                continue
+            field_ids.difference_update(hit)
+            value_map = self.int_field_filter[field_name]
+            for value in [value for value, bitmap in value_map.items() if bitmap.intersect(hit)]:
+                self.bitmap_cache.invalidate_field(field_name, value, None)
+                value_map[value].difference_update(hit)
+                if len(value_map[value]) == 0:
+                    self._remove_value(field_name, value)
+
+        removed &= self.live_ids
+        if removed:
+            self.live_ids -= removed
+            self.bitmap_cache.invalidate_live_ids()
+
     def get_int_field_filter_bitmap(
         self, 
         field_name: str, 
@@ -84,9 +199,35 @@ class FilterIndex:
         :param field_name: 字段名
         :param op: 操作类型
         :param value: 比较值
+        :return: 结果位图，可能来自缓存，调用方不能修改
+        """
+        key = f"{field_name}|{op.value}|{value!r}"
+        result_bitmap = self.bitmap_cache.get(key)
+        if result_bitmap is None:
+            result_bitmap = self._compute_int_field_filter_bitmap(field_name, op, value)
+            self.bitmap_cache.put(key, result_bitmap, [(field_name, op, value)],
+                                  op == Operation.NOT_EXISTS)
+        return result_bitmap
+
+    def _compute_int_field_filter_bitmap(
+        self,
+        field_name: str,
+        op: Operation,
+        value: int
+    ) -> BitMap:
+        """
+        计算满足条件的位图
+        :param field_name: 字段名
+        :param op: 操作类型
+        :param value: 比较值
         :return: 结果位图
         """
         result_bitmap = BitMap()
+
+        if op == Operation.NOT_EXISTS:
+            if field_name in self.int_field_ids:
+                return self.live_ids - self.int_field_ids[field_name]
+            return BitMap(self.live_ids)
         
         if field_name in self.int_field_filter:
             value_map = self.int_field_filter[field_name]
@@ -99,15 +240,61 @@ class FilterIndex:
                     )
             
             elif op == Operation.NOT_EQUAL:
-                for val, bitmap in value_map.items():
-                    if val != value:
-                        result_bitmap |= bitmap
+                result_bitmap = self.int_field_ids[field_name] - value_map[value] \
+                    if value in value_map else BitMap(self.int_field_ids[field_name])
                 logger.debug(
                     f"Retrieved NOT_EQUAL bitmap for field_name={field_name}, value={value}"
                 )
 
+            elif op == Operation.EXISTS:
+                result_bitmap |= self.int_field_ids[field_name]
+
+            elif op in (Operation.GREATER, Operation.GREATER_EQUAL, Operation.LESS, Operation.LESS_EQUAL):
+                values = self.int_field_values[field_name]
+                match op:
+                    case Operation.GREATER:
+                        selected = values[bisect.bisect_right(values, value):]
+                    case Operation.GREATER_EQUAL:
+                        selected = values[bisect.bisect_left(values, value):]
+                    case Operation.LESS:
+                        selected = values[:bisect.bisect_left(values, value)]
+                    case _:
+                        selected = values[:bisect.bisect_right(values, value)]
+                if selected:
+                    result_bitmap = BitMap.union(*(value_map[val] for val in selected))
+                logger.debug(
+                    f"Retrieved {op.name} bitmap for field_name={field_name}, value={value}, "
+                    f"matched_values={len(selected)}"
+                )
+
         return result_bitmap
 
+    def get_cached_bitmap(self, key: str) -> Optional[BitMap]:
+        """
+        获取缓存的过滤表达式结果
+        :param key: 规范化的过滤表达式
+        :return: 位图，未命中返回 None
+        """
+        return self.bitmap_cache.get(key)
+
+    def cache_bitmap(self, key: str, bitmap: BitMap, predicates: List[Predicate],
+                     depends_on_live_ids: bool) -> None:
+        """
+        缓存过滤表达式结果
+        :param key: 规范化的过滤表达式
+        :param bitmap: 结果位图
+        :param predicates: 表达式中的全部谓词
+        :param depends_on_live_ids: 结果是否依赖存活ID位图（含 not）
+        """
+        self.bitmap_cache.put(key, bitmap, predicates, depends_on_live_ids)
+
+    def get_all_ids_bitmap(self) -> BitMap:
+        """
+        获取全部存活文档ID
+        :return: 结果位图
+        """
+        return self.live_ids
+
     def serialize_int_field_filter(self) -> str:
         """
         序列化整数字段过滤器
@@ -132,6 +319,9 @@ class FilterIndex:
             return
 
         self.int_field_filter.clear()
+        self.int_field_values.clear()
+        self.int_field_ids.clear()
+        self.bitmap_cache.clear()
 
         for line in serialized_data.split('\n'):
             if not line:
@@ -142,6 +332,24 @@ class FilterIndex:
             bitmap_bytes = base64.b64decode(bitmap_str)
             bitmap = BitMap.deserialize(bitmap_bytes)
             self.int_field_filter[field_name][value] = bitmap
+            self.int_field_values[field_name].append(value)
+            self.int_field_ids[field_name] |= bitmap
+
+        for values in self.int_field_values.values():
+            values.sort()
+
+    def freeze(self) -> "FilterIndex":
+        """
+        复制全部位图，后台快照保存副本，原索引可以继续写入
+        :return: 索引副本（不带结果缓存）
+        """
+        frozen = FilterIndex(cache_size=0)
+        for field_name, value_map in self.int_field_filter.items():
+            frozen.int_field_filter[field_name] = {value: BitMap(bitmap) for value, bitmap in value_map.items()}
+            frozen.int_field_values[field_name] = list(self.int_field_values[field_name])
+            frozen.int_field_ids[field_name] = BitMap(self.int_field_ids[field_name])
+        frozen.live_ids = BitMap(self.live_ids)
+        return frozen
 
     def save_index(self, scalar_storage, key: str) -> None:
         """
@@ -152,6 +360,8 @@ class FilterIndex:
         try:
             serialized_data = self.serialize_int_field_filter()
             scalar_storage.put(key, serialized_data)
+            live_ids_str = base64.b64encode(self.live_ids.serialize()).decode('utf-8')
+            scalar_storage.put(f"{key}.live_ids", live_ids_str)
             logger.debug(f"Successfully saved filter index with key: {key}")
         except Exception as e:
             logger.error(f"Failed to save filter index: {str(e)}")
@@ -170,6 +380,46 @@ class FilterIndex:
                 logger.debug(f"Successfully loaded filter index with key: {key}")
             else:
                 logger.warning(f"No data found for key: {key}")
+
+            live_ids_str = scalar_storage.get(f"{key}.live_ids")
+            self.bitmap_cache.clear()
+            if live_ids_str:
+                self.live_ids = BitMap.deserialize(base64.b64decode(live_ids_str))
+            else:
+                # 旧快照没有存活ID位图，用各字段的ID位图重建
+                self.live_ids = BitMap.union(*self.int_field_ids.values()) if self.int_field_ids else BitMap()
+        except Exception as e:
+            logger.error(f"Failed to load filter index: {str(e)}")
+            raise
+
+    def save_index_file(self, file_path: str) -> None:
+        """
+        保存索引到快照目录中的文件
+        :param file_path: 保存路径
+        """
+        try:
+            with open(file_path, "w") as f:
+                json.dump({
+                    "int_field_filter": self.serialize_int_field_filter(),
+                    "live_ids": base64.b64encode(self.live_ids.serialize()).decode('utf-8'),
+                }, f)
+            logger.debug(f"Successfully saved filter index to {file_path}")
+        except Exception as e:
+            logger.error(f"Failed to save filter index: {str(e)}")
+            raise
+
+    def load_index_file(self, file_path: str) -> None:
+        """
+        从快照目录中的文件加载索引
+        :param file_path: 索引文件路径
+        """
+        try:
+            with open(file_path, "r") as f:
+                data = json.load(f)
+            self.deserialize_int_field_filter(data["int_field_filter"])
+            self.live_ids = BitMap.deserialize(base64.b64decode(data["live_ids"]))
+            self.bitmap_cache.clear()
+            logger.debug(f"Successfully loaded filter index from {file_path}")
         except Exception as e:
             logger.error(f"Failed to load filter index: {str(e)}")
             raise
\ No newline at end of file
@@ -1,10 +1,16 @@
 import os
+import copy
+import threading
 import logging as logger
+from contextlib import contextmanager
 import numpy as np
+import time
 import hnswlib
-from typing import Optional, Set
+from typing import Callable, Optional, Set
+from pyroaring import BitMap
 
-from constants import MetricType
+from constants import MetricType, HNSW_GROWTH_FACTOR, HNSW_EF_SEARCH, HNSW_BATCH_SEARCH_THREADS
+from indexes.exact_search import squared_l2, top_k
 
 
 
@@ -25,27 +31,53 @@ class RoaringBitmapIDFilter:
 
 class HNSWIndex:
 
-    def __init__(self, dim: int, num_data: int, metric: MetricType, M: int = 32, ef_construction: int = 200):
+    def __init__(self, dim: int, num_data: int, metric: MetricType, M: int = 32, ef_construction: int = 200,
+                 growth_factor: float = HNSW_GROWTH_FACTOR):
         """
         初始化 HNSW 索引
         :param dim: 向量维度
-        :param num_data: 预计插入的数据量
+        :param num_data: 初始容量，写满后自动扩容
         :param metric: 距离度量类型
         :param M: 每个节点的最大邻居数
         :param ef_construction: 构建索引时的搜索深度
+        :param growth_factor: 扩容倍数，按几何级数扩容使插入的均摊代价为常数
         """
         self.dim = dim
-        space = metric.value.lower()
-        
-        # 创建索引
-        self.index = hnswlib.Index(space=space, dim=dim)
-        
-        # 初始化索引
-        self.index.init_index(
-            max_elements=num_data,
-            ef_construction=ef_construction,
-            M=M
+        self.metric = metric
+        self.M = M
+        self.ef_construction = ef_construction
+        # 存活的标签；已删除标签只在图中打墓碑标记，新标签插入时复用其槽位
+        self.labels = BitMap()
+        # 打过墓碑标记的标签（槽位被复用后可能已不在图中）
+        self.deleted = BitMap()
+        self.compactions = 0
+        # 后台重建期间被写入或删除的标签，替换时据此追平；不在重建时为 None
+        self.changed: Optional[BitMap] = None
+        self.growth_factor = max(growth_factor, 1.1)
+        self.resizes = 0
+        # hnswlib 的 ef 是索引级别的共享状态：相同 ef 的搜索并发执行，
+        # 不同 ef 的搜索等待正在进行的搜索结束后再切换
+        self._ef_cond = threading.Condition()
+        self._active_searches = 0
+        self._pending_ef: Optional[int] = None
+
+        # 创建并初始化索引
+        self.index = self._new_index(num_data)
+
+    def _new_index(self, max_elements: int) -> hnswlib.Index:
+        """
+        创建允许复用已删除槽位的空索引
+        :param max_elements: 索引容量
+        :return: hnswlib 索引
+        """
+        index = hnswlib.Index(space=self.metric.value.lower(), dim=self.dim)
+        index.init_index(
+            max_elements=max(max_elements, 1),
+            ef_construction=self.ef_construction,
+            M=self.M,
+            allow_replace_deleted=True
         )
+        return index
 
     def insert_vectors(self, vectors: list, label: int):
         """
@@ -55,10 +87,224 @@ class HNSWIndex:
         """
         # 将输入列表转换为 numpy 数组并重塑维度
         vector = np.array(vectors).reshape(1, -1).astype('float32')
-        labels = np.array([label])
-        self.index.add_items(vector, labels)
+        self.insert_vectors_batch(vector, [label])
+
+    def insert_vectors_batch(self, vectors: np.ndarray, labels: list, num_threads: int = -1):
+        """
+        批量插入向量：已存在的标签原地更新，新标签复用已删除的槽位
+        :param vectors: (N, d) 向量矩阵
+        :param labels: 长度为 N 的向量标签列表
+        :param num_threads: add_items 使用的线程数，-1 表示使用全部核心
+        """
+        vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(len(labels), -1)
+        labels = np.asarray(labels, dtype='int64')
+        label_bitmap = BitMap(labels.tolist())
+        if self.changed is not None:
+            self.changed.update(label_bitmap)
+
+        # 被删除但槽位仍在的标签先取消墓碑，随后按已存在的标签原地更新
+        for label in label_bitmap & self.deleted:
+            self.deleted.remove(label)
+            try:
+                self.index.unmark_deleted(label)
+                self.labels.add(label)
+            except RuntimeError:
+                # 槽位已被其他标签复用，按新标签处理
+                pass
+
+        if label_bitmap.intersect(self.labels):
+            existing = np.fromiter((label in self.labels for label in labels.tolist()),
+                                   dtype=bool, count=len(labels))
+        else:
+            existing = np.zeros(len(labels), dtype=bool)
+        if existing.any():
+            self.index.add_items(vectors[existing], labels[existing], num_threads=num_threads)
+
+        # replace_deleted 只能用于图中不存在的标签，否则会产生重复标签
+        new_labels = labels[~existing]
+        if len(new_labels):
+            # 新标签优先复用墓碑槽位，不够时再占用新槽位
+            self._ensure_capacity(len(new_labels) - self.get_tombstone_count())
+            self.index.add_items(vectors[~existing], new_labels, num_threads=num_threads,
+                                 replace_deleted=True)
+            self.labels.update(label_bitmap - self.labels)
 
-    def search_vectors(self, query: list, k: int, bitmap=None, ef_search: int = 50):
+    def bulk_build(self, vectors: np.ndarray, labels: np.ndarray, num_threads: int = -1,
+                   chunk_size: int = 100000, progress: Optional[Callable[[int, int], None]] = None) -> None:
+        """
+        从 (N, d) 矩阵批量构建图：一次性预留容量，按块调用多线程 add_items。
+        vectors 可以是 np.load(..., mmap_mode='r') 返回的内存映射数组，每次只读入一个块
+        :param vectors: (N, d) 向量矩阵
+        :param labels: 长度为 N 的标签数组
+        :param num_threads: add_items 使用的线程数，-1 表示使用全部核心
+        :param chunk_size: 每次 add_items 的向量数量
+        :param progress: 每个块完成后回调 progress(已完成数量, 总数量)
+        """
+        total = len(labels)
+        if vectors.shape[0] != total:
+            raise ValueError(f"Got {vectors.shape[0]} vectors but {total} labels")
+        self.reserve(total)
+
+        start_time = time.perf_counter()
+        for start in range(0, total, chunk_size):
+            end = min(start + chunk_size, total)
+            self.insert_vectors_batch(vectors[start:end], labels[start:end], num_threads=num_threads)
+            if progress:
+                progress(end, total)
+            logger.info(f"HNSW bulk build: {end}/{total} vectors, "
+                        f"{end / max(time.perf_counter() - start_time, 1e-9):.0f} vectors/s")
+
+    def reserve(self, count: int) -> None:
+        """
+        一次性预留 count 个新标签所需的容量，避免分块插入时多次扩容
+        :param count: 即将插入的标签数量
+        """
+        self._ensure_capacity(count - self.get_tombstone_count())
+
+    def _ensure_capacity(self, extra: int) -> None:
+        """
+        确保还能再放下 extra 个新槽位，不够时按 growth_factor 几何扩容
+        :param extra: 需要的新槽位数量
+        """
+        if extra <= 0:
+            return
+        required = self.index.get_current_count() + extra
+        capacity = self.index.get_max_elements()
+        if required <= capacity:
+            return
+        new_capacity = max(required, int(capacity * self.growth_factor))
+        self.index.resize_index(new_capacity)
+        self.resizes += 1
+        logger.info(f"Resized HNSW index from {capacity} to {new_capacity}")
+
+    def remove_vectors(self, ids: list):
+        """
+        删除指定ID的向量：打墓碑标记，搜索时跳过，槽位由后续插入复用
+        :param ids: 要删除的向量ID列表
+        """
+        if self.changed is not None:
+            self.changed.update(ids)
+        for label in ids:
+            if label in self.labels:
+                self.index.mark_deleted(label)
+                self.labels.remove(label)
+                self.deleted.add(label)
+
+    def get_tombstone_count(self) -> int:
+        """
+        获取图中打了墓碑标记、尚未被复用的槽位数量
+        :return: 墓碑数量
+        """
+        return self.index.get_current_count() - len(self.labels)
+
+    def get_tombstone_ratio(self) -> float:
+        """
+        获取墓碑占图中全部槽位的比例
+        :return: 墓碑比例
+        """
+        return self.get_tombstone_count() / max(self.index.get_current_count(), 1)
+
+    def needs_compaction(self, min_tombstones: int, max_ratio: float) -> bool:
+        """
+        判断墓碑是否已多到需要重建
+        :param min_tombstones: 触发重建的最少墓碑数
+        :param max_ratio: 触发重建的墓碑比例阈值
+        :return: 是否需要重建
+        """
+        tombstones = self.get_tombstone_count()
+        return tombstones >= min_tombstones and self.get_tombstone_ratio() >= max_ratio
+
+    def start_tracking(self) -> None:
+        """开始记录被写入或删除的标签，调用方需保证此时没有并发写入"""
+        self.changed = BitMap()
+
+    def stop_tracking(self) -> BitMap:
+        """
+        停止记录并返回期间被写入或删除的标签
+        :return: 标签位图
+        """
+        changed, self.changed = self.changed, None
+        return changed if changed is not None else BitMap()
+
+    def rebuild(self) -> hnswlib.Index:
+        """
+        只用存活向量重建一张新图，不修改当前索引。
+        通常在 freeze() 得到的副本上调用，重建期间不需要持有锁
+        :return: 重建好的 hnswlib 索引
+        """
+        labels = np.array(self.labels.to_array(), dtype='int64')
+        rebuilt = self._new_index(max(self.index.max_elements, len(labels), 1))
+        rebuilt.set_ef(self.index.ef)
+        rebuilt.set_num_threads(HNSW_BATCH_SEARCH_THREADS)
+        if len(labels):
+            rebuilt.add_items(self.index.get_items(labels), labels)
+        return rebuilt
+
+    def swap(self, rebuilt: hnswlib.Index, labels: BitMap) -> None:
+        """
+        用重建好的图替换当前索引，并追平 start_tracking 之后的写入和删除
+        :param rebuilt: rebuild 返回的索引
+        :param labels: 重建时的存活标签
+        """
+        changed = self.stop_tracking()
+        upserted = np.array((changed & self.labels).to_array(), dtype='int64')
+        removed = list(changed - self.labels)
+        vectors = self.index.get_items(upserted) if len(upserted) else None
+
+        self.index = rebuilt
+        self.labels = BitMap(labels)
+        self.deleted = BitMap()
+        if removed:
+            self.remove_vectors(removed)
+        if len(upserted):
+            self.insert_vectors_batch(vectors, upserted)
+        self.compactions += 1
+        logger.info(f"Compacted HNSW index: {len(self.labels)} live vectors")
+
+    def stats(self) -> dict:
+        """
+        获取索引的容量和墓碑统计
+        :return: 统计信息字典
+        """
+        capacity = self.index.get_max_elements()
+        return {
+            "capacity": capacity,
+            "used": self.index.get_current_count(),
+            "usage_ratio": self.index.get_current_count() / max(capacity, 1),
+            "resizes": self.resizes,
+            "live": len(self.labels),
+            "tombstones": self.get_tombstone_count(),
+            "tombstone_ratio": self.get_tombstone_ratio(),
+            "compactions": self.compactions,
+        }
+
+    @contextmanager
+    def _search_ef(self, ef_search: int):
+        """
+        在指定 ef 下执行搜索，搜索期间其他线程不会修改 ef
+        :param ef_search: 搜索时的搜索深度
+        """
+        with self._ef_cond:
+            while self._active_searches:
+                if self.index.ef == ef_search and self._pending_ef is None:
+                    break
+                # 记录等待切换的 ef，阻止后续相同旧 ef 的搜索插队
+                if self._pending_ef is None and self.index.ef != ef_search:
+                    self._pending_ef = ef_search
+                self._ef_cond.wait()
+            if self.index.ef != ef_search:
+                self.index.set_ef(ef_search)
+            if self._pending_ef == ef_search:
+                self._pending_ef = None
+            self._active_searches += 1
+        try:
+            yield
+        finally:
+            with self._ef_cond:
+                self._active_searches -= 1
+                self._ef_cond.notify_all()
+
+    def search_vectors(self, query: list, k: int, bitmap=None, ef_search: int = HNSW_EF_SEARCH):
         """
         查询向量
         :param query: 查询向量，一维列表
@@ -68,15 +314,99 @@ class HNSWIndex:
         :return: (labels, distances) 元组，包含最近邻的标签和距离
         """
         query = np.array(query).reshape(1, -1).astype('float32')
-        self.index.set_ef(ef_search)
+        labels, distances = self.search_vectors_batch(query, k, bitmap, ef_search)
+        return labels[0], distances[0]
+
+    def search_vectors_batch(self, queries: np.ndarray, k: int, bitmap=None, ef_search: int = HNSW_EF_SEARCH):
+        """
+        批量查询向量，nq 个查询在一次多线程 knn_query 调用中完成
+        :param queries: (nq, d) 查询矩阵
+        :param k: 每个查询返回最近邻的数量
+        :param bitmap: 可选的位图过滤器，对所有查询生效
+        :param ef_search: 搜索时的搜索深度
+        :return: (labels, distances) 元组，每个元素为 nq 个结果列表
+        """
+        queries = np.ascontiguousarray(queries, dtype='float32').reshape(-1, self.dim)
 
         # 创建过滤器
         id_filter = RoaringBitmapIDFilter(bitmap)
-        
-        # 执行搜索，获取更多的候选项以应对过滤
-        labels, distances = self.index.knn_query(query, k=k, num_threads=1, filter=id_filter)
 
-        return labels[0].tolist(), distances[0].tolist()
+        num_threads = HNSW_BATCH_SEARCH_THREADS if queries.shape[0] > 1 else 1
+        with self._search_ef(ef_search):
+            labels, distances = self.index.knn_query(queries, k=k, num_threads=num_threads, filter=id_filter)
+
+        return labels.tolist(), distances.tolist()
+
+    def brute_force_search(self, queries: np.ndarray, k: int, bitmap):
+        """
+        对位图中的向量做精确距离计算，适用于高选择性的过滤条件
+        :param queries: (nq, d) 查询矩阵
+        :param k: 每个查询返回最近邻的数量
+        :param bitmap: 标签位图
+        :return: (labels, distances) 元组，每个元素为 nq 个结果列表
+        """
+        queries = np.ascontiguousarray(queries, dtype='float32').reshape(-1, self.dim)
+        # 已删除的标签 get_items 会报错，先与存活标签求交集
+        labels, vectors = self._get_items((bitmap & self.labels).to_array().tolist())
+
+        distances, descending = self.exact_distances(queries, vectors)
+        return top_k(distances, labels, k, descending)
+
+    def exact_distances(self, queries: np.ndarray, vectors: np.ndarray) -> tuple[np.ndarray, bool]:
+        """
+        按 hnswlib 的距离定义计算精确距离：l2 为平方距离，ip/cosine 为 1 - 内积
+        :param queries: (nq, d) 查询矩阵
+        :param vectors: (n, d) 候选向量矩阵
+        :return: ((nq, n) 距离矩阵, 是否越大越相似)
+        """
+        if self.metric == MetricType.L2:
+            return squared_l2(queries, vectors), False
+        if self.metric == MetricType.COSINE:
+            query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries = queries / np.where(query_norms == 0, 1, query_norms)
+            vector_norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(vector_norms == 0, 1, vector_norms)
+        return 1.0 - queries @ vectors.T, False
+
+    def _get_items(self, labels: list) -> tuple[np.ndarray, np.ndarray]:
+        """
+        获取标签对应的向量，忽略索引中不存在的标签
+        :param labels: 标签列表
+        :return: (labels, vectors) 元组
+        """
+        try:
+            vectors = self.index.get_items(labels) if labels else []
+        except RuntimeError:
+            # 位图可能包含其他索引的 ID，逐个过滤掉不存在的标签
+            found, vectors = [], []
+            for label in labels:
+                try:
+                    vectors.append(self.index.get_items([label])[0])
+                    found.append(label)
+                except RuntimeError:
+                    continue
+            labels = found
+        if not len(labels):
+            return np.empty(0, dtype='int64'), np.empty((0, self.dim), dtype='float32')
+        return np.array(labels, dtype='int64'), np.asarray(vectors, dtype='float32')
+
+    def get_count(self) -> int:
+        """
+        获取索引中存活的向量数量
+        :return: 向量数量
+        """
+        return len(self.labels)
+
+    def freeze(self) -> "HNSWIndex":
+        """
+        复制一份图和标签，后台快照保存副本，原索引可以继续写入
+        :return: 索引副本
+        """
+        frozen = copy.copy(self)
+        frozen.index = copy.copy(self.index)
+        frozen.labels = BitMap(self.labels)
+        frozen.deleted = BitMap(self.deleted)
+        return frozen
 
     def save_index(self, file_path: str) -> None:
         """
@@ -85,6 +415,8 @@ class HNSWIndex:
         """
         try:
             self.index.save_index(file_path)
+            with open(f"{file_path}.labels", "wb") as f:
+                f.write(self.labels.serialize())
             logger.info(f"Successfully saved index to {file_path}")
         except Exception as e:
             logger.error(f"Failed to save index: {str(e)}")
@@ -99,8 +431,17 @@ class HNSWIndex:
             if os.path.exists(file_path):
                 self.index.load_index(
                     file_path,
-                    max_elements=self.index.max_elements
+                    max_elements=self.index.max_elements,
+                    allow_replace_deleted=True
                 )
+                all_labels = BitMap(self.index.get_ids_list())
+                if os.path.exists(f"{file_path}.labels"):
+                    with open(f"{file_path}.labels", "rb") as f:
+                        self.labels = BitMap.deserialize(f.read())
+                else:
+                    # 旧快照没有删除操作，图中的标签都是存活的
+                    self.labels = all_labels
+                self.deleted = all_labels - self.labels
                 logger.info(f"Successfully loaded index from {file_path}")
             else:
                 logger.warning(f"File not found: {file_path}. Skipping loading index.")
@@ -1,15 +1,17 @@
 import os
+import time
 import logging as logger
-from typing import Dict, Optional, Union
-from constants import IndexType, MetricType
+from typing import Callable, Dict, Optional, Union
+from constants import IndexType, MetricType, IVF_NLIST, IVF_PQ_M, IVF_TRAIN_SIZE, IVF_NPROBE, INDEX_LOAD_MMAP
 from indexes.faiss_index import FaissIndex
 from indexes.hnsw_index import HNSWIndex
+from indexes.ivf_index import IVFIndex
 from indexes.filter_index import FilterIndex
 
 
 class IndexFactory:
     def __init__(self):
-        self.index_map: Dict[IndexType, Union[FaissIndex, HNSWIndex]] = {}
+        self.index_map: Dict[IndexType, Union[FaissIndex, HNSWIndex, IVFIndex]] = {}
 
     def init(self, type_: IndexType, dim: int = 1, num_data: int = 0, metric: MetricType = MetricType.L2):
         """
@@ -24,29 +26,53 @@ class IndexFactory:
                 self.index_map[type_] = FaissIndex(dim, metric)
             case IndexType.HNSW:
                 self.index_map[type_] = HNSWIndex(dim, num_data, metric, 32, 200)
+            case IndexType.IVF_FLAT | IndexType.IVF_PQ | IndexType.IVF_SQ8:
+                self.index_map[type_] = IVFIndex(dim, type_, metric, IVF_NLIST, IVF_PQ_M,
+                                                 IVF_TRAIN_SIZE, IVF_NPROBE)
             case IndexType.FILTER:
                 self.index_map[type_] = FilterIndex()
 
     def get_index(self, type_: IndexType) -> Optional[FaissIndex]:
         return self.index_map.get(type_)
 
-    def save_index(self, folder_path: str, scalar_storage) -> None:
+    def freeze(self) -> Dict[IndexType, Union[FaissIndex, HNSWIndex, IVFIndex, FilterIndex]]:
+        """
+        复制全部索引，调用方需持有读锁或写锁以阻止并发写入
+        :return: 索引类型到索引副本的映射
+        """
+        return {index_type: index.freeze() for index_type, index in self.index_map.items()}
+
+    def save_index(self, folder_path: str, scalar_storage,
+                   index_map: Optional[Dict[IndexType, Union[FaissIndex, HNSWIndex, IVFIndex, FilterIndex]]] = None,
+                   progress: Optional[Callable[[int, int, IndexType], None]] = None) -> Dict[str, float]:
         """
         保存所有索引到指定文件夹
         :param folder_path: 保存文件夹路径
         :param scalar_storage: 标量存储对象
+        :param index_map: 要保存的索引，默认为当前索引，后台快照时传入 freeze() 的结果
+        :param progress: 进度回调 (已保存数量, 总数, 正在保存的索引类型)
+        :return: 索引类型到保存耗时（秒）的映射
         """
         os.makedirs(folder_path, exist_ok=True)
 
-        for index_type, index in self.index_map.items():
+        index_map = self.index_map if index_map is None else index_map
+        timings = {}
+        for done, (index_type, index) in enumerate(index_map.items()):
+            if progress:
+                progress(done, len(index_map), index_type)
+            start = time.perf_counter()
             file_path = os.path.join(folder_path, f"{index_type.value}.index")            
             match index_type:
                 case IndexType.FLAT:
                     index.save_index(file_path)
-                case IndexType.HNSW:
+                case IndexType.HNSW | IndexType.IVF_FLAT | IndexType.IVF_PQ | IndexType.IVF_SQ8:
                     index.save_index(file_path)
                 case IndexType.FILTER:
-                    index.save_index(scalar_storage, file_path)
+                    index.save_index_file(file_path)
+            timings[index_type.value] = time.perf_counter() - start
+        if progress:
+            progress(len(index_map), len(index_map), None)
+        return timings
 
     def load_index(self, folder_path: str, scalar_storage) -> None:
         """
@@ -62,9 +88,13 @@ class IndexFactory:
             file_path = os.path.join(folder_path, f"{index_type.value}.index")
             
             match index_type:
-                case IndexType.FLAT:
-                    index.load_index(file_path)
+                case IndexType.FLAT | IndexType.IVF_FLAT | IndexType.IVF_PQ | IndexType.IVF_SQ8:
+                    index.load_index(file_path, INDEX_LOAD_MMAP)
                 case IndexType.HNSW:
                     index.load_index(file_path)
                 case IndexType.FILTER:
-                    index.load_index(scalar_storage, file_path)
\ No newline at end of file
+                    # 旧版快照的过滤索引保存在标量存储中
+                    if os.path.exists(file_path):
+                        index.load_index_file(file_path)
+                    else:
+                        index.load_index(scalar_storage, file_path)
\ No newline at end of file
@@ -0,0 +1,37 @@
+import logging as logger
+import os
+import tempfile
+import faiss
+
+
+def read_faiss_index(file_path: str, mmap: bool = False):
+    """
+    读取 faiss 索引。mmap 时扁平存储和倒排列表的向量数据以只读方式映射文件，
+    按需换入内存，同一台机器上的多个进程共享页缓存
+    :param file_path: 索引文件路径
+    :param mmap: 是否以内存映射方式加载
+    :return: (索引, 是否为内存映射)
+    """
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if mmap and flag is None:
+        logger.warning(f"faiss {faiss.__version__} does not support IO_FLAG_MMAP_IFC, reading {file_path} into memory")
+    if mmap and flag is not None:
+        return faiss.read_index(file_path, flag | faiss.IO_FLAG_READ_ONLY), True
+    return faiss.read_index(file_path), False
+
+
+def materialize_faiss_index(index, file_path: str):
+    """
+    把内存映射的只读索引读入内存，之后才能写入。重新读取加载时的文件，
+    峰值内存约为一份索引；快照已被清理、文件不存在时先写到临时文件再读回
+    :param index: read_faiss_index 以 mmap 方式加载的索引
+    :param file_path: 加载索引时的文件路径
+    :return: 可写的索引
+    """
+    if os.path.exists(file_path):
+        return faiss.read_index(file_path)
+    logger.warning(f"{file_path} no longer exists, copying the memory-mapped index through a temporary file")
+    with tempfile.TemporaryDirectory() as folder_path:
+        copy_path = os.path.join(folder_path, "index")
+        faiss.write_index(index, copy_path)
+        return faiss.read_index(copy_path)
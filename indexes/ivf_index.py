@@ -0,0 +1,364 @@
+import os
+import copy
+import logging as logger
+import faiss
+import numpy as np
+from typing import Callable, List, Optional, Tuple
+from pyroaring import BitMap
+
+from constants import IndexType, MetricType
+from indexes.exact_search import squared_l2
+from indexes.index_io import read_faiss_index, materialize_faiss_index
+
+# 按 ID 读取原始向量：ids -> (找到的ID列表, (n, d) 向量矩阵)
+VectorLoader = Callable[[List[int]], Tuple[List[int], np.ndarray]]
+
+
+class IVFIndex:
+    """
+    faiss 倒排索引（IVF-Flat / IVF-PQ / IVF-SQ8）。
+    训练前使用精确的 IndexIDMap2(IndexFlat) 提供服务并缓存向量；
+    插入数量达到 train_size（needs_training）后由调用方在后台训练倒排索引，
+    把已有向量写入新索引后整体替换。外部 ID 直接作为 faiss ID 存储。
+    """
+
+    def __init__(self, dim: int, index_type: IndexType, metric_type: MetricType = MetricType.L2,
+                 nlist: int = 100, pq_m: int = 8, train_size: int = 10000, nprobe: int = 8):
+        """
+        初始化 IVF 索引
+        :param dim: 向量维度
+        :param index_type: IVF_FLAT / IVF_PQ / IVF_SQ8
+        :param metric_type: 距离度量类型
+        :param nlist: 倒排列表（聚类中心）数量
+        :param pq_m: PQ 子空间数量，取不超过该值的 dim 的最大约数
+        :param train_size: 自动训练所需的向量数量
+        :param nprobe: 默认搜索的倒排列表数量
+        """
+        self.dim = dim
+        self.index_type = index_type
+        self.metric_type = metric_type
+        self.metric = faiss.METRIC_L2 if metric_type == MetricType.L2 else faiss.METRIC_INNER_PRODUCT
+        self.nlist = nlist
+        self.pq_m = max(m for m in range(1, min(pq_m, dim) + 1) if dim % m == 0)
+        self.train_size = train_size
+        self.nprobe = nprobe
+        self.index = self._new_flat_index()
+        # 以内存映射方式加载的索引是只读的，第一次写入前从 file_path 重新读入内存
+        self.mmapped = False
+        self.file_path: Optional[str] = None
+        # 后台训练期间被写入 / 删除的 ID，替换时据此追平；不在训练时为 None
+        self.changed: Optional[BitMap] = None
+        self.removed: Optional[BitMap] = None
+
+    @property
+    def is_trained(self) -> bool:
+        """是否已经切换到训练好的倒排索引"""
+        return not isinstance(self.index, faiss.IndexIDMap2)
+
+    def load_writable(self):
+        """
+        读出内存映射索引的可写副本，不修改当前索引，可以在写锁外调用
+        :return: 内存中的 faiss 索引，索引已经可写时为 None
+        """
+        if not self.mmapped:
+            return None
+        logger.info(f"Copying memory-mapped {self.index_type.value} index with {self.index.ntotal} vectors "
+                    f"into memory")
+        return materialize_faiss_index(self.index, self.file_path)
+
+    def adopt_writable(self, index) -> None:
+        """
+        替换为 load_writable 读出的副本，需要在写锁内调用；期间索引已被替换（如训练切换）时丢弃副本
+        :param index: load_writable 的返回值
+        """
+        if self.mmapped and index is not None:
+            self.index = index
+            self.mmapped = False
+
+    def _ensure_writable(self) -> None:
+        """内存映射加载的索引在第一次写入前复制到内存"""
+        self.adopt_writable(self.load_writable())
+
+    def _new_flat_index(self):
+        """创建训练前使用的精确索引"""
+        return faiss.IndexIDMap2(faiss.IndexFlat(self.dim, self.metric))
+
+    def _factory_string(self, nlist: int) -> str:
+        """
+        生成 faiss index_factory 描述字符串
+        :param nlist: 倒排列表数量
+        :return: 描述字符串
+        """
+        match self.index_type:
+            case IndexType.IVF_PQ:
+                return f"IVF{nlist},PQ{self.pq_m}"
+            case IndexType.IVF_SQ8:
+                return f"IVF{nlist},SQ8"
+            case _:
+                return f"IVF{nlist},Flat"
+
+    def insert_vectors(self, vectors: list, label: int):
+        """
+        插入向量
+        :param vectors: 向量数据
+        :param label: 向量标签
+        """
+        vector = np.array(vectors).reshape(1, -1).astype('float32')
+        self.insert_vectors_batch(vector, [label])
+
+    def insert_vectors_batch(self, vectors: np.ndarray, labels: list):
+        """
+        批量插入向量
+        :param vectors: (N, d) 向量矩阵
+        :param labels: 长度为 N 的向量标签列表
+        """
+        vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(len(labels), -1)
+        self._ensure_writable()
+        labels = np.array(labels, dtype='int64')
+        self.index.add_with_ids(vectors, labels)
+        if self.changed is not None:
+            label_bitmap = BitMap(labels.tolist())
+            self.changed.update(label_bitmap)
+            self.removed.difference_update(label_bitmap)
+
+    def needs_training(self) -> bool:
+        """
+        是否还在使用精确索引且向量数量已达到 train_size
+        :return: 是否需要训练
+        """
+        return not self.is_trained and self.index.ntotal >= self.train_size
+
+    def start_tracking(self) -> None:
+        """开始记录被写入或删除的 ID，调用方需保证此时没有并发写入"""
+        self.changed = BitMap()
+        self.removed = BitMap()
+
+    def stop_tracking(self) -> tuple[BitMap, BitMap]:
+        """
+        停止记录并返回期间写入和删除的 ID
+        :return: (changed, removed) 元组
+        """
+        changed, removed = self.changed, self.removed
+        self.changed, self.removed = None, None
+        return changed if changed is not None else BitMap(), removed if removed is not None else BitMap()
+
+    def train(self, sample: Optional[np.ndarray] = None, load_original: Optional[VectorLoader] = None):
+        """
+        训练一个新的空倒排索引，不修改当前索引
+        :param sample: 训练样本，默认从当前索引中最多抽取 train_size 个向量
+        :param load_original: 按 ID 读取原始向量的函数，见 _load_vectors
+        :return: 训练好的空索引
+        """
+        if sample is None:
+            ids = self.get_ids()
+            if len(ids) > self.train_size:
+                rng = np.random.default_rng(0)
+                ids = np.sort(ids[rng.choice(len(ids), self.train_size, replace=False)])
+            sample = self._load_vectors(ids, load_original)
+        sample = np.ascontiguousarray(sample, dtype='float32').reshape(-1, self.dim)
+        if len(sample) == 0:
+            raise RuntimeError("Cannot train an IVF index without vectors")
+
+        # 聚类中心数量不能超过训练样本数
+        nlist = min(self.nlist, len(sample))
+        trained = faiss.index_factory(self.dim, self._factory_string(nlist), self.metric)
+        trained.train(sample)
+        logger.info(f"Trained {self._factory_string(nlist)} on {len(sample)} vectors")
+        return trained
+
+    def populate(self, trained, load_original: Optional[VectorLoader] = None):
+        """
+        将当前索引中的全部向量写入训练好的索引，不修改当前索引。
+        通常在 freeze() 得到的副本上调用，写入期间不需要持有锁
+        :param trained: train() 返回的索引
+        :param load_original: 按 ID 读取原始向量的函数，见 _load_vectors
+        :return: 写入向量后的索引
+        """
+        ivf = faiss.extract_index_ivf(trained)
+        # 哈希直接映射：按 ID 删除和重建向量无需扫描倒排列表
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        ids = self.get_ids()
+        if len(ids):
+            trained.add_with_ids(self._load_vectors(ids, load_original), ids)
+        return trained
+
+    def swap(self, populated, load_original: Optional[VectorLoader] = None) -> None:
+        """
+        替换当前索引，并追平 start_tracking 之后的写入和删除
+        :param populated: populate() 返回的索引
+        :param load_original: 按 ID 读取原始向量的函数，见 _load_vectors
+        """
+        changed, removed = self.stop_tracking()
+        if changed or removed:
+            populated.remove_ids(np.array((changed | removed).to_array(), dtype='int64'))
+        if changed:
+            ids = np.array(changed.to_array(), dtype='int64')
+            populated.add_with_ids(self._load_vectors(ids, load_original), ids)
+        self.index = populated
+        self.mmapped = False
+
+    def get_ids(self) -> np.ndarray:
+        """
+        获取当前索引中的全部 ID
+        :return: int64 ID 数组
+        """
+        if self.index.ntotal == 0:
+            return np.empty(0, dtype='int64')
+        if not self.is_trained:
+            return faiss.vector_to_array(self.index.id_map).astype('int64')
+        ivf = faiss.extract_index_ivf(self.index)
+        invlists = ivf.invlists
+        return np.concatenate([
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(ivf.nlist) if invlists.list_size(list_no) > 0
+        ]).astype('int64')
+
+    def _load_vectors(self, ids: np.ndarray, load_original: Optional[VectorLoader] = None) -> np.ndarray:
+        """
+        获取 ID 对应的向量。PQ / SQ8 重建出的是有损的量化向量，用它重新训练会让误差逐次累积，
+        因此优先通过 load_original 读取原始 float32 向量，只有缺失的 ID 才从索引中重建
+        :param ids: 索引中存在的 ID
+        :param load_original: 返回 (找到的ID列表, (n, d) 向量矩阵) 的函数，如 ScalarStorage.get_vectors
+        :return: (len(ids), d) 向量矩阵
+        """
+        if len(ids) == 0:
+            return np.empty((0, self.dim), dtype='float32')
+        if load_original is None:
+            return self.index.reconstruct_batch(ids)
+
+        vectors = np.empty((len(ids), self.dim), dtype='float32')
+        loaded = np.zeros(len(ids), dtype=bool)
+        found_ids, found_vectors = load_original(ids.tolist())
+        if found_ids and found_vectors.shape[1] == self.dim:
+            order = np.argsort(ids)
+            positions = order[np.searchsorted(ids, found_ids, sorter=order)]
+            vectors[positions] = found_vectors
+            loaded[positions] = True
+        if not loaded.all():
+            vectors[~loaded] = self.index.reconstruct_batch(ids[~loaded])
+        return vectors
+
+    def _search_params(self, selector=None, nprobe: Optional[int] = None):
+        """
+        构造单次搜索参数，不修改索引的共享状态
+        :param selector: 可选的 IDSelector
+        :param nprobe: 搜索的倒排列表数量
+        :return: faiss 搜索参数
+        """
+        if not self.is_trained:
+            return faiss.SearchParameters(sel=selector) if selector is not None else None
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe or self.nprobe
+        if selector is not None:
+            params.sel = selector
+        return params
+
+    def search_vectors(self, query: list, k: int, bitmap=None, nprobe: Optional[int] = None):
+        """
+        搜索向量
+        :param query: 查询向量
+        :param k: 返回的最近邻数量
+        :param bitmap: 可选的位图过滤器
+        :param nprobe: 搜索的倒排列表数量
+        :return: (ids, distances) 元组
+        """
+        query = np.array(query).reshape(1, -1).astype('float32')
+        ids, distances = self.search_vectors_batch(query, k, bitmap, nprobe)
+        return ids[0], distances[0]
+
+    def search_vectors_batch(self, queries: np.ndarray, k: int, bitmap=None, nprobe: Optional[int] = None):
+        """
+        批量搜索向量，位图过滤直接下推到 faiss
+        :param queries: (nq, d) 查询矩阵
+        :param k: 每个查询返回的最近邻数量
+        :param bitmap: 可选的位图过滤器
+        :param nprobe: 搜索的倒排列表数量
+        :return: (ids, distances) 元组，每个元素为 nq 个结果列表
+        """
+        queries = np.ascontiguousarray(queries, dtype='float32').reshape(-1, self.dim)
+        selector = None
+        if bitmap is not None:
+            selector = faiss.IDSelectorBatch(np.array(bitmap.to_array(), dtype='int64'))
+        params = self._search_params(selector, nprobe)
+        distances, indices = self.index.search(queries, k, params=params)
+        # 未命中的位置距离置为 0，与其他索引保持一致
+        distances = np.where(indices == -1, 0.0, distances)
+        return indices.tolist(), distances.tolist()
+
+    def brute_force_search(self, queries: np.ndarray, k: int, bitmap):
+        """
+        高选择性过滤：扫描全部倒排列表，只计算位图内的向量
+        :param queries: (nq, d) 查询矩阵
+        :param k: 每个查询返回的最近邻数量
+        :param bitmap: 外部 ID 位图
+        :return: (ids, distances) 元组，每个元素为 nq 个结果列表
+        """
+        return self.search_vectors_batch(queries, k, bitmap, self.nlist)
+
+    def exact_distances(self, queries: np.ndarray, vectors: np.ndarray) -> tuple[np.ndarray, bool]:
+        """
+        按索引的度量计算精确距离，用于对量化结果重排
+        :param queries: (nq, d) 查询矩阵
+        :param vectors: (n, d) 候选向量矩阵
+        :return: ((nq, n) 距离矩阵, 是否越大越相似)
+        """
+        if self.metric_type == MetricType.L2:
+            return squared_l2(queries, vectors), False
+        return queries @ vectors.T, True
+
+    def remove_vectors(self, ids: list):
+        """
+        删除指定ID的向量
+        :param ids: 要删除的向量ID列表
+        """
+        if ids:
+            self._ensure_writable()
+            self.index.remove_ids(np.array(ids, dtype='int64'))
+            if self.changed is not None:
+                id_bitmap = BitMap(ids)
+                self.changed.difference_update(id_bitmap)
+                self.removed.update(id_bitmap)
+
+    def get_count(self) -> int:
+        """
+        获取索引中的向量数量
+        :return: 向量数量
+        """
+        return self.index.ntotal
+
+    def freeze(self) -> "IVFIndex":
+        """
+        复制一份索引，后台快照保存副本，原索引可以继续写入
+        :return: 索引副本
+        """
+        frozen = copy.copy(self)
+        # 内存映射的索引不会被原地修改（写入前会先复制），可以直接共享
+        frozen.index = self.index if self.mmapped else faiss.clone_index(self.index)
+        return frozen
+
+    def save_index(self, file_path: str) -> None:
+        """
+        保存索引到文件
+        :param file_path: 保存路径
+        """
+        try:
+            faiss.write_index(self.index, file_path)
+        except Exception as e:
+            logger.error(f"Failed to save index: {str(e)}")
+            raise
+
+    def load_index(self, file_path: str, mmap: bool = False) -> None:
+        """
+        从文件加载索引
+        :param file_path: 索引文件路径
+        :param mmap: 是否以内存映射方式只读加载向量数据和倒排列表
+        """
+        try:
+            if os.path.exists(file_path):
+                self.index, self.mmapped = read_faiss_index(file_path, mmap)
+                self.file_path = file_path
+            else:
+                logger.warning(f"File not found: {file_path}. Skipping loading index.")
+        except Exception as e:
+            logger.error(f"Failed to load index: {str(e)}")
+            raise
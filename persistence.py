@@ -1,7 +1,18 @@
+import os
 import json
+import time
+import shutil
+import threading
 import logging as logger
-from typing import Dict, Any, Optional, Tuple
-from constants import SNAPSHOTS_MAX_LOG_ID
+from concurrent.futures import Future
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
+from constants import SNAPSHOTS_MAX_LOG_ID, Durability, WAL_DURABILITY, WAL_GROUP_COMMIT_WINDOW_MS, \
+    WAL_SEGMENT_MAX_BYTES, WAL_SEGMENT_MAX_RECORDS, WAL_ARCHIVE_FOLDER_PATH, SNAPSHOT_KEEP_COUNT, \
+    SNAPSHOT_VERIFY_CHECKSUMS
+from wal import WAL_MAGIC, GroupCommitWriter, encode_record, decode_payload, read_records, \
+    segment_path, list_segments, is_binary_segment
+from snapshot import MANIFEST_FORMAT, SNAPSHOT_TMP_PREFIX, snapshot_dir_name, list_snapshots, load_manifest, \
+    write_manifest, file_entry, fsync_dir
 
 class Persistence:
 
@@ -11,30 +22,126 @@ class Persistence:
         """
         self.increase_id = 1
         self.last_snapshot_id = 0
+        self.wal_path = None
+        self.wal_manifest_path = None
+        # WAL 段信息，按序号排列，最后一个是当前写入的段
+        # {"seq", "file", "sealed", "first_id", "last_id", "records", "bytes"}，未知的日志ID范围为 None
+        self.wal_segments: List[Dict[str, Any]] = []
+        # 后台快照释放段与写入线程切换段可能并发，修改段列表和清单时加锁
+        self._wal_segments_lock = threading.Lock()
         self.wal_log_file = None
+        self.wal_writer: Optional[GroupCommitWriter] = None
         self.snapshot_path = ".snapshots"
+        # 启动时加载的快照目录，为空时使用旧版的平铺快照
+        self.snapshot_dir: Optional[str] = None
+        self.version = ""
         self.index_factory = None
+        self._wal_entries: Optional[Iterator[Tuple[str, Dict[str, Any]]]] = None
+        self._wal_scanned = False
 
     def __del__(self):
-        if self.wal_log_file:
-            self.wal_log_file.close()
+        self.close()
 
     def init(self, index_factory, wal_log_file_path: str, snapshot_folder_path: str) -> None:
         """
         初始化WAL日志文件
         :param index_factory: 索引工厂对象
-        :param wal_log_file_path: 日志文件路径
+        :param wal_log_file_path: 日志文件路径，WAL 段以 {路径}.00000001 的形式存放在同一目录
         :param snapshot_folder_path: 快照文件夹路径
         """
         self.index_factory = index_factory
         self.snapshot_path = snapshot_folder_path
+        self.wal_path = wal_log_file_path
+        self.wal_manifest_path = f"{wal_log_file_path}.manifest"
         try:
-            self.wal_log_file = open(wal_log_file_path, 'a+')
+            self._select_snapshot()
+            self._load_wal_segments()
+            self._migrate_single_file_wal()
+
+            if not self.wal_segments or self.wal_segments[-1]["sealed"]:
+                self._new_wal_segment()
+            self.wal_log_file = open(self._segment_file(self.wal_segments[-1]), 'a+b')
+            if self.wal_log_file.tell() == 0:
+                self.wal_log_file.write(WAL_MAGIC)
+                self.wal_log_file.flush()
             self.wal_log_file.seek(0)
-            self.load_last_snapshot_id()
         except Exception as e:
             raise RuntimeError(f"Failed to open WAL log file at path: {wal_log_file_path}")
 
+    def _load_wal_segments(self) -> None:
+        """合并磁盘上的段文件和清单中记录的日志ID范围，清单缺失的段在回放时补全"""
+        manifest = {}
+        if os.path.exists(self.wal_manifest_path):
+            with open(self.wal_manifest_path, 'r') as f:
+                manifest = {segment["file"]: segment for segment in json.load(f)["segments"]}
+
+        self.wal_segments = []
+        for seq, path in list_segments(self.wal_path):
+            name = os.path.basename(path)
+            segment = {"seq": seq, "file": name, "sealed": False, "first_id": None, "last_id": None,
+                       "records": 0, "bytes": os.path.getsize(path)}
+            if manifest.get(name, {}).get("sealed"):
+                segment.update(manifest[name])
+            self.wal_segments.append(segment)
+        # 只有最后一个段可能仍在写入
+        for segment in self.wal_segments[:-1]:
+            segment["sealed"] = True
+
+    def _migrate_single_file_wal(self) -> None:
+        """旧版的单文件 WAL（文本 wal.log.legacy、二进制或文本 wal.log）改名为已封存的段"""
+        migrated = False
+        for path in (f"{self.wal_path}.legacy", self.wal_path):
+            if not os.path.exists(path):
+                continue
+            if os.path.getsize(path) == 0:
+                os.remove(path)
+                continue
+            segment = self._new_wal_segment(sealed=True)
+            os.replace(path, self._segment_file(segment))
+            segment["bytes"] = os.path.getsize(self._segment_file(segment))
+            logger.info(f"Moved single-file WAL {path} to segment {segment['file']}")
+            migrated = True
+        if migrated:
+            self._save_wal_manifest()
+
+    def _new_wal_segment(self, sealed: bool = False) -> Dict[str, Any]:
+        """
+        追加一个新的段记录
+        :param sealed: 是否已封存
+        :return: 段信息
+        """
+        seq = self.wal_segments[-1]["seq"] + 1 if self.wal_segments else 1
+        segment = {"seq": seq, "file": os.path.basename(segment_path(self.wal_path, seq)), "sealed": sealed,
+                   "first_id": None, "last_id": None, "records": 0, "bytes": 0}
+        self.wal_segments.append(segment)
+        return segment
+
+    def _segment_file(self, segment: Dict[str, Any]) -> str:
+        """
+        段文件路径
+        :param segment: 段信息
+        :return: 路径
+        """
+        return os.path.join(os.path.dirname(self.wal_path), segment["file"])
+
+    def _save_wal_manifest(self) -> None:
+        """原子地写入 WAL 段清单"""
+        tmp_path = f"{self.wal_manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"segments": self.wal_segments}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.wal_manifest_path)
+
+    def close(self) -> None:
+        """写完排队中的 WAL 记录并关闭文件"""
+        if self.wal_writer:
+            self.wal_writer.close()
+            self.wal_writer = None
+        if self.wal_log_file:
+            self.wal_log_file.close()
+            self.wal_log_file = None
+
     def increased_id(self) -> int:
         """
         增加并返回ID
@@ -53,28 +160,114 @@ class Persistence:
     def write_wal_log(self, 
                     operation_type: str, 
                     json_data: Dict[str, Any],
-                    version: str) -> None:
+                    version: str,
+                    durability: Union[Durability, str, None] = None) -> Future:
         """
-        写入WAL日志
+        写入WAL日志：记录进入组提交队列，返回达到指定持久化级别时完成的 Future。
+        调用方需在写锁内调用，保证日志顺序与应用顺序一致
         :param operation_type: 操作类型
         :param json_data: JSON数据
         :param version: 版本信息
+        :param durability: 持久化级别 none / flush / fsync，默认使用 WAL_DURABILITY
+        :return: Future
         """
-        log_id = self.increased_id()
-        json_str = json.dumps(json_data)
-        log_entry = f"{log_id}|{version}|{operation_type}|{json_str}\n"
+        durability = Durability(durability or WAL_DURABILITY)
 
         try:
-            self.wal_log_file.write(log_entry)
-            self.wal_log_file.flush()
+            self._ensure_wal_writer()
+            active = self.wal_segments[-1]
+            if (WAL_SEGMENT_MAX_BYTES and active["bytes"] >= WAL_SEGMENT_MAX_BYTES) or \
+                    (WAL_SEGMENT_MAX_RECORDS and active["records"] >= WAL_SEGMENT_MAX_RECORDS):
+                self.rotate_wal()
+                active = self.wal_segments[-1]
+
+            log_id = self.increased_id()
+            record = encode_record(log_id, version, operation_type, json_data)
+            future = self.wal_writer.append(record, durability)
+            if active["first_id"] is None:
+                active["first_id"] = log_id
+            active["last_id"] = log_id
+            active["records"] += 1
+            active["bytes"] += len(record)
             logger.debug(
                 f"Wrote WAL log entry: log_id={log_id}, version={version}, "
-                f"operation_type={operation_type}, json_data_str={json_str}"
+                f"operation_type={operation_type}, durability={durability.value}"
             )
+            return future
         except Exception as e:
             logger.error(f"An error occurred while writing the WAL log entry. Reason: {str(e)}")
             raise
 
+    def _ensure_wal_writer(self) -> None:
+        """回放结束（已截掉损坏的尾部、恢复了日志ID）后才开始追加"""
+        if self.wal_writer is None:
+            if not self._wal_scanned:
+                for _ in self._iter_wal_entries():
+                    pass
+            self._wal_entries = None
+            self.wal_writer = GroupCommitWriter(self.wal_log_file, WAL_GROUP_COMMIT_WINDOW_MS)
+
+    def rotate_wal(self) -> None:
+        """
+        封存当前段并切换到新段，调用方需持有写锁（或阻塞写入的读锁）
+        """
+        self._ensure_wal_writer()
+        active = self.wal_segments[-1]
+        if active["records"] == 0:
+            return
+
+        segment = self._new_wal_segment()
+        new_file = open(self._segment_file(segment), 'a+b')
+        new_file.write(WAL_MAGIC)
+        new_file.flush()
+        segment["bytes"] = len(WAL_MAGIC)
+        # 旧段的全部记录写入并 fsync 后再封存
+        self.wal_writer.switch_file(new_file).close()
+        self.wal_log_file = new_file
+        with self._wal_segments_lock:
+            active["sealed"] = True
+            self._save_wal_manifest()
+        logger.info(f"Rotated WAL segment {active['file']} (log id {active['first_id']}-{active['last_id']}, "
+                    f"{active['records']} records, {active['bytes']} bytes)")
+
+    def release_wal_segments(self) -> None:
+        """删除或归档已被快照完全覆盖的封存段"""
+        # 保留最旧快照之后的段，回退到较旧的快照时仍可回放
+        snapshots = list_snapshots(self.snapshot_path)
+        release_id = min(snapshots[0][0], self.last_snapshot_id) if snapshots else self.last_snapshot_id
+        with self._wal_segments_lock:
+            released = [segment for segment in self.wal_segments[:-1]
+                        if segment["sealed"] and segment["last_id"] is not None
+                        and segment["last_id"] <= release_id]
+            if not released:
+                return
+
+            for segment in released:
+                path = self._segment_file(segment)
+                try:
+                    if WAL_ARCHIVE_FOLDER_PATH:
+                        os.makedirs(WAL_ARCHIVE_FOLDER_PATH, exist_ok=True)
+                        shutil.move(path, os.path.join(WAL_ARCHIVE_FOLDER_PATH, segment["file"]))
+                    else:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.error(f"Failed to release WAL segment {segment['file']}: {str(e)}")
+                    continue
+                self.wal_segments.remove(segment)
+                logger.info(f"Released WAL segment {segment['file']} covered by snapshot {release_id}")
+            self._save_wal_manifest()
+
+    def wal_bytes(self) -> int:
+        """
+        尚未被最新快照覆盖的 WAL 段总大小
+        :return: 字节数
+        """
+        with self._wal_segments_lock:
+            return sum(segment["bytes"] for segment in self.wal_segments
+                       if segment["last_id"] is None or segment["last_id"] > self.last_snapshot_id)
+
     def read_next_wal_log(self) -> Optional[Tuple[str, Dict[str, Any]]]:
         """
         读取下一条WAL日志
@@ -82,49 +275,231 @@ class Persistence:
         """
         logger.debug("Reading next WAL log entry")
 
+        if self._wal_entries is None:
+            self._wal_entries = self._iter_wal_entries()
         try:
-            while True:
-                line = self.wal_log_file.readline()
-                if not line:
-                    self.wal_log_file.seek(0)
-                    logger.debug("No more WAL log entries to read")
-                    return None
-
-                log_id_str, version, operation_type, json_data_str = line.strip().split('|')
-                log_id = int(log_id_str)
-                
-                if log_id > self.increase_id:
-                    self.increase_id = log_id
-
-                # 只处理比最后快照ID更新的日志
-                if log_id > self.last_snapshot_id:
-                    json_data = json.loads(json_data_str)
-                    logger.debug(
-                        f"Read WAL log entry: log_id={log_id_str}, "
-                        f"operation_type={operation_type}, json_data_str={json_data_str}"
-                    )
-                    return operation_type, json_data
-                else:
-                    logger.debug(
-                        f"Skip Read WAL log entry: log_id={log_id_str}, "
-                        f"operation_type={operation_type}, json_data_str={json_data_str}"
-                    )
-
+            return next(self._wal_entries)
+        except StopIteration:
+            self._wal_entries = None
+            logger.debug("No more WAL log entries to read")
+            return None
         except Exception as e:
             logger.error(f"Error reading WAL log: {str(e)}")
+            self._wal_entries = None
+            return None
+
+    def _iter_wal_entries(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        依次读取比最后快照更新的日志。日志ID范围已知且被快照覆盖的封存段直接跳过，不打开文件
+        :return: (operation_type, json_data) 迭代器
+        """
+        manifest_changed = False
+        for segment in self.wal_segments:
+            if segment["sealed"] and segment["last_id"] is not None \
+                    and segment["last_id"] <= self.last_snapshot_id:
+                self.increase_id = max(self.increase_id, segment["last_id"])
+                logger.debug(f"Skip WAL segment {segment['file']} covered by snapshot")
+                continue
+
+            segment.update(first_id=None, last_id=None, records=0)
+            for log_id, operation_type, json_data in self._read_segment(segment):
+                if segment["first_id"] is None:
+                    segment["first_id"] = log_id
+                segment["last_id"] = log_id
+                segment["records"] += 1
+                entry = self._accept(log_id, operation_type, json_data)
+                if entry:
+                    yield entry
+            if segment["sealed"]:
+                # 空段的范围记为 0，下次快照后即可释放
+                if segment["last_id"] is None:
+                    segment["last_id"] = 0
+                manifest_changed = True
+
+        self._wal_scanned = True
+        if manifest_changed:
+            with self._wal_segments_lock:
+                self._save_wal_manifest()
+        self.release_wal_segments()
+
+    def _read_segment(self, segment: Dict[str, Any]) -> Iterator[Tuple[int, str, Union[str, Dict[str, Any]]]]:
+        """
+        读取一个段中的全部日志，当前段会截掉崩溃时写了一半的尾部
+        :param segment: 段信息
+        :return: (log_id, operation_type, json_data) 迭代器
+        """
+        path = self._segment_file(segment)
+        if not is_binary_segment(path):
+            # 旧版文本 WAL：log_id|version|operation_type|json
+            with open(path, 'r') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    log_id_str, version, operation_type, json_data_str = line.strip().split('|', 3)
+                    yield int(log_id_str), operation_type, json_data_str
+            return
+
+        if segment is not self.wal_segments[-1]:
+            with open(path, 'rb') as f:
+                f.seek(len(WAL_MAGIC))
+                for _, _, payload in read_records(f):
+                    log_id, version, operation_type, json_data = decode_payload(payload)
+                    yield log_id, operation_type, json_data
+            return
+
+        self.wal_log_file.seek(len(WAL_MAGIC))
+        valid_end = len(WAL_MAGIC)
+        for _, end, payload in read_records(self.wal_log_file):
+            valid_end = end
+            log_id, version, operation_type, json_data = decode_payload(payload)
+            yield log_id, operation_type, json_data
+
+        # 截掉崩溃时写了一半的尾部，后续追加从完整记录之后开始
+        self.wal_log_file.seek(0, os.SEEK_END)
+        if self.wal_log_file.tell() > valid_end:
+            logger.warning(f"Truncating WAL from {self.wal_log_file.tell()} to {valid_end} bytes")
+            self.wal_log_file.truncate(valid_end)
+        self.wal_log_file.seek(0, os.SEEK_END)
+        segment["bytes"] = valid_end
+
+    def _accept(self, log_id: int, operation_type: str,
+                json_data: Union[str, Dict[str, Any]]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        更新当前日志ID，只返回比最后快照ID更新的日志
+        :param log_id: 日志ID
+        :param operation_type: 操作类型
+        :param json_data: JSON数据（文本 WAL 中为字符串）
+        :return: (operation_type, json_data)，已包含在快照中时返回 None
+        """
+        if log_id > self.increase_id:
+            self.increase_id = log_id
+
+        if log_id <= self.last_snapshot_id:
+            logger.debug(f"Skip Read WAL log entry: log_id={log_id}, operation_type={operation_type}")
             return None
+        if isinstance(json_data, str):
+            json_data = json.loads(json_data)
+        logger.debug(f"Read WAL log entry: log_id={log_id}, operation_type={operation_type}")
+        return operation_type, json_data
+
+    def wal_stats(self) -> dict:
+        """
+        获取 WAL 写入和分段统计
+        :return: 统计信息字典
+        """
+        stats = self.wal_writer.stats() if self.wal_writer else {}
+        stats["unsnapshotted_bytes"] = self.wal_bytes()
+        with self._wal_segments_lock:
+            stats["segments"] = len(self.wal_segments)
+            stats["segment_bytes"] = sum(segment["bytes"] for segment in self.wal_segments)
+            if self.wal_segments:
+                stats["active_segment"] = self.wal_segments[-1]["file"]
+        return stats
+
+    def begin_snapshot(self) -> int:
+        """
+        封存当前 WAL 段，快照完成后即可释放。调用方需持有读锁或写锁以阻止并发写入，
+        并在同一锁内复制索引
+        :return: 快照对应的日志ID
+        """
+        self.rotate_wal()
+        return self.increase_id
+
+    def save_snapshot(self, log_id: int, scalar_storage, index_map=None, progress=None) -> Dict[str, Any]:
+        """
+        把索引写入临时目录，写入清单（日志ID、文件、CRC32、大小、耗时）并 fsync 后原子地改名发布，
+        然后清理旧快照并释放被覆盖的 WAL 段
+        :param log_id: begin_snapshot 返回的日志ID
+        :param scalar_storage: 标量存储对象
+        :param index_map: 要保存的索引副本，默认为当前索引
+        :param progress: 进度回调，见 IndexFactory.save_index
+        :return: 清单内容
+        """
+        os.makedirs(self.snapshot_path, exist_ok=True)
+        name = snapshot_dir_name(log_id)
+        final_dir = os.path.join(self.snapshot_path, name)
+        tmp_dir = os.path.join(self.snapshot_path, f"{SNAPSHOT_TMP_PREFIX}{name}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        start = time.perf_counter()
+        timings = self.index_factory.save_index(tmp_dir, scalar_storage, index_map, progress)
+        save_seconds = time.perf_counter() - start
+        files = [file_entry(os.path.join(tmp_dir, file_name)) for file_name in sorted(os.listdir(tmp_dir))]
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "log_id": log_id,
+            "version": self.version,
+            "created_at": time.time(),
+            "files": files,
+            "save_seconds": timings,
+            "total_save_seconds": save_seconds,
+            "sync_seconds": time.perf_counter() - start - save_seconds,
+        }
+        write_manifest(tmp_dir, manifest)
+        fsync_dir(tmp_dir)
+
+        if os.path.exists(final_dir):
+            # 没有新的写入，已有相同日志ID的快照
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.info(f"Snapshot {name} already exists, skipping publish")
+        else:
+            os.rename(tmp_dir, final_dir)
+            fsync_dir(self.snapshot_path)
+            logger.info(f"Published snapshot {name}: {len(files)} files, "
+                        f"{sum(entry['bytes'] for entry in files)} bytes in {time.perf_counter() - start:.3f}s")
+        self.snapshot_dir = final_dir
+        self.last_snapshot_id = log_id
+
+        self._prune_snapshots()
+        self.release_wal_segments()
+        return manifest
+
+    def _prune_snapshots(self) -> None:
+        """只保留最新的 SNAPSHOT_KEEP_COUNT 个快照，删除残留的临时目录和旧版平铺快照"""
+        snapshots = list_snapshots(self.snapshot_path)
+        for _, path in snapshots[:-max(SNAPSHOT_KEEP_COUNT, 1)]:
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"Removed old snapshot {path}")
+
+        for name in os.listdir(self.snapshot_path):
+            path = os.path.join(self.snapshot_path, name)
+            if name.startswith(SNAPSHOT_TMP_PREFIX):
+                # 崩溃时未发布的快照
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isfile(path):
+                # 旧版快照直接写在快照根目录
+                os.remove(path)
+        if os.path.exists(SNAPSHOTS_MAX_LOG_ID):
+            os.remove(SNAPSHOTS_MAX_LOG_ID)
 
     def take_snapshot(self, scalar_storage) -> None:
         """
-        创建快照
+        创建快照，调用方需阻塞写入
         :param scalar_storage: 标量存储对象
         """
         logger.debug("Taking snapshot")
-        
-        self.last_snapshot_id = self.increase_id        
-        
-        self.index_factory.save_index(self.snapshot_path, scalar_storage)
-        self.save_last_snapshot_id()
+        self.save_snapshot(self.begin_snapshot(), scalar_storage)
+
+    def _select_snapshot(self) -> None:
+        """
+        选择最新的完整快照：清单存在且文件大小（可选 CRC32）一致，
+        不完整的快照跳过并回退到上一个。没有新版快照时读取旧版的快照ID文件
+        """
+        self.snapshot_dir = None
+        for log_id, path in reversed(list_snapshots(self.snapshot_path)):
+            try:
+                manifest = load_manifest(path, SNAPSHOT_VERIFY_CHECKSUMS)
+            except Exception as e:
+                logger.warning(f"Skipping invalid snapshot {path}: {str(e)}")
+                continue
+            self.snapshot_dir = path
+            self.last_snapshot_id = manifest["log_id"]
+            logger.info(f"Using snapshot {path} at log id {self.last_snapshot_id}")
+            break
+        if self.snapshot_dir is None:
+            self.load_last_snapshot_id()
+        # 被快照覆盖的 WAL 段可能已经删除，日志ID从快照ID继续
+        self.increase_id = max(self.increase_id, self.last_snapshot_id)
 
     def load_snapshot(self, scalar_storage) -> None:
         """
@@ -133,19 +508,10 @@ class Persistence:
         """
         logger.debug("Loading snapshot")
         
-        self.index_factory.load_index(self.snapshot_path, scalar_storage)
-
-    def save_last_snapshot_id(self) -> None:
-        """保存最后快照ID到文件"""
-        try:
-            with open(SNAPSHOTS_MAX_LOG_ID, "w") as f:
-                f.write(str(self.last_snapshot_id))
-            logger.debug(f"Save snapshot Max log ID {self.last_snapshot_id}")
-        except Exception as e:
-            logger.error(f"Failed to open file snapshots_MaxID for writing: {str(e)}")
+        self.index_factory.load_index(self.snapshot_dir or self.snapshot_path, scalar_storage)
 
     def load_last_snapshot_id(self) -> None:
-        """从文件加载最后快照ID"""
+        """从旧版的快照ID文件加载最后快照ID"""
         try:
             with open(SNAPSHOTS_MAX_LOG_ID, "r") as f:
                 self.last_snapshot_id = int(f.read().strip())
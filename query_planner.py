@@ -0,0 +1,69 @@
+import logging as logger
+from collections import Counter
+from typing import Optional
+
+from constants import SearchPlan
+
+
+class QueryPlanner:
+    """
+    根据过滤位图的基数选择搜索策略：
+    - 候选很少：直接对候选向量做精确计算
+    - 命中比例很高：不带过滤搜索更多结果，再按位图过滤
+    - 其他情况：将位图下推到索引内过滤
+    """
+
+    def __init__(self, brute_force_max_candidates: int, post_filter_min_selectivity: float,
+                 post_filter_overfetch: float):
+        """
+        初始化
+        :param brute_force_max_candidates: 精确计算的最大候选数
+        :param post_filter_min_selectivity: 采用先搜索再过滤的最小命中比例
+        :param post_filter_overfetch: 先搜索再过滤时的放大系数
+        """
+        self.brute_force_max_candidates = brute_force_max_candidates
+        self.post_filter_min_selectivity = post_filter_min_selectivity
+        self.post_filter_overfetch = post_filter_overfetch
+        self.plan_counts: Counter = Counter()
+
+    def plan(self, candidate_count: Optional[int], index_count: int, k: int) -> SearchPlan:
+        """
+        选择搜索策略
+        :param candidate_count: 过滤位图中的 ID 数量，None 表示没有过滤条件
+        :param index_count: 索引中的向量数量
+        :param k: 返回的最近邻数量
+        :return: 搜索策略
+        """
+        if candidate_count is None:
+            plan = SearchPlan.NO_FILTER
+        elif candidate_count <= max(self.brute_force_max_candidates, k):
+            plan = SearchPlan.BRUTE_FORCE
+        elif index_count > 0 and candidate_count / index_count >= self.post_filter_min_selectivity:
+            plan = SearchPlan.POST_FILTER
+        else:
+            plan = SearchPlan.IN_INDEX_FILTER
+
+        self.plan_counts[plan.value] += 1
+        logger.debug(
+            f"Search plan: {plan.value}, candidate_count={candidate_count}, "
+            f"index_count={index_count}, k={k}"
+        )
+        return plan
+
+    def post_filter_k(self, candidate_count: int, index_count: int, k: int) -> int:
+        """
+        计算先搜索再过滤时需要获取的结果数量
+        :param candidate_count: 过滤位图中的 ID 数量
+        :param index_count: 索引中的向量数量
+        :param k: 返回的最近邻数量
+        :return: 需要获取的结果数量
+        """
+        selectivity = min(1.0, candidate_count / index_count)
+        return min(index_count, int(k / selectivity * self.post_filter_overfetch) + 1)
+
+    def stats(self) -> dict:
+        """
+        获取各策略的使用次数
+        :return: 统计信息字典
+        """
+        return dict(self.plan_counts)
@@ -0,0 +1,77 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class RWLock:
+    """
+    读写锁：允许多个读者并发，写者独占。
+    写者优先，避免持续的搜索流量让写入饿死；同一线程可重入写锁。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+
+    def acquire_read(self) -> None:
+        """获取读锁"""
+        with self._cond:
+            # 持有写锁的线程可以直接读
+            if self._writer == threading.get_ident():
+                self._readers += 1
+                return
+            while self._writer is not None or self._writers_waiting > 0:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self) -> None:
+        """释放读锁"""
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        """获取写锁"""
+        ident = threading.get_ident()
+        with self._cond:
+            if self._writer == ident:
+                self._write_depth += 1
+                return
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers > 0:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = ident
+            self._write_depth = 1
+
+    def release_write(self) -> None:
+        """释放写锁"""
+        with self._cond:
+            self._write_depth -= 1
+            if self._write_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read_lock(self) -> Iterator[None]:
+        """读锁上下文管理器"""
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_lock(self) -> Iterator[None]:
+        """写锁上下文管理器"""
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
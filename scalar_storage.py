@@ -1,6 +1,17 @@
 import json
 import logging
-from rocksdict import Rdict
+import numpy as np
+from typing import Collection, Dict, List, Tuple
+from rocksdict import Rdict, WriteBatch
+
+
+def vector_key(id: int) -> bytes:
+    """
+    原始向量的存储键，向量以 float32 字节单独存储，重排时无需解析 JSON
+    :param id: 数据ID
+    :return: 存储键
+    """
+    return f"vector:{id}".encode('utf-8')
 
 
 class ScalarStorage:
@@ -28,7 +39,11 @@ class ScalarStorage:
         try:
             value = json.dumps(data).encode('utf-8')
             key = str(id).encode('utf-8')
-            self.db[key] = value
+            batch = WriteBatch()
+            batch.put(key, value)
+            if "vectors" in data:
+                batch.put(vector_key(id), np.asarray(data["vectors"], dtype=np.float32).tobytes())
+            self.db.write(batch)
         except Exception as e:
             logging.error(f"Failed to insert scalar: {str(e)}")
 
@@ -53,6 +68,108 @@ class ScalarStorage:
             logging.error(f"Failed to get scalar: {str(e)}")
             return {}
 
+    def insert_scalars(self, items: Dict[int, dict]) -> None:
+        """
+        批量插入标量数据，所有记录在一个 WriteBatch 中原子写入
+        :param items: 数据ID到字典数据的映射
+        """
+        if not items:
+            return
+        try:
+            batch = WriteBatch()
+            for id, data in items.items():
+                batch.put(str(id).encode('utf-8'), json.dumps(data).encode('utf-8'))
+                if "vectors" in data:
+                    batch.put(vector_key(id), np.asarray(data["vectors"], dtype=np.float32).tobytes())
+            self.db.write(batch)
+        except Exception as e:
+            logging.error(f"Failed to insert scalars: {str(e)}")
+            raise
+
+    def get_scalars(self, ids: List[int]) -> List[dict]:
+        """
+        批量获取标量数据（multi-get）
+        :param ids: 数据ID列表
+        :return: 与 ids 一一对应的字典数据列表，不存在的记录为空字典
+        """
+        if not ids:
+            return []
+        try:
+            keys = [str(id).encode('utf-8') for id in ids]
+            values = self.db.get(keys)
+            return [json.loads(value.decode('utf-8')) if value is not None else {}
+                    for value in values]
+        except Exception as e:
+            logging.error(f"Failed to get scalars: {str(e)}")
+            return [{} for _ in ids]
+
+    def insert_vectors(self, ids: List[int], vectors: np.ndarray, index_type: str,
+                       skip_records: Collection[int] = ()) -> None:
+        """
+        批量导入时写入原始向量和只含 id、index_type 的标量记录，避免把大矩阵编码成 JSON
+        :param ids: 数据ID列表
+        :param vectors: (n, d) float32 向量矩阵
+        :param index_type: 索引类型
+        :param skip_records: 只写原始向量、不覆盖标量记录的ID
+        """
+        if not ids:
+            return
+        try:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            batch = WriteBatch()
+            for id, vector in zip(ids, vectors):
+                if id not in skip_records:
+                    batch.put(str(id).encode('utf-8'),
+                              json.dumps({"id": id, "index_type": index_type}).encode('utf-8'))
+                batch.put(vector_key(id), vector.tobytes())
+            self.db.write(batch)
+        except Exception as e:
+            logging.error(f"Failed to insert vectors: {str(e)}")
+            raise
+
+    def delete_scalars(self, ids: List[int]) -> None:
+        """
+        批量删除标量数据和原始向量，在一个 WriteBatch 中原子删除
+        :param ids: 数据ID列表
+        """
+        if not ids:
+            return
+        try:
+            batch = WriteBatch()
+            for id in ids:
+                batch.delete(str(id).encode('utf-8'))
+                batch.delete(vector_key(id))
+            self.db.write(batch)
+        except Exception as e:
+            logging.error(f"Failed to delete scalars: {str(e)}")
+            raise
+
+    def get_vectors(self, ids: List[int]) -> Tuple[List[int], np.ndarray]:
+        """
+        批量获取原始向量（multi-get），缺少向量键的旧数据从标量记录中读取
+        :param ids: 数据ID列表
+        :return: (找到的ID列表, (n, d) float32 向量矩阵)
+        """
+        if not ids:
+            return [], np.empty((0, 0), dtype=np.float32)
+        try:
+            values = self.db.get([vector_key(id) for id in ids])
+            vectors = {id: np.frombuffer(value, dtype=np.float32)
+                       for id, value in zip(ids, values) if value is not None}
+
+            missing = [id for id in ids if id not in vectors]
+            for id, data in zip(missing, self.get_scalars(missing)):
+                if "vectors" in data:
+                    vectors[id] = np.asarray(data["vectors"], dtype=np.float32)
+
+            found = [id for id in ids if id in vectors]
+            if not found:
+                return [], np.empty((0, 0), dtype=np.float32)
+            return found, np.vstack([vectors[id] for id in found])
+        except Exception as e:
+            logging.error(f"Failed to get vectors: {str(e)}")
+            return [], np.empty((0, 0), dtype=np.float32)
+
     def put(self, key: str, value: str) -> None:
         """
         存储键值对
@@ -1,19 +1,42 @@
 from pydantic import BaseModel
-from typing import List, Optional, Any, Literal
+from typing import List, Optional, Any, Literal, Union
 from constants import IndexType
 
+# WAL 持久化级别：none 不等待写入，flush 写入操作系统，fsync 落盘；为空时使用服务端默认值
+DurabilityLevel = Optional[Literal["none", "flush", "fsync"]]
+
 
 class FilterCondition(BaseModel):
     fieldName: str
-    op: Literal["=", "!=", ">", "<", ">=", "<="]
-    value: Any
+    op: Literal["=", "!=", ">", "<", ">=", "<=", "exists", "not_exists"]
+    value: Any = None
+
+
+class FilterExpression(BaseModel):
+    """布尔过滤表达式：and/or 组合多个条件，not 对单个条件取反"""
+    op: Literal["and", "or", "not"]
+    conditions: List[Union[FilterCondition, "FilterExpression"]]
 
 
 class SearchRequest(BaseModel):
     vectors: List[float]
     k: int
     index_type: str = IndexType.FLAT
-    filter: Optional[FilterCondition] = None
+    filter: Optional[Union[FilterCondition, FilterExpression]] = None
+    nprobe: Optional[int] = None
+    ef: Optional[int] = None
+    rerank_factor: Optional[int] = None
+
+
+class BatchSearchRequest(BaseModel):
+    vectors: List[List[float]]
+    k: int
+    index_type: str = IndexType.FLAT.value
+    filter: Optional[Union[FilterCondition, FilterExpression]] = None
+    filters: Optional[List[Optional[Union[FilterCondition, FilterExpression]]]] = None
+    nprobe: Optional[int] = None
+    ef: Optional[int] = None
+    rerank_factor: Optional[int] = None
 
 
 class InsertRequest(BaseModel):
@@ -29,6 +52,17 @@ class SearchResponse(BaseModel):
     error_msg: Optional[str] = None
 
 
+class SearchResult(BaseModel):
+    vectors: List[int] = []
+    distances: List[float] = []
+
+
+class BatchSearchResponse(BaseModel):
+    retcode: int = 0
+    results: Optional[List[SearchResult]] = None
+    error_msg: Optional[str] = None
+
+
 class InsertResponse(BaseModel):
     retcode: int = 0
     error_msg: Optional[str] = None
@@ -38,6 +72,7 @@ class UpsertRequest(BaseModel):
     vectors: List[float]
     id: int
     index_type: str
+    durability: DurabilityLevel = None
 
     class Config:
         extra = "allow"
@@ -48,6 +83,52 @@ class UpsertResponse(BaseModel):
     error_msg: str = ""
 
 
+class UpsertRecord(BaseModel):
+    vectors: List[float]
+    id: int
+
+    class Config:
+        extra = "allow"
+
+
+class BatchUpsertRequest(BaseModel):
+    records: List[UpsertRecord]
+    index_type: str
+    durability: DurabilityLevel = None
+
+
+class BatchUpsertResponse(BaseModel):
+    retcode: int = 0
+    count: int = 0
+    error_msg: str = ""
+
+
+class DeleteRequest(BaseModel):
+    ids: List[int]
+    index_type: str
+    durability: DurabilityLevel = None
+
+
+class DeleteResponse(BaseModel):
+    retcode: int = 0
+    count: int = 0
+    error_msg: str = ""
+
+
+class BulkImportRequest(BaseModel):
+    """从服务端的 .npy 文件批量导入向量"""
+    index_type: str
+    path: str
+    labels_path: Optional[str] = None
+    start_id: int = 0
+
+
+class BulkImportResponse(BaseModel):
+    retcode: int = 0
+    count: int = 0
+    error_msg: str = ""
+
+
 class QueryRequest(BaseModel):
     id: int
 
@@ -59,6 +140,24 @@ class QueryResponse(BaseModel):
 
 
 class SnapshotResponse(BaseModel):
-    """快照响应"""
+    """快照响应，data 为快照任务状态"""
+    retcode: int = 0
+    data: dict = {}
+    error_msg: str = ""
+
+
+class TrainRequest(BaseModel):
+    index_type: str
+
+
+class TrainResponse(BaseModel):
+    """训练响应"""
+    retcode: int = 0
+    error_msg: str = ""
+
+
+class StatsResponse(BaseModel):
+    """统计信息响应"""
+    data: dict = {}
     retcode: int = 0
     error_msg: str = ""
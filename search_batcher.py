@@ -0,0 +1,157 @@
+import asyncio
+import logging as logger
+import time
+from typing import Dict, List, Set, Tuple
+
+from schemas import SearchRequest, BatchSearchRequest
+
+
+class SearchBatcher:
+    """
+    将并发的单向量 /search 请求按索引类型合并为一次矩阵搜索
+    """
+
+    def __init__(self, vector_database, executor, max_batch_size: int = 64, window_ms: float = 2):
+        """
+        初始化
+        :param vector_database: 向量数据库对象
+        :param executor: 执行批量搜索的 RequestExecutor
+        :param max_batch_size: 每批最多合并的查询数量，达到后立即执行
+        :param window_ms: 第一个请求入队后最长等待时间（毫秒）
+        """
+        self.vector_database = vector_database
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        # (索引类型, 维度, nprobe, ef, rerank_factor) -> [(请求, future, 入队时间)]
+        self.pending: Dict[tuple, List[Tuple[SearchRequest, asyncio.Future, float]]] = {}
+        self.timers: Dict[tuple, asyncio.TimerHandle] = {}
+        # 持有正在执行的批次任务的引用，避免被垃圾回收
+        self.tasks: Set[asyncio.Task] = set()
+
+        # 统计信息
+        self.batch_count = 0
+        self.query_count = 0
+        self.max_batch_size_seen = 0
+        self.total_queue_delay = 0.0
+        self.max_queue_delay = 0.0
+        self.fallback_count = 0
+
+    async def search(self, request: SearchRequest) -> tuple[list[int], list[float]]:
+        """
+        提交一个搜索请求并等待合批执行的结果
+        :param request: 搜索请求
+        :return: (ids, distances) 元组
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # 只有维度和搜索参数相同的请求才能合并，维度不同的请求无法组成 (nq, d) 矩阵
+        key = (request.index_type, len(request.vectors), request.nprobe, request.ef, request.rerank_factor)
+        batch = self.pending.setdefault(key, [])
+        batch.append((request, future, time.perf_counter()))
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: tuple) -> None:
+        """
+        取出一个批次并提交到读线程池执行
+        :param key: (索引类型, 维度, nprobe, ef, rerank_factor)
+        """
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self.pending.pop(key, [])
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run_batch(key, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run_batch(self, key: tuple, batch: list) -> None:
+        """
+        执行一个批次并将结果分发给等待中的请求
+        :param key: (索引类型, 维度, nprobe, ef, rerank_factor)
+        :param batch: 当前批次
+        """
+        now = time.perf_counter()
+        requests = [request for request, _, _ in batch]
+        k = max(request.k for request in requests)
+        batch_request = BatchSearchRequest(
+            vectors=[request.vectors for request in requests],
+            k=k,
+            index_type=key[0],
+            nprobe=key[2],
+            ef=key[3],
+            rerank_factor=key[4],
+            filters=[request.filter for request in requests],
+        )
+
+        self._record(batch, now)
+
+        try:
+            results = await self.executor.run_read(self.vector_database.search_batch, batch_request)
+        except Exception as e:
+            if len(batch) == 1:
+                _, future, _ = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # 整批失败时逐个重试，只有出错的请求返回错误
+            logger.warning(f"Batched search failed, retrying {len(batch)} requests individually: {str(e)}")
+            self.fallback_count += 1
+            await asyncio.gather(*(self._run_single(request, future) for request, future, _ in batch))
+            return
+
+        # 按各请求自己的 k 截断结果
+        for (request, future, _), (ids, distances) in zip(batch, results):
+            if not future.done():
+                future.set_result((ids[:request.k], distances[:request.k]))
+
+    async def _run_single(self, request: SearchRequest, future: asyncio.Future) -> None:
+        """
+        单独执行一个请求
+        :param request: 搜索请求
+        :param future: 请求对应的 future
+        """
+        try:
+            result = await self.executor.run_read(self.vector_database.search, request)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    def _record(self, batch: list, now: float) -> None:
+        """
+        记录批大小和排队延迟
+        :param batch: 当前批次
+        :param now: 批次开始执行的时间
+        """
+        delays = [now - enqueued_at for _, _, enqueued_at in batch]
+        self.batch_count += 1
+        self.query_count += len(batch)
+        self.max_batch_size_seen = max(self.max_batch_size_seen, len(batch))
+        self.total_queue_delay += sum(delays)
+        self.max_queue_delay = max(self.max_queue_delay, max(delays))
+        logger.debug(f"Flushing search batch: index_type={batch[0][0].index_type}, size={len(batch)}")
+
+    def stats(self) -> dict:
+        """
+        获取合批统计信息
+        :return: 统计信息字典
+        """
+        return {
+            "batches": self.batch_count,
+            "queries": self.query_count,
+            "avg_batch_size": self.query_count / self.batch_count if self.batch_count else 0.0,
+            "max_batch_size": self.max_batch_size_seen,
+            "avg_queue_delay_ms": self.total_queue_delay * 1000 / self.query_count if self.query_count else 0.0,
+            "max_queue_delay_ms": self.max_queue_delay * 1000,
+            "fallbacks": self.fallback_count,
+        }
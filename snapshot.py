@@ -0,0 +1,107 @@
+import os
+import re
+import json
+import zlib
+import logging as logger
+from typing import Any, Dict, List, Tuple
+
+
+# 快照目录名，按日志ID排序
+SNAPSHOT_DIR_PATTERN = re.compile(r"^snapshot-(\d{12})$")
+# 写入中的临时目录前缀，发布时原子地改名为快照目录
+SNAPSHOT_TMP_PREFIX = ".tmp-"
+MANIFEST_FILE = "MANIFEST.json"
+MANIFEST_FORMAT = 1
+
+
+def snapshot_dir_name(log_id: int) -> str:
+    """
+    快照目录名
+    :param log_id: 快照对应的日志ID
+    :return: 例如 snapshot-000000001024
+    """
+    return f"snapshot-{log_id:012d}"
+
+
+def fsync_dir(path: str) -> None:
+    """
+    fsync 目录，保证目录项（新建、改名）落盘
+    :param path: 目录路径
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def file_entry(path: str) -> Dict[str, Any]:
+    """
+    计算文件大小和 CRC32，同时 fsync 文件
+    :param path: 文件路径
+    :return: 清单中的文件项
+    """
+    crc = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            crc = zlib.crc32(chunk, crc)
+        os.fsync(f.fileno())
+    return {"name": os.path.basename(path), "bytes": os.path.getsize(path), "crc32": crc}
+
+
+def write_manifest(folder: str, manifest: Dict[str, Any]) -> None:
+    """
+    写入清单并 fsync
+    :param folder: 快照目录
+    :param manifest: 清单内容
+    """
+    with open(os.path.join(folder, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def list_snapshots(folder: str) -> List[Tuple[int, str]]:
+    """
+    列出已发布的快照目录
+    :param folder: 快照根目录
+    :return: 按日志ID排列的 (日志ID, 快照目录)
+    """
+    if not os.path.isdir(folder):
+        return []
+    snapshots = []
+    for name in os.listdir(folder):
+        match = SNAPSHOT_DIR_PATTERN.match(name)
+        if match:
+            snapshots.append((int(match.group(1)), os.path.join(folder, name)))
+    return sorted(snapshots)
+
+
+def load_manifest(path: str, verify_checksums: bool = False) -> Dict[str, Any]:
+    """
+    读取并校验快照清单：文件必须存在且大小一致，可选校验 CRC32
+    :param path: 快照目录
+    :param verify_checksums: 是否读取全部文件校验 CRC32
+    :return: 清单内容，清单缺失或文件不一致时抛出 ValueError
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"Missing {MANIFEST_FILE} in {path}")
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+
+    for entry in manifest["files"]:
+        file_path = os.path.join(path, entry["name"])
+        if not os.path.exists(file_path):
+            raise ValueError(f"Missing snapshot file {file_path}")
+        if os.path.getsize(file_path) != entry["bytes"]:
+            raise ValueError(f"Size mismatch for snapshot file {file_path}")
+        if verify_checksums:
+            crc = 0
+            with open(file_path, 'rb') as f:
+                while chunk := f.read(1 << 20):
+                    crc = zlib.crc32(chunk, crc)
+            if crc != entry["crc32"]:
+                raise ValueError(f"Checksum mismatch for snapshot file {file_path}")
+    logger.debug(f"Verified snapshot {path}")
+    return manifest
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+import vector_database as vector_database_module
+from constants import Durability, IndexType
+from vector_database import VectorDatabase
+from test_restart import data_path, open_database, close_database, upsert, search_ids  # noqa: F401
+
+
+def bulk_import(vector_database: VectorDatabase, path) -> int:
+    """与 /admin/bulk_import 接口相同：每块在写锁内写一条 WAL，导入在导入线程中执行"""
+    request = {"index_type": "FLAT", "path": str(path), "labels_path": None, "start_id": 100}
+    committed = []
+
+    def log_chunk(chunk: dict) -> None:
+        committed.append(vector_database.write_wal_log("bulk_import", {**request, **chunk}, Durability.FSYNC))
+
+    count = vector_database.start_bulk_import(str(path), None, 100, IndexType.FLAT, log_chunk).result()
+    for future in committed:
+        future.result()
+    return count
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(vector_database_module, "BULK_IMPORT_CHUNK_SIZE", 4)
+
+
+def test_bulk_import_replays_after_restart(data_path):
+    data = np.random.default_rng(0).random((10, 2), dtype=np.float32)
+    np.save(data_path / "vectors.npy", data)
+
+    vector_database = open_database(data_path)
+    assert bulk_import(vector_database, data_path / "vectors.npy") == 10
+    assert vector_database.bulk_import_progress == {"index_type": "FLAT", "state": "done", "done": 10, "total": 10}
+    close_database(vector_database)
+
+    vector_database = open_database(data_path)
+    # 10 个向量分 3 块写入 WAL
+    assert vector_database.recovery_stats["entries"] == 3
+    assert vector_database.recovery_stats["records"] == 10
+    index = vector_database.index_factory.get_index(IndexType.FLAT)
+    assert index.get_count() == 10
+    ids, distances = index.search_vectors(data[7].tolist(), 1)
+    assert (ids[0], distances[0]) == (107, 0.0)
+    close_database(vector_database)
+
+
+def test_rejected_import_is_not_logged(data_path):
+    np.save(data_path / "wrong_dim.npy", np.zeros((5, 3), dtype=np.float32))
+    np.save(data_path / "ints.npy", np.zeros((5, 2), dtype=np.int64))
+
+    vector_database = open_database(data_path)
+    with pytest.raises(ValueError, match="dimension 3"):
+        bulk_import(vector_database, data_path / "wrong_dim.npy")
+    with pytest.raises(ValueError, match="float matrix"):
+        bulk_import(vector_database, data_path / "ints.npy")
+    upsert(vector_database, {"id": 1, "vectors": [0.0, 1.0], "index_type": "FLAT", "price": 1})
+    close_database(vector_database)
+
+    # 被拒绝的导入没有写入 WAL，重启不受影响
+    vector_database = open_database(data_path)
+    assert vector_database.recovery_stats["entries"] == 1
+    assert search_ids(vector_database, "price", 1) == [1]
+    close_database(vector_database)
+
+
+def test_replay_skips_chunk_that_fails_to_apply(data_path, monkeypatch):
+    np.save(data_path / "vectors.npy", np.ones((6, 2), dtype=np.float32))
+    vector_database = open_database(data_path)
+    bulk_import(vector_database, data_path / "vectors.npy")
+    upsert(vector_database, {"id": 1, "vectors": [0.0, 1.0], "index_type": "FLAT", "price": 1})
+    close_database(vector_database)
+
+    original = VectorDatabase.bulk_import
+    failed = []
+
+    def fail_first_chunk(self, vectors, labels, index_type, log_chunk=None):
+        if not failed:
+            failed.append(True)
+            raise RuntimeError("simulated failure")
+        return original(self, vectors, labels, index_type, log_chunk)
+
+    monkeypatch.setattr(VectorDatabase, "bulk_import", fail_first_chunk)
+    vector_database = open_database(data_path)
+    # 第一块被跳过，其余的块和之后的写入照常回放
+    assert vector_database.recovery_stats["errors"] == 1
+    assert vector_database.index_factory.get_index(IndexType.FLAT).get_count() == 2 + 1
+    assert search_ids(vector_database, "price", 1) == [1]
+    close_database(vector_database)
+
+
+def test_replay_fails_when_file_changed(data_path):
+    path = data_path / "vectors.npy"
+    np.save(path, np.ones((6, 2), dtype=np.float32))
+    vector_database = open_database(data_path)
+    bulk_import(vector_database, path)
+    close_database(vector_database)
+
+    np.save(path, np.zeros((6, 2), dtype=np.float32))
+    with pytest.raises(RuntimeError, match="changed after the import"):
+        open_database(data_path)
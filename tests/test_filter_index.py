@@ -0,0 +1,77 @@
+from pyroaring import BitMap
+
+from constants import Operation
+from indexes.filter_index import FilterIndex
+
+
+def build_filter_index() -> FilterIndex:
+    """
+    id 1-5 的 price 分别为 10、20、20、30、40，id 6 没有 price 字段
+    :return: 过滤索引
+    """
+    filter_index = FilterIndex()
+    filter_index.add_live_ids(list(range(1, 7)))
+    filter_index.batch_update_int_field_filter([
+        ("price", None, price, id) for id, price in zip(range(1, 6), [10, 20, 20, 30, 40])
+    ])
+    return filter_index
+
+
+def test_range_operations():
+    filter_index = build_filter_index()
+
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.GREATER, 20) == BitMap([4, 5])
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.GREATER_EQUAL, 20) == BitMap([2, 3, 4, 5])
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.LESS, 20) == BitMap([1])
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.LESS_EQUAL, 25) == BitMap([1, 2, 3])
+    # 比较值不在已有取值中
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.GREATER, 100) == BitMap()
+
+
+def test_not_equal_excludes_documents_without_the_field():
+    filter_index = build_filter_index()
+
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.NOT_EQUAL, 20) == BitMap([1, 4, 5])
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.NOT_EQUAL, 99) == BitMap([1, 2, 3, 4, 5])
+
+
+def test_exists_and_not_exists():
+    filter_index = build_filter_index()
+
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.EXISTS, None) == BitMap([1, 2, 3, 4, 5])
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.NOT_EXISTS, None) == BitMap([6])
+    assert filter_index.get_int_field_filter_bitmap("color", Operation.NOT_EXISTS, None) == BitMap(range(1, 7))
+
+
+def test_remove_ids_drops_every_field_value():
+    filter_index = build_filter_index()
+    filter_index.remove_ids([2, 6])
+
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.EQUAL, 20) == BitMap([3])
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.NOT_EXISTS, None) == BitMap()
+    assert filter_index.get_all_ids_bitmap() == BitMap([1, 3, 4, 5])
+
+
+def test_cache_invalidated_only_when_result_changes():
+    filter_index = build_filter_index()
+    cache = filter_index.bitmap_cache
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.GREATER, 25) == BitMap([4, 5])
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.EQUAL, 10) == BitMap([1])
+
+    # 20 -> 22 不改变 > 25 和 = 10 的结果，两个缓存项都保留
+    filter_index.update_int_field_filter("price", 20, 22, 2)
+    assert cache.stats()["size"] == 2
+
+    # 22 -> 50 改变 > 25 的结果，只淘汰这一项
+    filter_index.update_int_field_filter("price", 22, 50, 2)
+    assert cache.stats()["size"] == 1
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.GREATER, 25) == BitMap([2, 4, 5])
+
+
+def test_cache_invalidated_when_live_ids_change():
+    filter_index = build_filter_index()
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.NOT_EXISTS, None) == BitMap([6])
+
+    # 新增的文档没有 price 字段，NOT_EXISTS 的结果依赖存活ID
+    filter_index.add_live_ids([7])
+    assert filter_index.get_int_field_filter_bitmap("price", Operation.NOT_EXISTS, None) == BitMap([6, 7])
@@ -0,0 +1,52 @@
+import numpy as np
+
+from constants import MetricType
+from indexes.hnsw_index import HNSWIndex
+
+
+def random_vectors(count: int, dim: int = 8) -> np.ndarray:
+    return np.random.default_rng(0).random((count, dim), dtype=np.float32)
+
+
+def test_delete_and_replace():
+    data = random_vectors(100)
+    index = HNSWIndex(8, 100, MetricType.L2)
+    index.insert_vectors_batch(data, list(range(100)))
+
+    index.remove_vectors([5, 6])
+    ids, _ = index.search_vectors(data[5].tolist(), 1)
+    assert ids[0] != 5
+    assert index.get_tombstone_count() == 2
+
+    # 同一标签再次写入时原地覆盖
+    index.insert_vectors_batch(data[5:6] + 10, [7])
+    ids, distances = index.search_vectors((data[5] + 10).tolist(), 1)
+    assert (ids[0], distances[0]) == (7, 0.0)
+    assert index.get_count() == 98
+
+
+def test_compaction_swap_catches_up_concurrent_writes():
+    data = random_vectors(700)
+    index = HNSWIndex(8, 100, MetricType.L2)
+    index.insert_vectors_batch(data[:500], list(range(500)))
+    index.remove_vectors(list(range(200)))
+
+    frozen = index.freeze()
+    index.start_tracking()
+    # 重建期间的写入和删除
+    index.insert_vectors_batch(data[500:], list(range(500, 700)))
+    index.remove_vectors([300, 301])
+    index.insert_vectors_batch(data[10:12], [10, 11])
+    index.insert_vectors_batch(data[:1] + 1, [400])
+    index.swap(frozen.rebuild(), frozen.labels)
+
+    expected = sorted((set(range(200, 700)) - {300, 301}) | {10, 11})
+    assert index.labels.to_array().tolist() == expected
+    assert index.get_tombstone_count() == 0
+
+    vectors = index.index.get_items(expected)
+    wanted = data[expected].copy()
+    wanted[expected.index(400)] = data[0] + 1
+    assert np.allclose(vectors, wanted)
+    ids, _ = index.search_vectors(data[600].tolist(), 1)
+    assert ids[0] == 600
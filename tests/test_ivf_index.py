@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from constants import IndexType
+from indexes.ivf_index import IVFIndex
+
+
+def random_vectors(count: int, dim: int = 8) -> np.ndarray:
+    return np.random.default_rng(0).random((count, dim), dtype=np.float32)
+
+
+def retrain(index: IVFIndex, load_original=None) -> None:
+    frozen = index.freeze()
+    index.start_tracking()
+    index.swap(frozen.populate(frozen.train(load_original=load_original), load_original), load_original)
+
+
+@pytest.mark.parametrize("trained_first", [False, True])
+def test_swap_catches_up_writes_during_training(trained_first):
+    data = random_vectors(600)
+    index = IVFIndex(8, IndexType.IVF_FLAT, nlist=10, train_size=10 ** 9)
+    index.insert_vectors_batch(data[:500], list(range(500)))
+    if trained_first:
+        retrain(index)
+
+    frozen = index.freeze()
+    index.start_tracking()
+    # 训练期间的写入和删除
+    index.insert_vectors_batch(data[500:], list(range(500, 600)))
+    index.remove_vectors(list(range(10)))
+    index.insert_vectors_batch(data[3:4], [3])
+    index.remove_vectors([550])
+    index.swap(frozen.populate(frozen.train()))
+
+    assert index.is_trained
+    ids = np.sort(index.get_ids())
+    expected = sorted((set(range(600)) - set(range(10)) - {550}) | {3})
+    assert ids.tolist() == expected
+    assert np.allclose(index.index.reconstruct_batch(ids), data[ids])
+
+
+def test_load_vectors_prefers_original_vectors():
+    data = random_vectors(500)
+    index = IVFIndex(8, IndexType.IVF_SQ8, nlist=4, train_size=10 ** 9)
+    index.insert_vectors_batch(data, list(range(500)))
+
+    def load_original(ids):
+        # 模拟标量存储：只保存了偶数 id 的原始向量
+        found = [id for id in ids if id % 2 == 0]
+        return found, data[found]
+
+    retrain(index, load_original)
+    ids = np.arange(10, dtype='int64')
+    vectors = index._load_vectors(ids, load_original)
+    # 偶数 id 取原始向量，奇数 id 退回到有损的 SQ8 重建
+    assert np.array_equal(vectors[::2], data[0:10:2])
+    assert np.array_equal(vectors[1::2], index.index.reconstruct_batch(ids[1::2]))
+    assert not np.allclose(vectors[1::2], data[1:10:2])
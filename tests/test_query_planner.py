@@ -0,0 +1,37 @@
+import pytest
+
+from constants import SearchPlan
+from query_planner import QueryPlanner
+
+
+@pytest.fixture
+def planner():
+    return QueryPlanner(brute_force_max_candidates=100, post_filter_min_selectivity=0.5, post_filter_overfetch=2.0)
+
+
+@pytest.mark.parametrize("candidate_count, index_count, k, expected", [
+    (None, 10000, 10, SearchPlan.NO_FILTER),
+    (0, 10000, 10, SearchPlan.BRUTE_FORCE),
+    (100, 10000, 10, SearchPlan.BRUTE_FORCE),
+    # 候选数不超过 k 时总是精确计算
+    (150, 10000, 200, SearchPlan.BRUTE_FORCE),
+    (1000, 10000, 10, SearchPlan.IN_INDEX_FILTER),
+    (5000, 10000, 10, SearchPlan.POST_FILTER),
+    (9000, 10000, 10, SearchPlan.POST_FILTER),
+])
+def test_plan(planner, candidate_count, index_count, k, expected):
+    assert planner.plan(candidate_count, index_count, k) == expected
+
+
+def test_post_filter_k_scales_with_selectivity(planner):
+    assert planner.post_filter_k(5000, 10000, 10) == 41
+    assert planner.post_filter_k(10000, 10000, 10) == 21
+    # 不超过索引中的向量数量
+    assert planner.post_filter_k(5000, 10000, 8000) == 10000
+
+
+def test_plan_counts(planner):
+    planner.plan(None, 100, 10)
+    planner.plan(None, 100, 10)
+    planner.plan(5, 100, 10)
+    assert planner.stats() == {"no_filter": 2, "brute_force": 1}
@@ -0,0 +1,108 @@
+from typing import Any, Dict, List
+
+import pytest
+
+from constants import IndexType
+from indexes.index_factory import IndexFactory
+from schemas import SearchRequest, FilterCondition
+from vector_database import VectorDatabase
+
+
+def open_database(path) -> VectorDatabase:
+    """
+    在临时目录中打开数据库并回放快照和 WAL，相当于一次进程重启
+    :param path: 数据目录
+    :return: 向量数据库
+    """
+    index_factory = IndexFactory()
+    index_factory.init(IndexType.FLAT, 2)
+    index_factory.init(IndexType.FILTER)
+    vector_database = VectorDatabase(index_factory, str(path / "db"), str(path / "wal.log"),
+                                     str(path / "snapshots"), "1.0")
+    vector_database.reload_database()
+    return vector_database
+
+
+def close_database(vector_database: VectorDatabase) -> None:
+    """
+    关闭数据库，释放 WAL 和 RocksDB
+    :param vector_database: 向量数据库
+    """
+    vector_database.maintenance_pool.shutdown(wait=True)
+    vector_database.snapshot_pool.shutdown(wait=True)
+    vector_database.import_pool.shutdown(wait=True)
+    vector_database.persistence.close()
+    vector_database.scalar_storage.db.close()
+    del vector_database.scalar_storage.db
+
+
+def upsert(vector_database: VectorDatabase, data: Dict[str, Any]) -> None:
+    """与 /upsert 接口相同：同一个写锁内写 WAL 并更新"""
+    with vector_database.rw_lock.write_lock():
+        committed = vector_database.write_wal_log("upsert", data)
+        vector_database.upsert(data["id"], data, IndexType.FLAT)
+    committed.result()
+
+
+def batch_upsert(vector_database: VectorDatabase, records: List[Dict[str, Any]]) -> None:
+    """与 /batch_upsert 接口相同：整个批次写一条 WAL"""
+    with vector_database.rw_lock.write_lock():
+        committed = vector_database.write_wal_log("batch_upsert", {"records": records, "index_type": "FLAT"})
+        vector_database.upsert_batch(records, IndexType.FLAT)
+    committed.result()
+
+
+def search_ids(vector_database: VectorDatabase, field_name: str, value: int) -> List[int]:
+    """
+    按整数字段过滤搜索
+    :return: 命中的 id
+    """
+    ids, _ = vector_database.search(SearchRequest(
+        vectors=[0.0, 0.0], k=10, index_type="FLAT",
+        filter=FilterCondition(fieldName=field_name, op="=", value=value),
+    ))
+    return sorted(id for id in ids if id != -1)
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_restart_removes_stale_filter_values(data_path, batched):
+    vector_database = open_database(data_path)
+    records = [{"id": id, "vectors": [float(id), 0.0], "index_type": "FLAT", "price": id} for id in range(1, 6)]
+    batch_upsert(vector_database, records)
+    vector_database.take_snapshot()
+
+    # 快照之后修改过滤字段，只记录在 WAL 中
+    changed = {"id": 4, "vectors": [4.0, 0.0], "index_type": "FLAT", "price": 999}
+    if batched:
+        batch_upsert(vector_database, [changed])
+    else:
+        upsert(vector_database, changed)
+    assert search_ids(vector_database, "price", 4) == []
+    close_database(vector_database)
+
+    vector_database = open_database(data_path)
+    assert search_ids(vector_database, "price", 4) == []
+    assert search_ids(vector_database, "price", 999) == [4]
+    assert search_ids(vector_database, "price", 3) == [3]
+    close_database(vector_database)
+
+
+def test_restart_returns_the_same_vectors(data_path):
+    vector_database = open_database(data_path)
+    upsert(vector_database, {"id": 1, "vectors": [0.1, 0.2], "index_type": "FLAT", "price": 1})
+    batch_upsert(vector_database, [{"id": 2, "vectors": [0.3, 0.7], "index_type": "FLAT", "price": 2}])
+    live = [vector_database.query(1), vector_database.query(2)]
+    close_database(vector_database)
+
+    # 重启前后查询结果完全一致，包括 float32 精度的向量
+    vector_database = open_database(data_path)
+    assert vector_database.recovery_stats["records"] == 2
+    assert [vector_database.query(1), vector_database.query(2)] == live
+    assert search_ids(vector_database, "price", 2) == [2]
+    close_database(vector_database)
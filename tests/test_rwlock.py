@@ -0,0 +1,94 @@
+import threading
+import time
+
+from rwlock import RWLock
+
+
+def run_in_thread(target) -> threading.Thread:
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_run_concurrently():
+    lock = RWLock()
+    inside = threading.Barrier(2, timeout=5)
+
+    def read():
+        with lock.read_lock():
+            # 两个读者都进入读锁后才能通过
+            inside.wait()
+
+    threads = [run_in_thread(read) for _ in range(2)]
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+
+def test_writer_excludes_readers():
+    lock = RWLock()
+    events = []
+
+    def read():
+        with lock.read_lock():
+            events.append("read")
+
+    with lock.write_lock():
+        reader = run_in_thread(read)
+        time.sleep(0.1)
+        assert events == []
+        events.append("write")
+    reader.join(timeout=5)
+    assert events == ["write", "read"]
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    events = []
+    first_reader_release = threading.Event()
+
+    def first_reader():
+        with lock.read_lock():
+            events.append("read1")
+            first_reader_release.wait(5)
+
+    def writer():
+        with lock.write_lock():
+            events.append("write")
+
+    def second_reader():
+        with lock.read_lock():
+            events.append("read2")
+
+    threads = [run_in_thread(first_reader)]
+    time.sleep(0.05)
+    threads.append(run_in_thread(writer))
+    time.sleep(0.05)
+    threads.append(run_in_thread(second_reader))
+    time.sleep(0.05)
+    # 写者优先：有写者等待时新的读者不能进入
+    assert events == ["read1"]
+
+    first_reader_release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert events == ["read1", "write", "read2"]
+
+
+def test_write_lock_is_reentrant_and_allows_reads():
+    lock = RWLock()
+    with lock.write_lock():
+        with lock.write_lock():
+            with lock.read_lock():
+                pass
+
+    # 完全释放后其他线程可以获取写锁
+    acquired = []
+
+    def write():
+        with lock.write_lock():
+            acquired.append(True)
+
+    thread = run_in_thread(write)
+    thread.join(timeout=5)
+    assert acquired == [True]
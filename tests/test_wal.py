@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+
+from constants import Durability
+from wal import WAL_MAGIC, encode_record, decode_payload, read_records, GroupCommitWriter
+
+
+def test_encode_decode_single_upsert():
+    data = {"id": 7, "vectors": [0.1, 0.2, 0.3], "index_type": "FLAT", "price": 4}
+    log_id, version, operation_type, decoded = decode_payload(encode_record(42, "1.0", "upsert", data)[8:])
+
+    assert (log_id, version, operation_type) == (42, "1.0", "upsert")
+    assert decoded["id"] == 7 and decoded["price"] == 4
+    # 向量以 float32 存储
+    assert decoded["vectors"] == np.array([0.1, 0.2, 0.3], dtype=np.float32).tolist()
+
+
+def test_encode_decode_batch_upsert():
+    records = [{"id": id, "vectors": [float(id), 1.0], "tag": id % 2} for id in range(3)]
+    data = {"records": records, "index_type": "HNSW"}
+    _, _, operation_type, decoded = decode_payload(encode_record(1, "1.0", "batch_upsert", data)[8:])
+
+    assert operation_type == "batch_upsert"
+    assert decoded == data
+
+
+def test_encode_decode_without_vectors():
+    data = {"ids": [1, 2, 3], "index_type": "FLAT"}
+    _, _, operation_type, decoded = decode_payload(encode_record(3, "1.0", "delete", data)[8:])
+    assert (operation_type, decoded) == ("delete", data)
+
+
+def test_read_records_stops_at_torn_tail():
+    records = [encode_record(i, "1.0", "delete", {"ids": [i]}) for i in range(3)]
+    # 最后一条记录只写了一半
+    file = io.BytesIO(b"".join(records) + records[0][:len(records[0]) // 2])
+
+    payloads = [payload for _, _, payload in read_records(file)]
+    assert [decode_payload(payload)[0] for payload in payloads] == [0, 1, 2]
+
+
+def test_read_records_stops_at_crc_mismatch():
+    records = [encode_record(i, "1.0", "delete", {"ids": [i]}) for i in range(3)]
+    corrupted = bytearray(records[1])
+    corrupted[-1] ^= 0xFF
+    file = io.BytesIO(records[0] + bytes(corrupted) + records[2])
+
+    assert [decode_payload(payload)[0] for _, _, payload in read_records(file)] == [0]
+
+
+def test_group_commit_writer(tmp_path):
+    path = tmp_path / "wal.log"
+    with open(path, "ab") as file:
+        file.write(WAL_MAGIC)
+        writer = GroupCommitWriter(file)
+        futures = [writer.append(encode_record(i, "1.0", "delete", {"ids": [i]}), durability)
+                   for i, durability in enumerate([Durability.NONE, Durability.FLUSH, Durability.FSYNC] * 10)]
+        for future in futures:
+            future.result(timeout=10)
+        writer.sync()
+        stats = writer.stats()
+        writer.close()
+
+    assert stats["records"] == 30
+    assert stats["fsyncs"] >= 1
+    assert stats["avg_group_size"] >= 1
+
+    with open(path, "rb") as file:
+        assert file.read(len(WAL_MAGIC)) == WAL_MAGIC
+        assert [decode_payload(payload)[0] for _, _, payload in read_records(file)] == list(range(30))
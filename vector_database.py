@@ -1,16 +1,30 @@
+import json
+import queue
+import threading
+import time
+import zlib
 import logging as logger
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
 import numpy as np
-from typing import Dict, Any, List
+from typing import Callable, Dict, Any, List, Optional, Union
+from pyroaring import BitMap
 
 from persistence import Persistence
+from rwlock import RWLock
+from query_planner import QueryPlanner
 from scalar_storage import ScalarStorage
 from indexes.index_factory import IndexFactory
 from indexes.faiss_index import FaissIndex
 from indexes.hnsw_index import HNSWIndex
+from indexes.bitmap_cache import Predicate
 
-from schemas import SearchRequest
-from constants import IndexType, Operation
+from schemas import SearchRequest, BatchSearchRequest, FilterCondition, FilterExpression
+from constants import IndexType, Operation, SearchPlan, BRUTE_FORCE_MAX_CANDIDATES, \
+    POST_FILTER_MIN_SELECTIVITY, POST_FILTER_OVERFETCH, VECTOR_INDEX_TYPES, IVF_INDEX_TYPES, \
+    HNSW_COMPACT_MIN_TOMBSTONES, HNSW_COMPACT_TOMBSTONE_RATIO, BULK_IMPORT_CHUNK_SIZE, BULK_IMPORT_THREADS, \
+    WAL_REPLAY_BATCH_SIZE, WAL_REPLAY_QUEUE_SIZE, SNAPSHOT_WAL_MAX_BYTES, SNAPSHOT_INTERVAL_SECONDS, \
+    SNAPSHOT_CHECK_INTERVAL_SECONDS
 
 
 class VectorDatabase:
@@ -28,42 +42,173 @@ class VectorDatabase:
         self.index_factory = index_factory
         self.version = version
         self.persistence = Persistence()
+        self.persistence.version = version
         self.persistence.init(index_factory, wal_path, snapshot_folder_path)
+        # 多个搜索可以并发执行，写入（upsert、WAL）独占；快照复制索引时阻塞写入但不阻塞搜索
+        self.rw_lock = RWLock()
+        self.query_planner = QueryPlanner(BRUTE_FORCE_MAX_CANDIDATES, POST_FILTER_MIN_SELECTIVITY,
+                                          POST_FILTER_OVERFETCH)
+        # 后台维护任务（HNSW 墓碑重建、IVF 自动训练），同一时间最多一个
+        self.maintenance_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lvdb-maintenance")
+        self._maintenance_lock = threading.Lock()
+        self._compaction_pending = False
+        # 每种 IVF 索引排队或执行中的训练任务
+        self._training_pending: Dict[IndexType, Future] = {}
+        # 重建和训练会记录期间的写入并在替换时追平，同一时间只能有一个
+        self._rebuild_lock = threading.Lock()
+        # 串行化内存映射索引的读入，避免并发写入各自读一份
+        self._materialize_lock = threading.Lock()
+        # 批量导入在独立线程中执行，同一时间最多一个；最近一次导入的进度
+        self.import_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lvdb-import")
+        self.bulk_import_progress: Dict[str, Any] = {}
+        # 启动时 WAL 回放的统计
+        self.recovery_stats: Dict[str, Any] = {}
+        # 后台快照任务，同一时间最多一个
+        self.snapshot_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lvdb-snapshot")
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_future: Optional[Future] = None
+        self.snapshot_status: Dict[str, Any] = {"state": "idle"}
+        self._last_snapshot_time = time.time()
+        self._snapshot_scheduler: Optional[threading.Thread] = None
+        self._scheduler_stop = threading.Event()
 
     def reload_database(self) -> None:
         """重新加载数据库"""
         logger.info("Entering VectorDatabase::reload_database()")
 
         self.persistence.load_snapshot(self.scalar_storage)
+        self._replay_wal()
+
+    def _replay_wal(self) -> None:
+        """
+        回放快照之后的 WAL：后台线程读取并解析日志，当前线程把连续的 upsert / batch_upsert
+        合并为批次（同一 id 只保留最后一次写入），按批调用 upsert_batch；
+        delete 和 bulk_import 前先应用已合并的批次，保证顺序
+        """
+        entries: queue.Queue = queue.Queue(maxsize=WAL_REPLAY_QUEUE_SIZE)
+
+        def read() -> None:
+            try:
+                while True:
+                    # 读取下一条WAL日志
+                    result = self.persistence.read_next_wal_log()
+                    if result is None:
+                        break
+                    entries.put(result)
+            finally:
+                entries.put(None)
+
+        reader = threading.Thread(target=read, name="lvdb-wal-reader", daemon=True)
+        start = time.perf_counter()
+        reader.start()
+
+        stats = {"entries": 0, "records": 0, "collapsed": 0, "batches": 0, "errors": 0}
+        # id -> (索引类型, 记录)；不同 id 之间互不影响，可以按索引类型分组批量应用
+        pending: Dict[int, tuple[IndexType, Dict[str, Any]]] = {}
+
+        def flush() -> None:
+            if not pending:
+                return
+            groups: Dict[IndexType, List[Dict[str, Any]]] = {}
+            for index_type, record in pending.values():
+                groups.setdefault(index_type, []).append(record)
+            # 标量存储已是最新状态，upsert 从中取到的"旧值"并不是快照过滤索引中的值；
+            # 先把这些 id 从过滤索引中移除，再按新值加入，避免快照中的旧值残留
+            filter_index = self.index_factory.get_index(IndexType.FILTER)
+            if filter_index:
+                with self.rw_lock.write_lock():
+                    filter_index.remove_ids(list(pending.keys()))
+            pending.clear()
+
+            for index_type, records in groups.items():
+                stats["batches"] += 1
+                try:
+                    self.materialize_index(index_type)
+                    self.upsert_batch(records, index_type)
+                except Exception as e:
+                    # 整批失败时逐条应用，只跳过出错的记录
+                    logger.error(f"Error replaying WAL batch, falling back to single upserts: {str(e)}")
+                    for record in records:
+                        try:
+                            self.upsert(record["id"], record, index_type)
+                        except Exception as e:
+                            stats["errors"] += 1
+                            logger.error(f"Error processing WAL log entry: {str(e)}")
 
         while True:
-            # 读取下一条WAL日志
-            result = self.persistence.read_next_wal_log()
+            result = entries.get()
             if result is None:
                 break
-                
             operation_type, json_data = result
-            logger.info(f"Operation Type: {operation_type}")
-            logger.info(f"Read Line: {json_data}")
+            stats["entries"] += 1
+            logger.debug(f"Replaying WAL entry: {operation_type}")
 
-            if operation_type == "upsert":
-                try:
-                    id = json_data["id"]
-                    index_type = self._get_index_type_from_request(json_data)
-                    
-                    # 调用upsert接口重建数据
-                    self.upsert(id, json_data, index_type)
-                except Exception as e:
-                    logger.error(f"Error processing WAL log entry: {str(e)}")
-                    continue
+            try:
+                index_type = self._get_index_type_from_request(json_data)
+                if operation_type in ("upsert", "batch_upsert"):
+                    records = [json_data] if operation_type == "upsert" else json_data["records"]
+                    for record in records:
+                        stats["records"] += 1
+                        previous = pending.get(record["id"])
+                        if previous and previous[0] != index_type:
+                            # 同一 id 先后写入不同索引，标量数据以后写入的为准，需要保持顺序
+                            flush()
+                        elif previous:
+                            stats["collapsed"] += 1
+                        pending[record["id"]] = (index_type, record)
+                    if len(pending) >= WAL_REPLAY_BATCH_SIZE:
+                        flush()
+                elif operation_type == "bulk_import":
+                    flush()
+                    vectors, labels = self.open_bulk_import_file(json_data["path"], json_data.get("labels_path"),
+                                                                 json_data.get("start_id", 0), index_type,
+                                                                 json_data.get("offset", 0), json_data.get("end"),
+                                                                 json_data.get("checksum"))
+                    try:
+                        stats["records"] += self.bulk_import(vectors, labels, index_type)
+                    except Exception as e:
+                        # 文件完好但这一块无法应用时只跳过这一块
+                        stats["errors"] += 1
+                        logger.error(f"Error replaying bulk import of {json_data['path']} rows "
+                                     f"[{json_data.get('offset', 0)}, {json_data.get('end')}): {str(e)}")
+                elif operation_type == "delete":
+                    # 只有删除的 id 尚未应用时才需要先应用合并的批次
+                    if any(id in pending for id in json_data["ids"]):
+                        flush()
+                    stats["records"] += len(json_data["ids"])
+                    self.materialize_index(index_type)
+                    self.delete(json_data["ids"], index_type)
+                else:
+                    logger.warning(f"Unknown WAL operation type: {operation_type}")
+            except Exception as e:
+                if operation_type == "bulk_import":
+                    # 导入文件缺失、无法打开或被修改时无法恢复出一致的数据，终止回放
+                    logger.error(f"Cannot replay bulk import of {json_data.get('path')}: {str(e)}")
+                    raise
+                stats["errors"] += 1
+                logger.error(f"Error processing WAL log entry: {str(e)}")
+                continue
+        flush()
+        reader.join()
 
-    def write_wal_log(self, operation_type: str, json_data: Dict[str, Any]) -> None:
+        elapsed = time.perf_counter() - start
+        stats["seconds"] = elapsed
+        stats["records_per_second"] = stats["records"] / elapsed if elapsed > 0 else 0.0
+        self.recovery_stats = stats
+        logger.info(f"Replayed {stats['entries']} WAL entries ({stats['records']} records, "
+                    f"{stats['collapsed']} collapsed, {stats['batches']} batches, {stats['errors']} errors) "
+                    f"in {elapsed:.3f}s, {stats['records_per_second']:.0f} records/s")
+
+    def write_wal_log(self, operation_type: str, json_data: Dict[str, Any],
+                      durability: Optional[str] = None) -> Future:
         """
         写入WAL日志
         :param operation_type: 操作类型
         :param json_data: JSON数据
+        :param durability: 持久化级别 none / flush / fsync，为空时使用默认级别
+        :return: 日志达到该持久化级别时完成的 Future
         """
-        self.persistence.write_wal_log(operation_type, json_data, self.version)
+        return self.persistence.write_wal_log(operation_type, json_data, self.version, durability)
 
     def _get_index_type_from_request(self, json_request: Dict[str, Any]) -> IndexType:
         """
@@ -72,13 +217,23 @@ class VectorDatabase:
         :return: 索引类型
         """
         if "index_type" in json_request:
-            index_type_str = json_request["index_type"]
-            if index_type_str == IndexType.FLAT.value:
-                return IndexType.FLAT
-            elif index_type_str == IndexType.HNSW.value:
-                return IndexType.HNSW
+            return self._get_index_type(json_request["index_type"])
         return IndexType.UNKNOWN
 
+    def materialize_index(self, index_type: IndexType) -> None:
+        """
+        内存映射加载的只读索引在第一次写入前读入内存。读文件在写锁外进行，写锁内只替换引用；
+        写入路径在获取写锁之前调用，索引已经可写时不做任何事
+        :param index_type: 即将写入的索引类型
+        """
+        index = self.index_factory.get_index(index_type)
+        if not getattr(index, "mmapped", False):
+            return
+        with self._materialize_lock:
+            writable = index.load_writable()
+            with self.rw_lock.write_lock():
+                index.adopt_writable(writable)
+
     def upsert(self, id: int, data: Dict[str, Any], index_type: IndexType) -> None:
         """
         更新或插入向量
@@ -86,53 +241,374 @@ class VectorDatabase:
         :param data: 包含向量数据的字典
         :param index_type: 索引类型
         """
-        # 检查是否存在现有向量
+        with self.rw_lock.write_lock():
+            # 检查是否存在现有向量
+            try:
+                existing_data = self.scalar_storage.get_scalar(id)
+            except Exception:
+                existing_data = {}
+
+            index = self.index_factory.get_index(index_type)
+            if not index:
+                raise ValueError(f"Index type {index_type} not initialized")
+
+            # 如果存在现有向量，从 IVF 索引中删除（FLAT 和 HNSW 插入时原地覆盖，无需删除）
+            if existing_data and index_type in IVF_INDEX_TYPES:
+                index.remove_vectors([id])
+
+            # 插入新向量
+            new_vector = np.array(data["vectors"], dtype=np.float32)
+            index.insert_vectors(new_vector, id)
+
+            # 支持过滤索引
+            filter_index = self.index_factory.get_index(IndexType.FILTER)
+            if filter_index:
+                filter_index.add_live_ids([id])
+                for field_name, value in data.items():
+                    if isinstance(value, int) and field_name != "id":
+
+                        # 获取旧值（如果存在）
+                        old_value = None
+                        if existing_data and field_name in existing_data:
+                            old_value = existing_data[field_name]
+
+                        # 更新过滤器
+                        filter_index.update_int_field_filter(
+                            field_name=field_name,
+                            old_value=old_value,
+                            new_value=value,
+                            id=id
+                        )
+
+            # 更新标量存储；向量按 float32 存储，与 WAL 回放后的数据保持一致
+            self.scalar_storage.insert_scalar(id, {**data, "vectors": new_vector.tolist()})
+
+            if index_type in IVF_INDEX_TYPES:
+                self._maybe_train_ivf(index_type, index)
+
+    def upsert_batch(self, records: List[Dict[str, Any]], index_type: IndexType) -> None:
+        """
+        批量更新或插入向量
+        :param records: 记录列表，每条记录包含 id、vectors 及标量字段
+        :param index_type: 索引类型
+        """
+        with self.rw_lock.write_lock():
+            index = self.index_factory.get_index(index_type)
+            if not index:
+                raise ValueError(f"Index type {index_type} not initialized")
+
+            # 同一批次内重复的 id 只保留最后一次写入
+            batch: Dict[int, Dict[str, Any]] = {}
+            for data in records:
+                batch[data["id"]] = {**data, "index_type": index_type.value}
+            if not batch:
+                return
+            ids = list(batch.keys())
+
+            # 一次 multi-get 读取已有数据
+            existing_list = self.scalar_storage.get_scalars(ids)
+            existing_map = {id: existing for id, existing in zip(ids, existing_list) if existing}
+
+            # 从 IVF 索引中删除已存在的向量，FLAT 和 HNSW 插入时原地覆盖
+            if existing_map and index_type in IVF_INDEX_TYPES:
+                index.remove_vectors(list(existing_map.keys()))
+
+            # 一次性插入 (N, d) 矩阵
+            new_vectors = np.array([batch[id]["vectors"] for id in ids], dtype=np.float32)
+            index.insert_vectors_batch(new_vectors, ids)
+            # 向量按 float32 存储，与 WAL 回放后的数据保持一致
+            for id, vector in zip(ids, new_vectors.tolist()):
+                batch[id]["vectors"] = vector
+
+            # 批量更新过滤索引
+            filter_index = self.index_factory.get_index(IndexType.FILTER)
+            if filter_index:
+                updates = []
+                for id, data in batch.items():
+                    existing_data = existing_map.get(id, {})
+                    for field_name, value in data.items():
+                        if isinstance(value, int) and field_name != "id":
+                            updates.append((field_name, existing_data.get(field_name), value, id))
+                filter_index.batch_update_int_field_filter(updates)
+                filter_index.add_live_ids(ids)
+
+            # 一次 WriteBatch 更新标量存储
+            self.scalar_storage.insert_scalars(batch)
+
+            if index_type in IVF_INDEX_TYPES:
+                self._maybe_train_ivf(index_type, index)
+
+    def bulk_import_file(self, path: str, labels_path: Optional[str], start_id: int, index_type: IndexType,
+                         log_chunk: Optional[Callable[[Dict[str, Any]], None]] = None) -> int:
+        """
+        以内存映射方式打开 .npy 文件并批量导入，文件不会一次性读入内存
+        :param path: (N, d) 浮点向量矩阵的 .npy 文件路径
+        :param labels_path: 可选的标签 .npy 文件路径，为空时标签为 start_id 起的连续整数
+        :param start_id: 起始标签
+        :param index_type: 索引类型
+        :param log_chunk: 每块导入前在写锁内调用，参数为该块的 offset、end 和 checksum
+        :return: 导入的向量数量
+        """
+        vectors, labels = self.open_bulk_import_file(path, labels_path, start_id, index_type)
+
+        def log(start: int, stop: int, chunk_checksum: int) -> None:
+            log_chunk({"offset": start, "end": stop, "checksum": chunk_checksum})
+
+        return self.bulk_import(vectors, labels, index_type, log if log_chunk else None)
+
+    def start_bulk_import(self, path: str, labels_path: Optional[str], start_id: int, index_type: IndexType,
+                          log_chunk: Optional[Callable[[Dict[str, Any]], None]] = None) -> Future:
+        """
+        在导入线程中执行 bulk_import_file，不占用处理写入的线程，
+        块之间其他写入可以进入写锁；进度见 bulk_import_progress
+        :return: 完成时结果为导入数量的 Future
+        """
+        return self.import_pool.submit(self.bulk_import_file, path, labels_path, start_id, index_type, log_chunk)
+
+    def open_bulk_import_file(self, path: str, labels_path: Optional[str], start_id: int, index_type: IndexType,
+                              offset: int = 0, end: Optional[int] = None,
+                              checksum: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        以内存映射方式打开导入文件并检查，写入 WAL 之前调用，避免无法应用的导入进入日志
+        :param path: 向量 .npy 文件路径
+        :param labels_path: 可选的标签 .npy 文件路径
+        :param start_id: 起始标签
+        :param index_type: 索引类型
+        :param offset: 只取 [offset, end) 行，回放 WAL 时使用
+        :param end: 同上，为空时取到文件末尾
+        :param checksum: 期望的 [offset, end) 行内容校验和，回放 WAL 时使用
+        :return: (vectors, labels) 内存映射数组
+        """
+        index = self.index_factory.get_index(index_type)
+        if not index:
+            raise ValueError(f"Index type {index_type} not initialized")
+        vectors = np.load(path, mmap_mode='r')
+        if vectors.ndim != 2 or not np.issubdtype(vectors.dtype, np.floating):
+            raise ValueError(f"{path} must hold a 2-D float matrix, got {vectors.dtype} with shape {vectors.shape}")
+        if vectors.shape[1] != index.dim:
+            raise ValueError(f"{path} has dimension {vectors.shape[1]} but the {index_type.value} index has "
+                             f"dimension {index.dim}")
+        if labels_path:
+            labels = np.load(labels_path, mmap_mode='r')
+            if labels.ndim != 1 or not np.issubdtype(labels.dtype, np.integer):
+                raise ValueError(f"{labels_path} must hold a 1-D integer array, got {labels.dtype} "
+                                 f"with shape {labels.shape}")
+            if len(labels) != vectors.shape[0]:
+                raise ValueError(f"Got {vectors.shape[0]} vectors but {len(labels)} labels")
+        else:
+            labels = np.arange(start_id, start_id + vectors.shape[0], dtype='int64')
+
+        end = vectors.shape[0] if end is None else end
+        if end > vectors.shape[0]:
+            raise RuntimeError(f"Bulk import file {path} has fewer than {end} rows, it changed after the import")
+        vectors, labels = vectors[offset:end], labels[offset:end]
+        if checksum is not None and self._chunk_checksum(vectors, labels) != checksum:
+            raise RuntimeError(f"Bulk import file {path} rows [{offset}, {end}) changed after the import")
+        return vectors, labels
+
+    @staticmethod
+    def _chunk_checksum(vectors: np.ndarray, labels: np.ndarray) -> int:
+        """
+        计算一块导入数据的 CRC32，WAL 只记录文件路径，回放时据此确认文件未被修改
+        :param vectors: (n, d) 向量矩阵
+        :param labels: 长度为 n 的标签数组
+        :return: CRC32
+        """
+        checksum = zlib.crc32(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        return zlib.crc32(np.ascontiguousarray(labels, dtype='int64').tobytes(), checksum)
+
+    def bulk_import(self, vectors: np.ndarray, labels: np.ndarray, index_type: IndexType,
+                    log_chunk: Optional[Callable[[int, int, int], None]] = None) -> int:
+        """
+        批量导入 (N, d) 矩阵：按块导入，每块单独持有写锁，块之间搜索和其他线程的写入可以进入；
+        HNSW 使用多线程 add_items 构建。整个导入在调用线程中执行，HTTP 接口通过 start_bulk_import
+        放到导入线程，不占用写线程池
+        :param vectors: (N, d) 向量矩阵，可以是内存映射数组
+        :param labels: 长度为 N 的标签数组，不应包含重复标签
+        :param index_type: 索引类型
+        :param log_chunk: 每块导入前在写锁内调用 log_chunk(start, end, checksum)，
+                          用于按块写 WAL，使日志顺序与并发写入的应用顺序一致
+        :return: 导入的向量数量
+        """
+        index = self.index_factory.get_index(index_type)
+        if not index:
+            raise ValueError(f"Index type {index_type} not initialized")
+        total = len(labels)
+        if vectors.shape[0] != total:
+            raise ValueError(f"Got {vectors.shape[0]} vectors but {total} labels")
+        if vectors.ndim != 2 or vectors.shape[1] != index.dim:
+            raise ValueError(f"Expected vectors of dimension {index.dim}, got shape {vectors.shape}")
+        self.bulk_import_progress = {"index_type": index_type.value, "state": "running", "done": 0, "total": total}
         try:
-            existing_data = self.scalar_storage.get_scalar(id)
+            self.materialize_index(index_type)
+            self._bulk_import_chunks(index, vectors, labels, index_type, log_chunk)
         except Exception:
-            existing_data = {}
+            self.bulk_import_progress["state"] = "failed"
+            raise
+        self.bulk_import_progress["state"] = "done"
+        logger.info(f"Bulk imported {total} vectors into {index_type.value}")
+        return total
 
-        # 如果存在现有向量，从索引中删除
-        if existing_data:
-            existing_vector = np.array(existing_data.get("vectors", []), dtype=np.float32)
-            
+    def _bulk_import_chunks(self, index, vectors: np.ndarray, labels: np.ndarray, index_type: IndexType,
+                            log_chunk: Optional[Callable[[int, int, int], None]]) -> None:
+        """
+        按块把已检查过的向量写入索引和存储，参数同 bulk_import
+        """
+        total = len(labels)
+
+        if index_type == IndexType.HNSW:
+            with self.rw_lock.write_lock():
+                index.reserve(total)
+
+        filter_index = self.index_factory.get_index(IndexType.FILTER)
+        for start in range(0, total, BULK_IMPORT_CHUNK_SIZE):
+            end = min(start + BULK_IMPORT_CHUNK_SIZE, total)
+            chunk_vectors = np.ascontiguousarray(vectors[start:end], dtype=np.float32)
+            chunk_labels = np.asarray(labels[start:end], dtype='int64').tolist()
+
+            with self.rw_lock.write_lock():
+                if log_chunk:
+                    log_chunk(start, end, self._chunk_checksum(chunk_vectors, chunk_labels))
+                existing_map = {id: data for id, data in
+                                zip(chunk_labels, self.scalar_storage.get_scalars(chunk_labels)) if data}
+
+                if index_type == IndexType.HNSW:
+                    index.insert_vectors_batch(chunk_vectors, chunk_labels, num_threads=BULK_IMPORT_THREADS)
+                else:
+                    if existing_map and index_type in IVF_INDEX_TYPES:
+                        index.remove_vectors(list(existing_map.keys()))
+                    index.insert_vectors_batch(chunk_vectors, chunk_labels)
+
+                if filter_index:
+                    filter_index.add_live_ids(chunk_labels)
+
+                # 已有记录保留标量字段，JSON 中原本带向量的同步替换；原始向量统一覆盖写入
+                updated = {}
+                for id, vector in zip(chunk_labels, chunk_vectors):
+                    if id in existing_map and "vectors" in existing_map[id]:
+                        updated[id] = {**existing_map[id], "vectors": vector.tolist(), "index_type": index_type.value}
+                self.scalar_storage.insert_scalars(updated)
+                self.scalar_storage.insert_vectors(chunk_labels, chunk_vectors, index_type.value,
+                                                   skip_records=existing_map.keys())
+            self.bulk_import_progress["done"] = end
+
+        if index_type in IVF_INDEX_TYPES:
+            with self.rw_lock.write_lock():
+                self._maybe_train_ivf(index_type, index)
+
+    def delete(self, ids: List[int], index_type: IndexType) -> int:
+        """
+        删除向量及其标量数据
+        :param ids: 向量ID列表
+        :param index_type: 索引类型
+        :return: 实际删除的数量
+        """
+        with self.rw_lock.write_lock():
             index = self.index_factory.get_index(index_type)
-            if index_type == IndexType.FLAT:
-                faiss_index = index
-                faiss_index.remove_vectors([id])
-            elif index_type == IndexType.HNSW:
-                hnsw_index = index
-                # HNSW 目前不支持删除操作
-                pass
-
-        # 插入新向量
-        new_vector = np.array(data["vectors"], dtype=np.float32)
+            if not index:
+                raise ValueError(f"Index type {index_type} not initialized")
+
+            ids = list(dict.fromkeys(ids))
+            count = sum(1 for existing in self.scalar_storage.get_scalars(ids) if existing)
+
+            # 回放 WAL 时标量存储可能已经删除，索引和过滤器不依赖标量数据删除
+            index.remove_vectors(ids)
+            filter_index = self.index_factory.get_index(IndexType.FILTER)
+            if filter_index:
+                filter_index.remove_ids(ids)
+
+            self.scalar_storage.delete_scalars(ids)
+
+            if index_type == IndexType.HNSW:
+                self._maybe_compact_hnsw(index)
+            return count
+
+    def _maybe_compact_hnsw(self, index: HNSWIndex) -> None:
+        """
+        墓碑超过阈值时提交后台重建任务，已有任务排队时不重复提交
+        :param index: HNSW 索引
+        """
+        if not index.needs_compaction(HNSW_COMPACT_MIN_TOMBSTONES, HNSW_COMPACT_TOMBSTONE_RATIO):
+            return
+        with self._maintenance_lock:
+            if self._compaction_pending:
+                return
+            self._compaction_pending = True
+        self.maintenance_pool.submit(self._run_compaction)
+
+    def _run_compaction(self) -> None:
+        """后台执行 HNSW 重建"""
+        try:
+            self.compact_index(IndexType.HNSW)
+        except Exception as e:
+            logger.error(f"Failed to compact HNSW index: {str(e)}")
+        finally:
+            with self._maintenance_lock:
+                self._compaction_pending = False
+
+    def _maybe_train_ivf(self, index_type: IndexType, index) -> None:
+        """
+        IVF 索引的向量数量达到 train_size 时提交后台训练任务，已有任务排队时不重复提交
+        :param index_type: IVF 索引类型
+        :param index: IVF 索引
+        """
+        if not index.needs_training() or index_type in self._training_pending:
+            return
+        logger.info(f"{index_type.value} reached {index.get_count()} vectors, training index in background")
+        self.start_training(index_type)
+
+    def start_training(self, index_type: IndexType) -> Future:
+        """
+        在维护线程中训练 IVF 索引，不占用处理写入的线程；同一索引已有任务排队或执行时返回该任务
+        :param index_type: IVF 索引类型
+        :return: 训练完成时完成的 Future
+        """
+        with self._maintenance_lock:
+            future = self._training_pending.get(index_type)
+            if future is None:
+                future = self.maintenance_pool.submit(self._run_training, index_type)
+                self._training_pending[index_type] = future
+            return future
+
+    def _run_training(self, index_type: IndexType) -> None:
+        """
+        后台训练 IVF 索引
+        :param index_type: IVF 索引类型
+        """
+        try:
+            self.train_index(index_type)
+        except Exception as e:
+            logger.error(f"Failed to train {index_type.value} index: {str(e)}")
+            raise
+        finally:
+            with self._maintenance_lock:
+                self._training_pending.pop(index_type, None)
+
+    def compact_index(self, index_type: IndexType) -> None:
+        """
+        用存活向量重建 HNSW 图并热切换：在读锁内复制索引并开始记录写入，
+        重建在副本上进行且不持有锁，写入和搜索照常进行；
+        写锁内只替换图并追平重建期间的写入和删除
+        :param index_type: 索引类型
+        """
+        if index_type != IndexType.HNSW:
+            raise ValueError(f"Index type {index_type} does not support compaction")
         index = self.index_factory.get_index(index_type)
-        # TODO: 检查index是否为空
-        index.insert_vectors(new_vector, id)
+        if not index:
+            raise ValueError(f"Index type {index_type} not initialized")
 
-        # 支持过滤索引
-        filter_index = self.index_factory.get_index(IndexType.FILTER)
-        if filter_index:
-            for field_name, value in data.items():
-                if isinstance(value, int) and field_name != "id":
-
-                    # 获取旧值（如果存在）
-                    old_value = None
-                    if existing_data and field_name in existing_data:
-                        old_value = existing_data[field_name]
-
-                    # 更新过滤器
-                    filter_index.update_int_field_filter(
-                        field_name=field_name,
-                        old_value=old_value,
-                        new_value=value,
-                        id=id
-                    )
-                    logger.error(f"id: {id}, field_name: {field_name}, value : {value}")
-    
-        # 更新标量存储
-        self.scalar_storage.insert_scalar(id, data)
+        with self._rebuild_lock:
+            with self.rw_lock.read_lock():
+                frozen = index.freeze()
+                index.start_tracking()
+            try:
+                rebuilt = frozen.rebuild()
+            except Exception:
+                with self.rw_lock.write_lock():
+                    index.stop_tracking()
+                raise
+            with self.rw_lock.write_lock():
+                index.swap(rebuilt, frozen.labels)
 
     def query(self, id: int) -> Dict[str, Any]:
         """
@@ -148,57 +624,399 @@ class VectorDatabase:
         :param json_request: 包含搜索参数的字典
         :return: (ids, distances) 元组
         """
-        # 从请求中获取查询参数
-        query = np.array(json_request.vectors, dtype=np.float32)
-        k = json_request.k
-
-        # 获取索引类型
-        index_type = IndexType.UNKNOWN
-        if json_request.index_type:
-            index_type_str = json_request.index_type
-            if index_type_str == IndexType.FLAT.value:
-                index_type = IndexType.FLAT
-            elif index_type_str == IndexType.HNSW.value:
-                index_type = IndexType.HNSW
-
-        # 处理过滤条件
-        filter_bitmap = None
-        if json_request.filter:
-            filter_data = json_request.filter
-            field_name = filter_data.fieldName
-            op_str = filter_data.op
-            value = filter_data.value
-
-            # 转换操作符
-            op = Operation.EQUAL if op_str == "=" else Operation.NOT_EQUAL
-
-            logger.error(f"op: {op}, field_name: {field_name}, value : {value}")
-
-            # 获取过滤索引并创建位图
-            filter_index = self.index_factory.get_index(IndexType.FILTER)
-            if filter_index:
-                filter_bitmap = filter_index.get_int_field_filter_bitmap(
-                    field_name, op, value
-                )
+        with self.rw_lock.read_lock():
+            # 从请求中获取查询参数
+            query = np.array(json_request.vectors, dtype=np.float32)
+            k = json_request.k
+
+            # 获取索引类型
+            index_type = self._get_index_type(json_request.index_type)
+
+            # 处理过滤条件
+            filter_bitmap = self._get_filter_bitmap(json_request.filter)
+
+            # 获取向量索引
+            index = self.index_factory.get_index(index_type)
+            if not index:
+                raise ValueError(f"Index type {index_type} not initialized")
 
-        # 获取向量索引
+            # 执行搜索
+            search_params = self._get_search_params(json_request, index_type)
+            match index_type:
+                case IndexType.FLAT | IndexType.HNSW | IndexType.IVF_FLAT | IndexType.IVF_PQ | IndexType.IVF_SQ8:
+                    ids, distances = self._search_with_rerank(index, query.reshape(1, -1), k, filter_bitmap,
+                                                              json_request.rerank_factor, **search_params)
+                case _:
+                    raise ValueError(f"Unsupported index type: {index_type}")
+
+            return ids[0], distances[0]
+
+    def search_batch(self, json_request: BatchSearchRequest) -> list[tuple[list[int], list[float]]]:
+        """
+        批量搜索向量，过滤条件相同的查询合并为一次矩阵搜索
+        :param json_request: 批量搜索请求
+        :return: 与查询一一对应的 (ids, distances) 元组列表
+        """
+        with self.rw_lock.read_lock():
+            queries = np.array(json_request.vectors, dtype=np.float32)
+            k = json_request.k
+            nq = len(json_request.vectors)
+
+            # 每个查询的过滤条件：优先使用 filters，否则使用共享的 filter
+            if json_request.filters is not None:
+                if len(json_request.filters) != nq:
+                    raise ValueError("The number of filters must match the number of query vectors")
+                filters = json_request.filters
+            else:
+                filters = [json_request.filter] * nq
+
+            index_type = self._get_index_type(json_request.index_type)
+            index = self.index_factory.get_index(index_type)
+            if not index:
+                raise ValueError(f"Index type {index_type} not initialized")
+            if index_type not in VECTOR_INDEX_TYPES:
+                raise ValueError(f"Unsupported index type: {index_type}")
+            search_params = self._get_search_params(json_request, index_type)
+
+            # 按过滤条件分组，每组只构建一次位图并执行一次搜索
+            groups: Dict[Any, List[int]] = {}
+            for i, filter_data in enumerate(filters):
+                groups.setdefault(self._get_filter_key(filter_data), []).append(i)
+
+            results: list[tuple[list[int], list[float]]] = [([], [])] * nq
+            for positions in groups.values():
+                filter_bitmap = self._get_filter_bitmap(filters[positions[0]])
+                ids, distances = self._search_with_rerank(index, queries[positions], k, filter_bitmap,
+                                                          json_request.rerank_factor, **search_params)
+                for position, row_ids, row_distances in zip(positions, ids, distances):
+                    results[position] = (row_ids, row_distances)
+
+            return results
+
+    def _search_with_rerank(self, index, queries: np.ndarray, k: int, filter_bitmap: Optional[BitMap],
+                            rerank_factor: Optional[int],
+                            **search_params: Any) -> tuple[list[list[int]], list[list[float]]]:
+        """
+        两阶段搜索：先在（量化）索引中取 k * rerank_factor 个候选，
+        再用存储的原始向量计算精确距离并取 top-k
+        :param index: 向量索引
+        :param queries: (nq, d) 查询矩阵
+        :param k: 每个查询返回的最近邻数量
+        :param filter_bitmap: 过滤位图
+        :param rerank_factor: 候选放大倍数，为空或不大于 1 时不重排
+        :param search_params: 传给索引的单次搜索参数
+        :return: (ids, distances) 元组，每个元素为 nq 个结果列表
+        """
+        if not rerank_factor or rerank_factor <= 1:
+            return self._execute_search(index, queries, k, filter_bitmap, **search_params)
+
+        search_k = min(k * rerank_factor, max(k, index.get_count()))
+        ids, _ = self._execute_search(index, queries, search_k, filter_bitmap, **search_params)
+
+        # 一次 multi-get 取回全部候选的原始向量，一次矩阵运算计算精确距离
+        candidate_ids = sorted({i for row_ids in ids for i in row_ids if i != -1})
+        found_ids, vectors = self.scalar_storage.get_vectors(candidate_ids)
+        if not found_ids:
+            return [[-1] * k for _ in ids], [[0.0] * k for _ in ids]
+        exact_distances, descending = index.exact_distances(queries, vectors)
+        columns = {id: column for column, id in enumerate(found_ids)}
+
+        all_ids, all_distances = [], []
+        for row, row_ids in enumerate(ids):
+            row_columns = np.array([columns[i] for i in row_ids if i in columns], dtype=np.int64)
+            row_distances = exact_distances[row, row_columns]
+            order = np.argsort(-row_distances if descending else row_distances, kind='stable')[:k]
+            result_ids = [found_ids[c] for c in row_columns[order].tolist()]
+            result_distances = row_distances[order].tolist()
+            all_ids.append(result_ids + [-1] * (k - len(result_ids)))
+            all_distances.append(result_distances + [0.0] * (k - len(result_distances)))
+
+        return all_ids, all_distances
+
+    def _execute_search(self, index, queries: np.ndarray, k: int, filter_bitmap: Optional[BitMap],
+                        **search_params: Any) -> tuple[list[list[int]], list[list[float]]]:
+        """
+        根据过滤位图的基数选择搜索策略并执行
+        :param index: 向量索引
+        :param queries: (nq, d) 查询矩阵
+        :param k: 每个查询返回的最近邻数量
+        :param filter_bitmap: 过滤位图
+        :param search_params: 传给索引的单次搜索参数（如 nprobe）
+        :return: (ids, distances) 元组，每个元素为 nq 个结果列表
+        """
+        candidate_count = len(filter_bitmap) if filter_bitmap is not None else None
+        index_count = index.get_count()
+        plan = self.query_planner.plan(candidate_count, index_count, k)
+
+        match plan:
+            case SearchPlan.NO_FILTER:
+                return index.search_vectors_batch(queries, k, None, **search_params)
+            case SearchPlan.BRUTE_FORCE:
+                return index.brute_force_search(queries, k, filter_bitmap)
+            case SearchPlan.POST_FILTER:
+                search_k = self.query_planner.post_filter_k(candidate_count, index_count, k)
+                ids, distances = index.search_vectors_batch(queries, search_k, None, **search_params)
+                all_ids, all_distances = [], []
+                for row_ids, row_distances in zip(ids, distances):
+                    hits = [(i, d) for i, d in zip(row_ids, row_distances) if i in filter_bitmap][:k]
+                    all_ids.append([i for i, _ in hits])
+                    all_distances.append([d for _, d in hits])
+
+                # 命中不足 k 个时回退到索引内过滤
+                if any(len(row_ids) < k for row_ids in all_ids) and search_k < index_count:
+                    logger.debug("Post filter returned fewer than k hits, falling back to in-index filter")
+                    return index.search_vectors_batch(queries, k, filter_bitmap, **search_params)
+                for row_ids, row_distances in zip(all_ids, all_distances):
+                    row_ids.extend([-1] * (k - len(row_ids)))
+                    row_distances.extend([0.0] * (k - len(row_distances)))
+                return all_ids, all_distances
+            case _:
+                return index.search_vectors_batch(queries, k, filter_bitmap, **search_params)
+
+    def _get_index_type(self, index_type_str: str) -> IndexType:
+        """
+        将索引类型字符串转换为 IndexType
+        :param index_type_str: 索引类型字符串
+        :return: 索引类型
+        """
+        for index_type in VECTOR_INDEX_TYPES:
+            if index_type_str == index_type.value:
+                return index_type
+        return IndexType.UNKNOWN
+
+    def _get_search_params(self, json_request: Union[SearchRequest, BatchSearchRequest],
+                           index_type: IndexType) -> Dict[str, Any]:
+        """
+        从请求中提取索引相关的单次搜索参数
+        :param json_request: 搜索请求
+        :param index_type: 索引类型
+        :return: 搜索参数字典
+        """
+        search_params: Dict[str, Any] = {}
+        if index_type in IVF_INDEX_TYPES and json_request.nprobe is not None:
+            search_params["nprobe"] = json_request.nprobe
+        if index_type == IndexType.HNSW and json_request.ef is not None:
+            search_params["ef_search"] = json_request.ef
+        return search_params
+
+    def _get_filter_key(self, filter_data: Optional[Union[FilterCondition, FilterExpression]]) -> Optional[str]:
+        """
+        生成过滤条件的规范化键，相同语义的条件得到相同的键
+        :param filter_data: 过滤条件或表达式
+        :return: 规范化键，没有过滤条件时返回 None
+        """
+        if filter_data is None:
+            return None
+        return json.dumps(filter_data.dict(), sort_keys=True, default=str)
+
+    def _get_filter_bitmap(
+        self,
+        filter_data: Optional[Union[FilterCondition, FilterExpression]]
+    ) -> Optional[BitMap]:
+        """
+        根据过滤条件创建位图，表达式通过位图的交、并、差运算求值
+        :param filter_data: 过滤条件或表达式
+        :return: 满足条件的位图，没有过滤条件时返回 None
+        """
+        if not filter_data:
+            return None
+
+        # 获取过滤索引
+        filter_index = self.index_factory.get_index(IndexType.FILTER)
+        if not filter_index:
+            return None
+        if isinstance(filter_data, FilterCondition):
+            return self._evaluate_filter(filter_index, filter_data, [])
+
+        # 表达式结果按规范化键缓存，单个条件由过滤索引内部缓存
+        key = self._get_filter_key(filter_data)
+        bitmap = filter_index.get_cached_bitmap(key)
+        if bitmap is None:
+            predicates: List[Predicate] = []
+            bitmap = self._evaluate_filter(filter_index, filter_data, predicates)
+            filter_index.cache_bitmap(key, bitmap, predicates, self._depends_on_live_ids(filter_data))
+        return bitmap
+
+    def _depends_on_live_ids(self, filter_data: Union[FilterCondition, FilterExpression]) -> bool:
+        """
+        判断过滤结果是否依赖存活ID位图（not 表达式或 not_exists 条件）
+        :param filter_data: 过滤条件或表达式
+        :return: 是否依赖
+        """
+        if isinstance(filter_data, FilterCondition):
+            return filter_data.op == "not_exists"
+        return filter_data.op == "not" or any(
+            self._depends_on_live_ids(condition) for condition in filter_data.conditions
+        )
+
+    def _evaluate_filter(self, filter_index, filter_data: Union[FilterCondition, FilterExpression],
+                         predicates: List[Predicate]) -> BitMap:
+        """
+        递归计算过滤条件对应的位图
+        :param filter_index: 过滤索引
+        :param filter_data: 过滤条件或表达式
+        :param predicates: 收集表达式中出现的谓词，用于缓存失效
+        :return: 结果位图
+        """
+        if isinstance(filter_data, FilterExpression):
+            bitmaps = [self._evaluate_filter(filter_index, condition, predicates)
+                       for condition in filter_data.conditions]
+            match filter_data.op:
+                case "and":
+                    return BitMap.intersection(*bitmaps) if bitmaps else BitMap()
+                case "or":
+                    return BitMap.union(*bitmaps) if bitmaps else BitMap()
+                case _:
+                    if len(bitmaps) != 1:
+                        raise ValueError("The 'not' filter expression takes exactly one condition")
+                    return filter_index.get_all_ids_bitmap() - bitmaps[0]
+
+        field_name = filter_data.fieldName
+        value = filter_data.value
+
+        # 转换操作符
+        match filter_data.op:
+            case "=":
+                op = Operation.EQUAL
+            case "!=":
+                op = Operation.NOT_EQUAL
+            case ">":
+                op = Operation.GREATER
+            case ">=":
+                op = Operation.GREATER_EQUAL
+            case "<":
+                op = Operation.LESS
+            case "<=":
+                op = Operation.LESS_EQUAL
+            case "exists":
+                op = Operation.EXISTS
+            case _:
+                op = Operation.NOT_EXISTS
+
+        logger.debug(f"op: {op}, field_name: {field_name}, value : {value}")
+
+        predicates.append((field_name, op, value))
+        return filter_index.get_int_field_filter_bitmap(field_name, op, value)
+
+    def train_index(self, index_type: IndexType) -> None:
+        """
+        训练 IVF 索引并热切换：在读锁内复制索引并开始记录写入，
+        训练和写入向量都在副本上进行且不持有锁；
+        写锁内只替换索引引用并追平训练期间的写入和删除。
+        训练样本和写入的向量取自标量存储中的原始向量，重复训练 PQ / SQ8 不会累积量化误差
+        :param index_type: IVF 索引类型
+        """
+        if index_type not in IVF_INDEX_TYPES:
+            raise ValueError(f"Index type {index_type} does not need training")
         index = self.index_factory.get_index(index_type)
         if not index:
             raise ValueError(f"Index type {index_type} not initialized")
 
-        # 执行搜索
-        match index_type:
-            case IndexType.FLAT:
-                results = index.search_vectors(query, k, filter_bitmap)
-            case IndexType.HNSW:
-                results = index.search_vectors(query, k, filter_bitmap)
-            case _:
-                raise ValueError(f"Unsupported index type: {index_type}")
+        with self._rebuild_lock:
+            with self.rw_lock.read_lock():
+                frozen = index.freeze()
+                index.start_tracking()
+            try:
+                load_original = self.scalar_storage.get_vectors
+                populated = frozen.populate(frozen.train(load_original=load_original), load_original)
+            except Exception:
+                with self.rw_lock.write_lock():
+                    index.stop_tracking()
+                raise
+            with self.rw_lock.write_lock():
+                index.swap(populated, self.scalar_storage.get_vectors)
 
-        return results
+    def take_snapshot(self) -> Dict[str, Any]:
+        """
+        保存快照并等待完成
+        :return: 快照任务状态
+        """
+        self.start_snapshot().result()
+        return self.snapshot_status
 
-    def take_snapshot(self):
+    def start_snapshot(self, trigger: str = "manual") -> Future:
         """
-        保存快照
+        启动后台快照：在读锁内封存 WAL 段并复制索引（阻塞写入但不阻塞搜索），
+        之后写入和搜索照常进行，后台线程保存索引副本。已有快照任务在运行时返回该任务。
+        复制是完整的内存拷贝：FLAT / IVF 的向量数据和 HNSW 的图各复制一份（内存映射加载
+        且未写入的索引直接共享），过滤位图也会复制，快照期间峰值内存约为索引大小的两倍
+        :param trigger: 触发原因 manual / wal_size / interval
+        :return: 快照完成时完成的 Future
         """
-        self.persistence.take_snapshot(self.scalar_storage)
\ No newline at end of file
+        with self._snapshot_lock:
+            if self._snapshot_future and not self._snapshot_future.done():
+                return self._snapshot_future
+
+            start = time.perf_counter()
+            with self.rw_lock.read_lock():
+                log_id = self.persistence.begin_snapshot()
+                frozen = self.index_factory.freeze()
+            self.snapshot_status = {
+                "state": "running",
+                "trigger": trigger,
+                "log_id": log_id,
+                "started_at": time.time(),
+                "freeze_ms": (time.perf_counter() - start) * 1000,
+                "progress": {"done": 0, "total": len(frozen), "current": None},
+            }
+            self._last_snapshot_time = time.time()
+            self._snapshot_future = self.snapshot_pool.submit(self._run_snapshot, log_id, frozen)
+            return self._snapshot_future
+
+    def _run_snapshot(self, log_id: int, frozen: Dict[IndexType, Any]) -> None:
+        """
+        后台保存索引副本
+        :param log_id: 快照对应的日志ID
+        :param frozen: 索引副本
+        """
+        status = self.snapshot_status
+        start = time.perf_counter()
+
+        def on_progress(done: int, total: int, index_type: Optional[IndexType]) -> None:
+            status["progress"] = {"done": done, "total": total,
+                                  "current": index_type.value if index_type else None}
+
+        try:
+            manifest = self.persistence.save_snapshot(log_id, self.scalar_storage, frozen, on_progress)
+            status["path"] = self.persistence.snapshot_dir
+            status["bytes"] = sum(entry["bytes"] for entry in manifest["files"])
+            status["state"] = "done"
+            logger.info(f"Snapshot at log id {log_id} finished in {time.perf_counter() - start:.3f}s")
+        except Exception as e:
+            status["state"] = "failed"
+            status["error"] = str(e)
+            logger.error(f"Failed to take snapshot: {str(e)}")
+            raise
+        finally:
+            status["finished_at"] = time.time()
+            status["seconds"] = time.perf_counter() - start
+
+    def start_snapshot_scheduler(self) -> None:
+        """启动自动快照线程，按 WAL 大小或时间间隔触发后台快照"""
+        if self._snapshot_scheduler or not (SNAPSHOT_WAL_MAX_BYTES or SNAPSHOT_INTERVAL_SECONDS):
+            return
+        self._snapshot_scheduler = threading.Thread(target=self._schedule_snapshots,
+                                                    name="lvdb-snapshot-scheduler", daemon=True)
+        self._snapshot_scheduler.start()
+
+    def stop_snapshot_scheduler(self) -> None:
+        """停止自动快照线程"""
+        self._scheduler_stop.set()
+        if self._snapshot_scheduler:
+            self._snapshot_scheduler.join()
+            self._snapshot_scheduler = None
+
+    def _schedule_snapshots(self) -> None:
+        """定期检查是否需要自动快照"""
+        while not self._scheduler_stop.wait(SNAPSHOT_CHECK_INTERVAL_SECONDS):
+            try:
+                if self._snapshot_future and not self._snapshot_future.done():
+                    continue
+                has_writes = self.persistence.get_id() > self.persistence.last_snapshot_id
+                if SNAPSHOT_WAL_MAX_BYTES and self.persistence.wal_bytes() >= SNAPSHOT_WAL_MAX_BYTES and has_writes:
+                    self.start_snapshot("wal_size")
+                elif SNAPSHOT_INTERVAL_SECONDS and has_writes and \
+                        time.time() - self._last_snapshot_time >= SNAPSHOT_INTERVAL_SECONDS:
+                    self.start_snapshot("interval")
+            except Exception as e:
+                logger.error(f"Failed to start scheduled snapshot: {str(e)}")
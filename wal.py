@@ -0,0 +1,276 @@
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+import logging as logger
+from concurrent.futures import Future
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from constants import Durability
+
+
+# 二进制 WAL 文件头，用于区分旧版文本 WAL
+WAL_MAGIC = b"LVWAL01\n"
+
+# 记录头：payload 长度、payload 的 CRC32
+RECORD_HEADER = struct.Struct("<II")
+# payload 固定部分：log_id、操作类型长度、版本长度、向量类型、JSON 长度
+PAYLOAD_HEADER = struct.Struct("<QBBBI")
+# 向量矩阵头：行数、维度
+VECTORS_HEADER = struct.Struct("<II")
+
+# 向量类型：无向量、单条记录的 vectors、批量记录中每条的 vectors
+VECTORS_NONE = 0
+VECTORS_SINGLE = 1
+VECTORS_BATCH = 2
+
+
+def _split_vectors(data: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Optional[np.ndarray]]:
+    """
+    从请求数据中拆出向量，向量以 float32 原始字节存储，不再经过 JSON 编码
+    :param data: 请求数据
+    :return: (向量类型, 去掉向量后的数据, (n, d) 向量矩阵)
+    """
+    if isinstance(data.get("vectors"), list):
+        vectors = np.asarray(data["vectors"], dtype=np.float32)
+        if vectors.ndim == 1:
+            rest = {key: value for key, value in data.items() if key != "vectors"}
+            return VECTORS_SINGLE, rest, vectors.reshape(1, -1)
+
+    records = data.get("records")
+    if isinstance(records, list) and records and all(isinstance(record.get("vectors"), list) for record in records):
+        dims = {len(record["vectors"]) for record in records}
+        if len(dims) == 1:
+            vectors = np.asarray([record["vectors"] for record in records], dtype=np.float32)
+            rest = {**data, "records": [{key: value for key, value in record.items() if key != "vectors"}
+                                        for record in records]}
+            return VECTORS_BATCH, rest, vectors
+
+    return VECTORS_NONE, data, None
+
+
+def encode_record(log_id: int, version: str, operation_type: str, data: Dict[str, Any]) -> bytes:
+    """
+    编码一条 WAL 记录：[长度][CRC32][log_id, 操作类型, 版本, JSON, float32 向量]
+    :param log_id: 日志ID
+    :param version: 版本信息
+    :param operation_type: 操作类型
+    :param data: 请求数据
+    :return: 记录字节
+    """
+    kind, rest, vectors = _split_vectors(data)
+    op_bytes = operation_type.encode("utf-8")
+    version_bytes = version.encode("utf-8")
+    json_bytes = json.dumps(rest).encode("utf-8")
+
+    parts = [PAYLOAD_HEADER.pack(log_id, len(op_bytes), len(version_bytes), kind, len(json_bytes)),
+             op_bytes, version_bytes, json_bytes]
+    if vectors is not None:
+        parts.append(VECTORS_HEADER.pack(*vectors.shape))
+        parts.append(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+    payload = b"".join(parts)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_payload(payload: bytes) -> Tuple[int, str, str, Dict[str, Any]]:
+    """
+    解码 payload
+    :param payload: 已通过 CRC 校验的 payload
+    :return: (log_id, version, operation_type, data)
+    """
+    log_id, op_len, version_len, kind, json_len = PAYLOAD_HEADER.unpack_from(payload)
+    offset = PAYLOAD_HEADER.size
+    operation_type = payload[offset:offset + op_len].decode("utf-8")
+    offset += op_len
+    version = payload[offset:offset + version_len].decode("utf-8")
+    offset += version_len
+    data = json.loads(payload[offset:offset + json_len])
+    offset += json_len
+
+    if kind != VECTORS_NONE:
+        n, dim = VECTORS_HEADER.unpack_from(payload, offset)
+        offset += VECTORS_HEADER.size
+        vectors = np.frombuffer(payload, dtype=np.float32, count=n * dim, offset=offset).reshape(n, dim)
+        if kind == VECTORS_SINGLE:
+            data["vectors"] = vectors[0].tolist()
+        else:
+            for record, vector in zip(data["records"], vectors.tolist()):
+                record["vectors"] = vector
+    return log_id, version, operation_type, data
+
+
+def segment_path(wal_path: str, seq: int) -> str:
+    """
+    WAL 段文件路径，例如 wal.log.00000001
+    :param wal_path: WAL 基础路径
+    :param seq: 段序号
+    :return: 段文件路径
+    """
+    return f"{wal_path}.{seq:08d}"
+
+
+def list_segments(wal_path: str) -> List[Tuple[int, str]]:
+    """
+    列出磁盘上的 WAL 段
+    :param wal_path: WAL 基础路径
+    :return: 按序号排列的 (段序号, 段文件路径)
+    """
+    folder = os.path.dirname(wal_path) or "."
+    pattern = re.compile(rf"^{re.escape(os.path.basename(wal_path))}\.(\d{{8}})$")
+    segments = []
+    for name in os.listdir(folder):
+        match = pattern.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(folder, name)))
+    return sorted(segments)
+
+
+def is_binary_segment(path: str) -> bool:
+    """
+    是否为二进制 WAL 段（否则是旧版文本 WAL）
+    :param path: 段文件路径
+    :return: 文件头是否为 WAL_MAGIC
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(WAL_MAGIC)) == WAL_MAGIC
+
+
+def read_records(file: BinaryIO) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    从文件当前位置顺序读取记录，遇到不完整或 CRC 不匹配的记录时停止（崩溃时写了一半的尾部）
+    :param file: 二进制文件，位于文件头之后
+    :return: (记录起始偏移, 记录结束偏移, payload) 迭代器
+    """
+    while True:
+        start = file.tell()
+        header = file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = file.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            logger.warning(f"Truncated or corrupted WAL record at offset {start}, ignoring the rest")
+            return
+        yield start, file.tell(), payload
+
+
+class GroupCommitWriter:
+    """
+    WAL 组提交：append 只把记录放入队列，后台线程把排队的记录合并为一次 write，
+    同一组中只要有记录要求 fsync 就整体 fsync 一次。
+    每条记录按自己的持久化级别完成对应的 Future。
+    """
+
+    def __init__(self, file: BinaryIO, window_ms: float = 0):
+        """
+        初始化并启动后台写线程
+        :param file: 以追加模式打开的二进制 WAL 文件
+        :param window_ms: 收到第一条记录后额外等待的时间（毫秒），用于攒更大的组
+        """
+        self.file = file
+        self.window = window_ms / 1000.0
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[bytes, Durability, Future]] = []
+        self._closed = False
+
+        # 统计信息
+        self.groups = 0
+        self.records = 0
+        self.fsyncs = 0
+        self.bytes_written = 0
+
+        self._thread = threading.Thread(target=self._run, name="lvdb-wal-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, record: bytes, durability: Durability) -> Future:
+        """
+        追加一条记录。调用方需保证并发 append 的顺序即日志顺序（在写锁内调用）
+        :param record: encode_record 编码后的记录
+        :param durability: 持久化级别
+        :return: 记录达到该持久化级别时完成的 Future
+        """
+        future: Future = Future()
+        # 入队前完成，否则后台线程可能先完成它
+        if durability == Durability.NONE:
+            future.set_result(None)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("WAL writer is closed")
+            self._queue.append((record, durability, future))
+            self._cond.notify()
+        return future
+
+    def sync(self) -> None:
+        """等待此前追加的全部记录写入并 fsync"""
+        self.append(b"", Durability.FSYNC).result()
+
+    def _run(self) -> None:
+        """后台写线程：取出整组记录，一次 write + flush，按需 fsync"""
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue and self._closed:
+                    return
+            if self.window:
+                time.sleep(self.window)
+            with self._cond:
+                group, self._queue = self._queue, []
+
+            try:
+                data = b"".join(record for record, _, _ in group)
+                if data:
+                    self.file.write(data)
+                self.file.flush()
+                if any(durability == Durability.FSYNC for _, durability, _ in group):
+                    os.fsync(self.file.fileno())
+                    self.fsyncs += 1
+                # sync() 追加的空记录不计入组数
+                records = sum(1 for record, _, _ in group if record)
+                self.groups += 1 if records else 0
+                self.records += records
+                self.bytes_written += len(data)
+                for _, _, future in group:
+                    if not future.done():
+                        future.set_result(None)
+            except Exception as e:
+                logger.error(f"Failed to write WAL group: {str(e)}")
+                for _, _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def switch_file(self, file: BinaryIO) -> BinaryIO:
+        """
+        切换写入的文件（WAL 分段）。调用方需保证切换期间没有并发 append（在写锁内调用）
+        :param file: 新的段文件
+        :return: 旧的段文件，其中的记录已全部写入并 fsync
+        """
+        self.sync()
+        with self._cond:
+            old_file, self.file = self.file, file
+        return old_file
+
+    def close(self) -> None:
+        """写完队列中的记录后停止后台线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self) -> dict:
+        """
+        获取组提交统计信息
+        :return: 统计信息字典
+        """
+        return {
+            "groups": self.groups,
+            "records": self.records,
+            "avg_group_size": self.records / self.groups if self.groups else 0.0,
+            "fsyncs": self.fsyncs,
+            "bytes_written": self.bytes_written,
+        }